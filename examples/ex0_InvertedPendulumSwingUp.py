@@ -5,6 +5,7 @@ PyTrajectory as well as its visualisation capabilities.
 
 # import all we need for solving the problem
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 import numpy as np
 from sympy import cos, sin
 from numpy import pi
@@ -14,6 +15,9 @@ import sys
 import matplotlib as mpl
 from pytrajectory.visualisation import Animation
 
+# print the messages of the solution process
+enable_console()
+
 # first, we define the function that returns the vectorfield
 def f(x,u):
     x1, x2, x3, x4 = x  # system variables
@@ -2,9 +2,13 @@
 
 # import trajectory class and necessary dependencies
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 from sympy import cos, sin
 import numpy as np
 
+# print the messages of the solution process
+enable_console()
+
 # define the function that returns the vectorfield
 def f(x,u):
 	x1, x2, x3, x4, x5, x6 = x  # system variables
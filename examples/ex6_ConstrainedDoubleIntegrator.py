@@ -3,8 +3,12 @@ This example of the double integrator demonstrates how to pass constraints to Py
 '''
 # imports
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 import numpy as np
 
+# print the messages of the solution process
+enable_console()
+
 # define the vectorfield
 def f(x,u):
     x1, x2 = x
@@ -4,9 +4,13 @@ This example of the inverted pendulum demonstrates how to handle possible state
 
 # import all we need for solving the problem
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 import numpy as np
 from sympy import cos, sin
 
+# print the messages of the solution process
+enable_console()
+
 # first, we define the function that returns the vectorfield
 def f(x,u):
     x1, x2, x3, x4 = x  # system variables
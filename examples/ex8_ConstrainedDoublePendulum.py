@@ -2,6 +2,7 @@
 
 # import all we need for solving the problem
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 import numpy as np
 import sympy as sp
 from sympy import cos, sin, Matrix
@@ -11,6 +12,9 @@ from numpy import pi
 # to define a callable function that returns the vectorfield
 # we first solve the motion equations of form Mx = B
 
+# print the messages of the solution process
+enable_console()
+
 def solve_motion_equations(M, B, state_vars=[], input_vars=[], parameters_values=dict()):
     '''
     Solves the motion equations given by the mass matrix and right hand side
@@ -2,6 +2,7 @@
 
 # import all we need for solving the problem
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 
 import numpy as np
 import sympy as sp
@@ -9,6 +10,9 @@ import sympy as sp
 from sympy import cos, sin
 from numpy import pi
 
+# print the messages of the solution process
+enable_console()
+
 def n_bar_pendulum(N=1, param_values=dict()):
     '''
     Returns the mass matrix :math:`M` and right hand site :math:`B` of motion equations
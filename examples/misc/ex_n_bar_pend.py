@@ -2,13 +2,18 @@
 
 # import all we need for solving the problem
 from pytrajectory import ControlSystem
+from pytrajectory.log import enable_console
 import numpy as np
 import sympy as sp
 from sympy import cos, sin
 from numpy import pi
+import sys
 
 from IPython import embed as IPS
 
+# print the messages of the solution process
+enable_console()
+
 
 def n_bar_pendulum(N=1, param_values=dict()):
     '''
@@ -302,6 +307,59 @@ def f(x, u):
     # now we have defined a callable function that can be used within PyTrajectory
     return f
 
+def mass_matrix_system(M, B, state_vars=[], input_vars=[]):
+    '''
+    Creates callable functions for the mass matrix and the right hand side of
+    the motion equations in the state space that can be passed to PyTrajectory
+    (via the keyword argument `mass_matrix`) without solving them symbolically.
+    
+    The state variables are expected to be ordered like `q0, dq0, q1, dq1, ...`.
+    
+    Parameters
+    ----------
+    
+    M, B, state_vars, input_vars
+        See :py:func:`solve_motion_equations`
+    
+    Returns
+    -------
+    
+    callable
+        The right hand side `F(x, u)`.
+    
+    callable
+        The mass matrix `MM(x)` with `MM(x) * dx/dt = F(x, u)`.
+    '''
+    
+    n = len(state_vars)
+    
+    def F(x, u):
+        # (PyTrajectory determines the number of inputs by calling
+        #  this function until the dimensions match)
+        if len(x) != n or len(u) != len(input_vars):
+            raise ValueError("Dimension mismatch")
+        
+        subs = dict(zip(state_vars + input_vars, list(x) + list(u)))
+        
+        ff = []
+        for i in xrange(n/2):
+            ff.append(x[2*i+1])
+            ff.append(sp.sympify(B[i]).xreplace(subs))
+        
+        return ff
+    
+    def MM(x):
+        subs = dict(zip(state_vars, x))
+        
+        mm = sp.eye(n)
+        for i in xrange(n/2):
+            for j in xrange(n/2):
+                mm[2*i+1, 2*j+1] = sp.sympify(M[i,j]).xreplace(subs)
+        
+        return mm
+    
+    return F, MM
+
 if __name__=='__main__':
     N = 3
     
@@ -326,11 +384,15 @@ if __name__=='__main__':
     
     # get matrices of motion equations
     print "Get matrices of motion equations"
-    M, B, state_vars, input_vars = N_Bar_Pendulum(N=N, param_values=param_values)
+    M, B, state_vars, input_vars = n_bar_pendulum(N=N, param_values=param_values)
     
     # get callable function for vectorfield that can be used with PyTrajectory
     print "Get callable vectorfield"
-    f = solve_motion_equations(M, B, state_vars, input_vars)
+    if 'mass_matrix' in sys.argv:
+        # leave the motion equations implicit (much faster for many bars)
+        f, MM = mass_matrix_system(M, B, state_vars, input_vars)
+    else:
+        f = solve_motion_equations(M, B, state_vars, input_vars)
     
     # then we specify all boundary conditions
     a = 0.0
@@ -347,14 +409,17 @@ if __name__=='__main__':
            1 : [-5.0, 5.0]}
     
     # now we create our Trajectory object and alter some method parameters via the keyword arguments
-    S = ControlSystem(f, a, b, xa, xb, ua, ub, constraints=con, eps=4e-1, su=20, kx=2, use_chains=False)
+    if 'mass_matrix' in sys.argv:
+        # (constraints are not supported for implicit motion equations)
+        S = ControlSystem(f, a, b, xa, xb, ua, ub, mass_matrix=MM, eps=4e-1, su=20, kx=2, use_chains=False)
+    else:
+        S = ControlSystem(f, a, b, xa, xb, ua, ub, constraints=con, eps=4e-1, su=20, kx=2, use_chains=False)
     
     # time to run the iteration
     x, u = S.solve()
     
     # the following code provides an animation of the system above
     # for a more detailed explanation have a look at the 'Visualisation' section in the documentation
-    import sys
     import matplotlib as mpl
     from pytrajectory.visualisation import Animation
     
@@ -6,13 +6,11 @@ PyTrajectory is a Python library for the determination of the feed forward contr
 to achieve a transition between desired states of a nonlinear control system.
 '''
 
-from system import ControlSystem
-from trajectories import Trajectory
-from splines import Spline
-from solver import Solver
-from simulation import Simulator
-from visualisation import Animation
-from log import logging
+import sys
+import types
+import importlib
+
+from log import logger
 
 # current version
 __version__ = '1.2.0'
@@ -23,22 +21,67 @@ __date__ = "2016-01-15 14:12:08"
 # `__date__` contains the date and time of the latest commit
 # (will be altered with every commit using git's pre-commit hook)
 
-# check versions of dependencies
-import numpy
-import scipy
-import sympy
+# the public classes (and the modules) are imported on first access, so that
+# the modules that only depend on numpy (e.g. `results`) can be imported
+# without sympy, scipy and matplotlib
+_lazy_attributes = {'ControlSystem' : 'system',
+                    'Trajectory' : 'trajectories',
+                    'Spline' : 'splines',
+                    'Solver' : 'solver',
+                    'Simulator' : 'simulation',
+                    'Animation' : 'visualisation'}
 
-np_info = numpy.__version__.split('.')
-scp_info = scipy.__version__.split('.')
-sp_info = sympy.__version__.split('.')
+_submodules = {'auxiliary', 'batch', 'collocation', 'log', 'results', 'simulation',
+               'solver', 'splines', 'system', 'trajectories', 'visualisation'}
 
-if not (int(np_info[0]) >= 1 and int(np_info[1]) >= 8):
-    logging.warning('numpy version ({}) may be out of date'.format(numpy.__version__))
-if not (int(scp_info[0]) >= 0 and int(scp_info[1]) >= 13 and int(scp_info[2][0]) >= 0):
-    logging.warning('scipy version ({}) may be out of date'.format(scipy.__version__))
-if not (int(sp_info[0]) >= 0 and int(sp_info[1]) >= 7 and int(sp_info[2][0]) >= 5):
-    logging.warning('sympy version ({}) may be out of date'.format(sympy.__version__))
+def _check_versions():
+    '''
+    Checks the versions of the dependencies (once).
+    '''
+    if _check_versions.done:
+        return
+    _check_versions.done = True
+    
+    import numpy
+    import scipy
+    import sympy
+    
+    np_info = numpy.__version__.split('.')
+    scp_info = scipy.__version__.split('.')
+    sp_info = sympy.__version__.split('.')
+    
+    if not (int(np_info[0]) >= 1 and int(np_info[1]) >= 8):
+        logger.warning('numpy version ({}) may be out of date'.format(numpy.__version__))
+    if not (int(scp_info[0]) >= 0 and int(scp_info[1]) >= 13 and int(scp_info[2][0]) >= 0):
+        logger.warning('scipy version ({}) may be out of date'.format(scipy.__version__))
+    if not (int(sp_info[0]) >= 0 and int(sp_info[1]) >= 7 and int(sp_info[2][0]) >= 5):
+        logger.warning('sympy version ({}) may be out of date'.format(sympy.__version__))
 
-# log information about current version
-logging.debug('This is PyTrajectory version {} of {}'.format(__version__, __date__))
+_check_versions.done = False
+
+class _LazyPackage(types.ModuleType):
+    '''
+    The package module, which imports the public classes on first access.
+    '''
+    def __getattr__(self, name):
+        if name in _lazy_attributes:
+            _check_versions()
+            module = importlib.import_module(__name__ + '.' + _lazy_attributes[name])
+            value = getattr(module, name)
+        elif name in _submodules:
+            value = importlib.import_module(__name__ + '.' + name)
+        else:
+            raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+        
+        setattr(self, name, value)
+        return value
 
+# replace this module by the lazy one
+# (the original one has to be kept, otherwise python 2 clears its globals)
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+_package._original_module = sys.modules[__name__]
+sys.modules[__name__] = _package
+
+# log information about current version
+logger.debug('This is PyTrajectory version {} of {}'.format(__version__, __date__))
@@ -1,17 +1,22 @@
 # IMPORTS
 import numpy as np
 import sympy as sp
+from scipy import sparse
 from sympy.utilities.lambdify import _get_namespace
+from sympy.printing.lambdarepr import LambdaPrinter, NumExprPrinter
+import __future__
+import multiprocessing
 import time
 
-from log import logging, Timer
+from log import logger, Timer
 
 class IntegChain(object):
     '''
     This class provides a representation of an integrator chain.
     
     For the elements :math:`(x_i)_{i=1,...,n}` of the chain the relation
-    :math:`\dot{x}_i = x_{i+1}` applies.
+    :math:`\dot{x}_i = x_{i+1}` applies, or more generally the affine relation
+    :math:`\dot{x}_i = k_i x_{i+1} + c_i` with constant coefficients.
     
     Parameters
     ----------
@@ -19,6 +24,10 @@ class IntegChain(object):
     lst : list
         Ordered list of the integrator chain's elements.
     
+    coeffs : list
+        The coefficients :math:`(k_i, c_i)` of the relations between
+        consecutive elements (default: all :math:`(1, 0)`).
+    
     Attributes
     ----------
     
@@ -32,7 +41,7 @@ class IntegChain(object):
         Lower end of the integrator chain
     '''
     
-    def __init__(self, lst):
+    def __init__(self, lst, coeffs=None):
         # check if elements are sympy.Symbol's or already strings
         elements = []
         for elem in lst:
@@ -45,6 +54,10 @@ class IntegChain(object):
                                  sympy.Symbol's or string objects!")
                                  
         self._elements = tuple(elements)
+        
+        if coeffs is None:
+            coeffs = [(1.0, 0.0)] * (len(elements) - 1)
+        self._coeffs = tuple((float(k), float(c)) for k, c in coeffs)
     
     def __len__(self):
         return len(self._elements)
@@ -83,9 +96,22 @@ class IntegChain(object):
         which has no derivative in the integrator chain.
         '''
         return self._elements[-1]
+    
+    @property
+    def transforms(self):
+        '''
+        Returns the scale :math:`\\alpha_i` and the offset :math:`\\beta_i` of every element
+        with respect to the derivatives of the upper end :math:`x_1`, i.e.
+        :math:`x_i = \\alpha_i x_1^{(i-1)} + \\beta_i`.
+        '''
+        transforms = [(1.0, 0.0)]
+        for k, c in self._coeffs:
+            scale = transforms[-1][0]
+            transforms.append((scale / k, -c / k if c else 0.0))
+        return transforms
 
 
-def find_integrator_chains(dyn_sys):
+def find_integrator_chains(model):
     '''
     Searches for integrator chains in given vector field matrix `fi`,
     i.e. equations of the form :math:`\dot{x}_i = x_j`.
@@ -93,8 +119,8 @@ def find_integrator_chains(dyn_sys):
     Parameters
     ----------
     
-    dyn_sys : pytrajectory.system.DynamicalSystem
-        Instance of a dynamical system
+    model : pytrajectory.system.SymbolicModel
+        The symbolic model of a dynamical system
     
     Returns
     -------
@@ -107,31 +133,84 @@ def find_integrator_chains(dyn_sys):
     '''
 
     # next, we look for integrator chains
-    logging.debug("Looking for integrator chains")
+    logger.debug("Looking for integrator chains")
 
     # create symbolic variables to find integrator chains
-    state_sym = sp.symbols(dyn_sys.states)
-    input_sym = sp.symbols(dyn_sys.inputs)
-    f = dyn_sys.f_sym(state_sym, input_sym)
+    state_sym = sp.symbols(model.states)
+    input_sym = sp.symbols(model.inputs)
+    f = model.f
     
-    assert dyn_sys.n_states == len(f)
+    assert model.n_states == len(f)
     
     chaindict = {}
+    coeffdict = {}
     for i in xrange(len(f)):
-        # substitution because of sympy difference betw. 1.0 and 1
-        if isinstance(f[i], sp.Basic):
-            f[i] = f[i].subs(1.0, 1)
+        fi = f[i]
+        
+        # sympy distinguishes between 1.0 and 1, so an equation like `1.0*x2`
+        # has to be recognized, too (without substituting in the whole expression)
+        if isinstance(fi, sp.Basic):
+            coeff, rest = fi.as_coeff_Mul()
+            if coeff == 1:
+                fi = rest
 
+        # (a later relation of the same variable replaces an earlier one
+        #  together with its coefficients)
         for xx in state_sym:
-            if f[i] == xx:
+            if fi == xx:
                 chaindict[xx] = state_sym[i]
+                coeffdict.pop(xx, None)
 
         for uu in input_sym:
-            if f[i] == uu:
+            if fi == uu:
                 chaindict[uu] = state_sym[i]
+                coeffdict.pop(uu, None)
+        
+        # affine relations like `k*x2 + c` with constant coefficients
+        if isinstance(fi, sp.Basic) and not fi.is_Symbol and len(fi.free_symbols) == 1:
+            vv = fi.free_symbols.pop()
+            k = fi.diff(vv)
+            
+            if vv in state_sym + input_sym and k.is_Number and k != 0:
+                c = sp.expand(fi - k*vv)
+                if c.is_Number:
+                    chaindict[vv] = state_sym[i]
+                    coeffdict[vv] = (float(k), float(c))
 
+    return assemble_integrator_chains(chaindict, model, coeffdict)
+
+def assemble_integrator_chains(chaindict, model, coeffdict=None):
+    '''
+    Creates the integrator chains from the relations between the variables
+    of a vector field.
+    
+    Parameters
+    ----------
+    
+    chaindict : dict
+        Maps a variable (symbol or name) to the state variable it is the derivative of
+    
+    model : pytrajectory.system.SymbolicModel
+        The model of the dynamical system
+    
+    coeffdict : dict
+        Maps a variable to the coefficients `(k, c)` of an affine relation
+        (the others are plain derivatives)
+    
+    Returns
+    -------
+    
+    list
+        Found integrator chains.
+    
+    list
+        Indices of the equations that have to be solved using collocation.
+    '''
+    
     # chaindict looks like this:  {u_1 : x_2, x_4 : x_3, x_2 : x_1}
     # where x_4 = d/dt x_3 and so on
+    if coeffdict is None:
+        coeffdict = {}
 
     # find upper ends of integrator chains
     uppers = []
@@ -148,47 +227,176 @@ def find_integrator_chains(dyn_sys):
 
     for var in uppers:
         tmpchain = []
+        tmpcoeffs = []
         vv = var
         tmpchain.append(vv)
 
         while dictchain.has_key(vv):
             vv = dictchain[vv]
             tmpchain.append(vv)
+            tmpcoeffs.append(coeffdict.get(vv, (1.0, 0.0)))
 
-        tmpchains.append(tmpchain)
+        tmpchains.append((tmpchain, tmpcoeffs))
 
     # create an integrator chain object for every temporary chain
     chains = []
-    for lst in tmpchains:
-        ic = IntegChain(lst)
+    for lst, coeffs in tmpchains:
+        ic = IntegChain(lst, coeffs)
         chains.append(ic)
-        logging.debug("--> found: " + str(ic))
+        logger.debug("--> found: " + str(ic))
     
     # now we determine the equations that have to be solved by collocation
-    # (--> lower ends of integrator chains)
+    # (--> lower ends of integrator chains and all state variables
+    #      that are not part of any chain, e.g. because of constraints)
     eqind = []
     
     if chains:
-        # iterate over all integrator chains
+        # the equations of all other chain elements are fulfilled
+        # by construction of the splines
+        in_chain = set()
         for ic in chains:
-            # if lower end is a system variable
-            # then its equation has to be solved
-            if ic.lower.startswith('x'):
-                idx = dyn_sys.states.index(ic.lower)
-                eqind.append(idx)
-        eqind.sort()
+            in_chain.update(ic.elements[:-1])
+        
+        eqind = [i for i, xx in enumerate(model.states) if xx not in in_chain]
         
         # if every integrator chain ended with input variable
         if not eqind:
-            eqind = range(dyn_sys.n_states)
+            eqind = range(model.n_states)
     else:
         # if integrator chains should not be used
         # then every equation has to be solved by collocation
-        eqind = range(dyn_sys.n_states)
+        eqind = range(model.n_states)
     
     return chains, eqind
 
-def sym2num_vectorfield(f_sym, x_sym, u_sym, vectorized=False, cse=False):
+def numeric_jacobian(fnc, X, U, cols, method='central', f0=None):
+    '''
+    Approximates the derivatives of a vectorized function with respect to some
+    of its variables in many points at once.
+    
+    All perturbed points are stacked side by side, so `fnc` is called only
+    once (twice for central differences) no matter how many points and
+    variables there are.
+    
+    Parameters
+    ----------
+    
+    fnc : callable
+        Vectorized function `fnc(X, U)` returning an array of shape `(m, n_pts)`
+    
+    X, U : numpy.ndarray
+        Values of the state and input variables (one column per point)
+    
+    cols : array_like
+        Indices of the variables (in `[x, u]`) to differentiate with respect to
+    
+    method : str
+        One of 'forward', 'central' (finite differences) or 'complex_step'
+        (exact up to rounding errors but requires `fnc` to accept complex arguments)
+    
+    f0 : numpy.ndarray
+        Value of `fnc(X, U)` if already known (only used by forward differences)
+    
+    Returns
+    -------
+    
+    numpy.ndarray
+        The derivatives with shape `(m, len(cols), n_pts)`
+    '''
+    
+    n_states = X.shape[0]
+    n_pts = X.shape[1]
+    cols = np.asarray(cols, dtype=int)
+    
+    Z = np.vstack((X, U)).astype(float)
+    
+    # one copy of all points for every variable,
+    # only the values of that variable get perturbed
+    ZZ = np.tile(Z, (1, cols.size)).reshape((Z.shape[0], cols.size, n_pts))
+    z = ZZ[cols, np.arange(cols.size)]
+    
+    def evaluate(ZZ):
+        ZZ = ZZ.reshape((Z.shape[0], -1))
+        return fnc(ZZ[:n_states], ZZ[n_states:]).reshape((-1, cols.size, n_pts))
+    
+    if method == 'complex_step':
+        h = 1e-20
+        ZZ = ZZ.astype(complex)
+        ZZ[cols, np.arange(cols.size)] += 1j * h
+        return evaluate(ZZ).imag / h
+    
+    # steps that are exactly representable in floating point arithmetic
+    eps = np.finfo(float).eps
+    step = np.sqrt(eps) if method == 'forward' else eps**(1.0/3)
+    h = (z + step * np.maximum(1.0, np.abs(z))) - z
+    
+    if method == 'forward':
+        if f0 is None:
+            f0 = fnc(X, U)
+        
+        ZZ[cols, np.arange(cols.size)] = z + h
+        return (evaluate(ZZ) - np.asarray(f0).reshape((-1, 1, n_pts))) / h
+    elif method == 'central':
+        ZZ[cols, np.arange(cols.size)] = z + h
+        F_plus = evaluate(ZZ)
+        ZZ[cols, np.arange(cols.size)] = z - h
+        return (F_plus - evaluate(ZZ)) / (2 * h)
+    else:
+        raise ValueError("Unknown differentiation method: {}".format(method))
+
+def color_columns(pattern):
+    '''
+    Groups the columns of a sparse matrix such that no two columns of a group
+    have a nonzero entry in the same row (greedy Curtis-Powell-Reed coloring).
+    
+    All columns of a group can be perturbed at once when approximating
+    the matrix by finite differences.
+    
+    Parameters
+    ----------
+    
+    pattern : scipy.sparse.spmatrix
+        Matrix whose nonzero entries define the structure
+    
+    Returns
+    -------
+    
+    numpy.ndarray
+        The group ("color") of every column
+    
+    int
+        The number of groups
+    '''
+    
+    pattern = sparse.csc_matrix(pattern)
+    pattern.eliminate_zeros()
+    
+    n_rows, n_cols = pattern.shape
+    indices, indptr = pattern.indices, pattern.indptr
+    
+    colors = -np.ones(n_cols, dtype=int)
+    
+    # colors of the columns that have already a nonzero entry in a row
+    row_colors = [set() for i in xrange(n_rows)]
+    
+    for j in xrange(n_cols):
+        rows = indices[indptr[j]:indptr[j+1]]
+        
+        forbidden = set()
+        for i in rows:
+            forbidden.update(row_colors[i])
+        
+        color = 0
+        while color in forbidden:
+            color += 1
+        
+        colors[j] = color
+        for i in rows:
+            row_colors[i].add(color)
+    
+    return colors, int(colors.max()) + 1 if n_cols else 0
+
+def sym2num_vectorfield(f_sym, x_sym, u_sym, vectorized=False, cse=False, backend='lambdify', n_procs=1):
     '''
     This function takes a callable vector field of a control system that is to be evaluated with symbols
     for the state and input variables and returns a corresponding function that can be evaluated with
@@ -211,12 +419,26 @@ def sym2num_vectorfield(f_sym, x_sym, u_sym, vectorized=False, cse=False):
 
     cse : bool
         Whether or not to make use of common subexpressions in vector field
+        (only relevant for the `lambdify` backend)
+    
+    backend : str
+        How to generate the numeric function, one of
+        
+        * 'lambdify': use (a cse wrapper of) :py:func:`sympy.lambdify`
+        * 'numpy': generate one flattened function (see :py:func:`cse_codegen`)
+        * 'numba': like 'numpy' but compiled with :py:func:`numba.njit`
+        * 'numexpr': like 'numpy' but using :py:func:`numexpr.evaluate`
+    
+    n_procs : int
+        Number of worker processes for the search of common subexpressions
+        (see :py:func:`parallel_cse`)
     
     Returns
     -------
     
     callable
         The callable ("numeric") vector field of the control system.
+        It takes an optional argument `out` to write the result into.
     '''
 
     # make sure we got symbols as arguments
@@ -247,6 +469,36 @@ def sym2num_vectorfield(f_sym, x_sym, u_sym, vectorized=False, cse=False):
     else:
         raise TypeError(str(sym_type))
 
+    if vectorized:
+        stack = np.vstack
+    else:
+        stack = np.hstack
+    
+    if backend != 'lambdify':
+        if backend not in {'numpy', 'numba', 'numexpr'}:
+            logger.warning('Unknown backend ({}).'.format(backend))
+            logger.warning('--> will use lambdify!')
+            return sym2num_vectorfield(F_sym, x_sym, u_sym, vectorized, cse, backend='lambdify',
+                                       n_procs=n_procs)
+        
+        if sym_dim == 1:
+            F_sym = np.array(F_sym).ravel(order='F').tolist()
+        else:
+            F_sym = sp.Matrix(F_sym)
+        
+        _f_gen = cse_codegen(x_sym + u_sym, F_sym, backend=backend, n_procs=n_procs)
+        shape = _f_gen.shape
+        
+        # the generated function writes into the array `out`
+        # so we just have to provide one if none is given
+        def f_num(x, u, out=None):
+            xu = stack((x, u))
+            if out is None:
+                out = np.empty(shape + xu.shape[1:])
+            return _f_gen(*(tuple(xu) + (out,)))
+        
+        return f_num
+
     if vectorized:
         # in order to make the numeric function vectorized
         # we have to check if the symbolic expression contains
@@ -282,7 +534,7 @@ def sym2num_vectorfield(f_sym, x_sym, u_sym, vectorized=False, cse=False):
 
     # now we can create the numeric function
     if cse:
-        _f_num = cse_lambdify(x_sym + u_sym, F_sym,
+        _f_num = cse_lambdify(x_sym + u_sym, F_sym, n_procs=n_procs,
                               modules=[{'ImmutableMatrix':np.array}, 'numpy'])
     else:
         _f_num = sp.lambdify(x_sym + u_sym, F_sym,
@@ -290,18 +542,23 @@ def sym2num_vectorfield(f_sym, x_sym, u_sym, vectorized=False, cse=False):
     
     # create a wrapper as the actual function due to the behaviour
     # of lambdify()
-    if vectorized:
-        stack = np.vstack
-    else:
-        stack = np.hstack
-    
     if sym_dim == 1:
-        def f_num(x, u):
+        def f_num(x, u, out=None):
             xu = stack((x, u))
-            return np.array(_f_num(*xu))
+            if out is None:
+                out = np.empty((len(F_sym),) + xu.shape[1:])
+            
+            # (the cse may have removed the trick for constant elements
+            # so they are broadcasted here)
+            for i, fi in enumerate(_f_num(*xu)):
+                out[i] = fi
+            return out
     else:
-        def f_num(x, u):
+        def f_num(x, u, out=None):
             xu = stack((x, u))
+            if out is not None:
+                out[...] = _f_num(*xu)
+                return out
             return _f_num(*xu)
         
     return f_num
@@ -354,7 +611,8 @@ def eval_replacements_fnc(args):
     '''
 
     # first we create the string needed to unpack the input arguments
-    unpack_args_str = ','.join(str(a) for a in input_args)
+    # (the trailing comma is needed for a single argument)
+    unpack_args_str = ','.join(str(a) for a in input_args) + ','
     
     # then we create the string that successively evaluates the replacement pairs
     eval_pairs_str = ''
@@ -367,7 +625,9 @@ def eval_replacements_fnc(args):
         replacements_str = ','.join(str(r) for r in ret_filter)
     else:
         replacements_str = ','.join(str(r) for r in zip(*replacement_pairs)[0])
-
+    
+    # always return a tuple (even for a single replacement)
+    replacements_str = '({},)'.format(replacements_str) if replacements_str else '()'
 
     eval_replacements_fnc_str = function_buffer.format(unpack_args=unpack_args_str,
                                                        eval_pairs=eval_pairs_str,
@@ -417,7 +677,7 @@ def cse_lambdify(args, expr, **kwargs):
         args = (args,)
 
     # get the common subexpressions
-    cse_pairs, red_exprs = sp.cse(expr, symbols=sp.numbered_symbols('r'))
+    cse_pairs, red_exprs = parallel_cse(expr, n_procs=kwargs.pop('n_procs', 1))
     if len(red_exprs) == 1:
         red_exprs = red_exprs[0]
 
@@ -470,6 +730,285 @@ def cse_lambdify(args, expr, **kwargs):
     return cse_fnc
     
 
+def cse_codegen(args, expr, backend='numpy', n_procs=1):
+    '''
+    Generates one flattened function that evaluates the common subexpressions
+    and all elements of the given expression and writes them into an array.
+    
+    The created function takes the values for `args` and the array `out`
+    (whose shape has to be that of the expression, possibly with an additional
+    axis for vectorized evaluation) as positional arguments and returns `out`.
+    
+    Parameters
+    ----------
+    
+    args : iterable
+        Symbols (or their names) the expression depends on.
+    
+    expr : list or sympy.Matrix
+        The (1- or 2-dimensional) expression to evaluate.
+    
+    backend : str
+        'numpy', 'numba' (compile the function with :py:func:`numba.njit`)
+        or 'numexpr' (evaluate the expressions with :py:func:`numexpr.evaluate`)
+    
+    n_procs : int
+        Number of worker processes for the search of common subexpressions
+        (see :py:func:`parallel_cse`)
+    
+    Returns
+    -------
+    
+    callable
+        The generated function. Its attribute `shape` holds the shape of the expression
+        and `source` the generated code.
+    '''
+    
+    function_buffer = '''
+def generated_fnc({args}, out):
+    {eval_pairs}
+    {eval_out}
+    return out
+    '''
+    
+    # the optional backends
+    if backend == 'numba':
+        try:
+            import numba
+        except ImportError:
+            logger.warning('Could not import numba.')
+            logger.warning('--> will use numpy backend!')
+            backend = 'numpy'
+    elif backend == 'numexpr':
+        try:
+            import numexpr
+        except ImportError:
+            logger.warning('Could not import numexpr.')
+            logger.warning('--> will use numpy backend!')
+            backend = 'numpy'
+    
+    args = [sp.Symbol(str(a)) for a in args]
+    
+    if isinstance(expr, sp.MatrixBase):
+        shape = expr.shape
+        elements = list(expr)
+        indices = [(i, j) for i in xrange(shape[0]) for j in xrange(shape[1])]
+    else:
+        shape = (len(expr),)
+        elements = [sp.sympify(e) for e in expr]
+        indices = [(i,) for i in xrange(shape[0])]
+    
+    # rational numbers are replaced by floats to avoid integer divisions
+    def _floats(e):
+        return e.xreplace(dict((r, sp.Float(r)) for r in e.atoms(sp.Rational) if not r.is_Integer))
+    
+    cse_pairs, red_exprs = parallel_cse(elements, n_procs=n_procs)
+    
+    if backend == 'numexpr':
+        printer = NumExprPrinter()
+    else:
+        printer = LambdaPrinter()
+    
+    eval_pairs_str = '\n    '.join('{} = {}'.format(str(sym), printer.doprint(_floats(e)))
+                                    for sym, e in cse_pairs)
+    eval_out_str = '\n    '.join('out[{}] = {}'.format(', '.join(str(i) for i in idx),
+                                                       printer.doprint(_floats(e)))
+                                  for idx, e in zip(indices, red_exprs))
+    
+    source = function_buffer.format(args=', '.join(str(a) for a in args),
+                                    eval_pairs=eval_pairs_str,
+                                    eval_out=eval_out_str)
+    
+    # the namespace in which to define the function
+    namespace = _get_namespace('numpy').copy()
+    if backend == 'numexpr':
+        namespace['evaluate'] = numexpr.evaluate
+    
+    code = compile(source, '<generated>', 'exec', __future__.division.compiler_flag, True)
+    exec code in namespace
+    generated_fnc = namespace['generated_fnc']
+    
+    if backend == 'numba':
+        generated_fnc = numba.njit(generated_fnc)
+    
+    # the returned function should allow to set attributes
+    def cse_fnc(*args):
+        return generated_fnc(*args)
+    
+    cse_fnc.shape = shape
+    cse_fnc.source = source
+    
+    return cse_fnc
+
+
+def _parallel_map(fnc, items, n_procs):
+    '''
+    Applies `fnc` to all `items`, using a pool of `n_procs` worker
+    processes if this is greater than one.
+    '''
+    
+    if n_procs <= 1 or len(items) <= 1:
+        return map(fnc, items)
+    
+    pool = multiprocessing.Pool(min(n_procs, len(items)))
+    try:
+        res = pool.map(fnc, items)
+    finally:
+        pool.close()
+        pool.join()
+    
+    return res
+
+def _split(seq, n):
+    '''
+    Splits the sequence `seq` into (at most) `n` consecutive chunks.
+    '''
+    
+    bounds = np.linspace(0, len(seq), min(n, len(seq)) + 1).astype(int)
+    return [seq[bounds[k]:bounds[k+1]] for k in xrange(len(bounds) - 1)]
+
+def _jacobian_rows(args):
+    # worker function for `jacobian()` (has to be picklable)
+    rows, variables = args
+    return [[r.diff(v) for v in variables] for r in rows]
+
+def _cse_chunk(args):
+    # worker function for `parallel_cse()` (has to be picklable)
+    exprs, prefix = args
+    return sp.cse(exprs, symbols=sp.numbered_symbols(prefix))
+
+def jacobian(expr, variables, n_procs=1):
+    '''
+    Computes the jacobian matrix of the vector valued expression `expr`
+    with respect to `variables`.
+    
+    The rows are independent from each other, so for large expressions
+    they can be differentiated in parallel by `n_procs` worker processes.
+    
+    Parameters
+    ----------
+    
+    expr : iterable
+        The (1-dimensional) expression, e.g. the vector field.
+    
+    variables : iterable
+        Symbols (or their names) of the variables of differentiation.
+    
+    n_procs : int
+        Number of worker processes.
+    
+    Returns
+    -------
+    
+    sympy.Matrix
+        The jacobian matrix.
+    '''
+    
+    rows = [sp.sympify(e) for e in np.array(expr).ravel(order='F')]
+    variables = [sp.Symbol(str(v)) for v in variables]
+    
+    if n_procs <= 1:
+        return sp.Matrix(_jacobian_rows((rows, variables)))
+    
+    chunks = _split(rows, n_procs)
+    res = _parallel_map(_jacobian_rows, [(c, variables) for c in chunks], n_procs)
+    
+    return sp.Matrix(sum(res, []))
+
+def parallel_cse(expr, n_procs=1):
+    '''
+    Searches for common subexpressions in the given expression(s)
+    like :py:func:`sympy.cse` does (with the symbols `r0, r1, ...`).
+    
+    If `n_procs` is greater than one the elements of the expression are
+    split into consecutive chunks which are processed in parallel by
+    worker processes. The symbols of every chunk get their own prefix
+    (`r0_0, r0_1, ..., r1_0, ...`) so that they don't collide.
+    Subexpressions that are shared between different chunks are not recognized
+    but this is a small price for the speed up in case of large models.
+    
+    Parameters
+    ----------
+    
+    expr : list or sympy.Matrix
+        The expression(s) to reduce.
+    
+    n_procs : int
+        Number of worker processes.
+    
+    Returns
+    -------
+    
+    list
+        The replacement pairs.
+    
+    list
+        The reduced expression(s) (a single matrix if `expr` is one).
+    '''
+    
+    is_matrix = isinstance(expr, sp.MatrixBase)
+    
+    if n_procs <= 1 or not (is_matrix or isinstance(expr, (list, tuple))) or len(expr) <= 1:
+        return sp.cse(expr, symbols=sp.numbered_symbols('r'))
+    
+    elements = [sp.sympify(e) for e in expr]
+    chunks = _split(elements, n_procs)
+    
+    res = _parallel_map(_cse_chunk, [(c, 'r{}_'.format(k)) for k, c in enumerate(chunks)], n_procs)
+    
+    cse_pairs = []
+    red_exprs = []
+    for pairs, red in res:
+        cse_pairs += pairs
+        red_exprs += red
+    
+    if is_matrix:
+        red_exprs = [sp.Matrix(expr.shape[0], expr.shape[1], red_exprs)]
+    
+    return cse_pairs, red_exprs
+
+
+def saturation_expressions(y, y0, y1):
+    '''
+    Returns the symbolic expressions of the saturation function that projects
+    an unconstrained variable `y` on the interval `(y0, y1)` and of its first
+    derivative with respect to `y`.
+    
+    For more information, please have a look at :ref:`handling_constraints`.
+    
+    Parameters
+    ----------
+    
+    y : sympy.Symbol
+        The unconstrained variable.
+    
+    y0 : float
+        Lower saturation limit.
+    
+    y1 : float
+        Upper saturation limit.
+    
+    Returns
+    -------
+    
+    sympy.Expr
+        The saturation function :math:`\\psi(y)`.
+    
+    sympy.Expr
+        Its derivative :math:`\\frac{d\\psi}{dy}(y)`.
+    '''
+    
+    # Calculate the parameter m such that the slope of the saturation function
+    # at t = 0 becomes 1
+    m = 4.0/(y1-y0)
+    
+    psi = y1 - (y1-y0)/(1. + sp.exp(m * y))
+    
+    #dpsi = ((y1-y0)*m*sp.exp(m*y))/(1.0+sp.exp(m*y))**2
+    dpsi = (4. * sp.exp(m * y))/(1. + sp.exp(m * y))**2
+    
+    return psi, dpsi
+
 def saturation_functions(y_fnc, dy_fnc, y0, y1):
     '''
     Creates callable saturation function and its first derivative to project 
@@ -505,25 +1044,32 @@ def saturation_functions(y_fnc, dy_fnc, y0, y1):
         to a calculated solution for an unconstrained state variable.
     '''
     
-    # Calculate the parameter m such that the slope of the saturation function
-    # at t = 0 becomes 1
-    m = 4.0/(y1-y0)
+    # the same expressions that are used to transform the vectorfield
+    # (see :py:meth:`system.ControlSystem.unconstrain`) are compiled
+    # to (vectorized) numpy functions
+    y = sp.Symbol('y')
+    psi, dpsi = saturation_expressions(y, y0, y1)
+    
+    psi_num = sp.lambdify(y, psi, modules='numpy')
+    dpsi_num = sp.lambdify(y, dpsi, modules='numpy')
     
     # this is the saturation function
     def psi_y(t):
-        y = y_fnc(t)
-        return y1 - (y1-y0)/(1.0+np.exp(m*y))
+        return psi_num(y_fnc(t))
     
     # and this its first derivative
     def dpsi_dy(t):
-        y = y_fnc(t)
-        dy = dy_fnc(t)
-        return dy * (4.0*np.exp(m*y))/(1.0+np.exp(m*y))**2
+        return dy_fnc(t) * dpsi_num(y_fnc(t))
+    
+    # remember what the compositions are made of
+    # (see :py:func:`results.save_results`)
+    psi_y.y_fnc, psi_y.saturation_limits = y_fnc, (y0, y1)
+    dpsi_dy.y_fnc, dpsi_dy.saturation_limits = y_fnc, (y0, y1)
     
     return psi_y, dpsi_dy
 
 
-def consistency_error(I, x_fnc, u_fnc, dx_fnc, ff_fnc, npts=500, return_error_array=False):
+def consistency_error(I, x_fnc, u_fnc, dx_fnc, ff_fnc, npts=500, return_error_array=False, vectorized=False):
     '''
     Calculates an error that shows how "well" the spline functions comply with the system
     dynamic given by the vector field.
@@ -552,6 +1098,10 @@ def consistency_error(I, x_fnc, u_fnc, dx_fnc, ff_fnc, npts=500, return_error_ar
     return_error_array : bool
         Whether or not to return the calculated errors (mainly for plotting).
     
+    vectorized : bool
+        Whether the functions take (and return) arrays of all points at once
+        (one column per point) instead of being called for every point.
+    
     Returns
     -------
     
@@ -565,17 +1115,20 @@ def consistency_error(I, x_fnc, u_fnc, dx_fnc, ff_fnc, npts=500, return_error_ar
     # get some test points to calculate the error at
     tt = np.linspace(I[0], I[1], npts, endpoint=True)
     
-    error = []
-    for t in tt:
-        x = x_fnc(t)
-        u = u_fnc(t)
-        
-        ff = ff_fnc(x, u)
-        dx = dx_fnc(t)
+    if vectorized:
+        error = (ff_fnc(x_fnc(tt), u_fnc(tt)) - dx_fnc(tt)).T.squeeze()
+    else:
+        error = []
+        for t in tt:
+            x = x_fnc(t)
+            u = u_fnc(t)
+            
+            ff = ff_fnc(x, u)
+            dx = dx_fnc(t)
+            
+            error.append(ff - dx)
         
-        error.append(ff - dx)
-    
-    error = np.array(error).squeeze()
+        error = np.array(error).squeeze()
     
     max_con_err = error.max()
     
@@ -0,0 +1,301 @@
+# IMPORTS
+import sympy as sp
+import multiprocessing
+import argparse
+import logging
+import json
+import glob
+import time
+import os
+import re
+
+from system import ControlSystem
+from log import logger, enable_console
+
+
+# NOTE:
+# A problem spec is a dictionary (a JSON object) like
+#
+#   {"name": "pendulum",
+#    "ff": ["x2", "u1", "x4", "2*(9.81*sin(x3) + u1*cos(x3))"],
+#    "a": 0.0, "b": 2.0,
+#    "xa": [0.0, 0.0, 3.14159, 0.0], "xb": [0.0, 0.0, 0.0, 0.0],
+#    "ua": [0.0], "ub": [0.0],
+#    "constraints": {"0": [-0.8, 0.3]},
+#    "kwargs": {"sx": 5, "use_chains": false}}
+#
+# The vector field is given by sympy-parsable expressions in the
+# state variables `x1, x2, ...` and the input variables `u1, u2, ...`.
+
+
+def parse_vectorfield(exprs, n_inputs=None):
+    '''
+    Creates the vector field `ff(x, u)` of a control system from
+    sympy-parsable expressions.
+
+    Parameters
+    ----------
+
+    exprs : list
+        The expressions (strings) of the vector field's components in the
+        state variables `x1, ..., xn` and the input variables `u1, ..., um`.
+
+    n_inputs : int
+        Number of input variables (determined from the expressions if not given).
+
+    Returns
+    -------
+
+    callable
+        The vector field.
+    '''
+
+    n_states = len(exprs)
+
+    # the variables that may appear in the expressions
+    x = sp.symbols(['x{}'.format(i+1) for i in xrange(n_states)])
+    namespace = dict((str(xx), xx) for xx in x)
+
+    if n_inputs is None:
+        indices = [int(i) for e in exprs for i in re.findall(r'\bu(\d+)\b', e)]
+        n_inputs = max(indices) if indices else 0
+
+    u = sp.symbols(['u{}'.format(j+1) for j in xrange(n_inputs)])
+    namespace.update((str(uu), uu) for uu in u)
+
+    f = [sp.sympify(e, locals=namespace) for e in exprs]
+
+    unknown = set().union(*[fi.free_symbols for fi in f]) - set(x) - set(u)
+    if unknown:
+        raise ValueError("Unknown variables in the vector field: {}".format(
+                         ', '.join(sorted(str(s) for s in unknown))))
+
+    def ff(xx, uu):
+        if len(xx) != n_states or len(uu) != n_inputs:
+            # the dimensions are determined by calling the vector field
+            # with increasing numbers of inputs (see system.SymbolicModel)
+            raise ValueError("Wrong number of variables")
+
+        subs = dict(zip(x + u, list(xx) + list(uu)))
+        return [fi.xreplace(subs) for fi in f]
+
+    return ff
+
+def load_specs(source):
+    '''
+    Reads the problem specs from a JSON-lines file (one spec per line) or
+    from all `*.json` files (each a spec or a list of specs) and `*.jsonl`
+    files of a directory.
+
+    Specs without a name are named after their file and position.
+    '''
+
+    if os.path.isdir(source):
+        fnames = sorted(glob.glob(os.path.join(source, '*.json')) +
+                        glob.glob(os.path.join(source, '*.jsonl')))
+    else:
+        fnames = [source]
+
+    specs = []
+    for fname in fnames:
+        with open(fname) as f:
+            if fname.endswith('.json'):
+                content = json.load(f)
+                file_specs = content if isinstance(content, list) else [content]
+            else:
+                file_specs = [json.loads(line) for line in f if line.strip()]
+
+        stem = os.path.splitext(os.path.basename(fname))[0]
+        for i, spec in enumerate(file_specs):
+            if not spec.has_key('name'):
+                spec['name'] = '{}_{}'.format(stem, i) if len(file_specs) > 1 else stem
+            specs.append(spec)
+
+    names = [spec['name'] for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the problems have to be unique")
+
+    return specs
+
+def shard(specs, index, count):
+    '''
+    Returns the part `index` (starting with 0) of `count` parts of the specs.
+
+    The specs are distributed by their position, so every machine that reads
+    the same specs gets a disjoint part of them.
+    '''
+
+    if not 0 <= index < count:
+        raise ValueError("Invalid shard {}/{}".format(index, count))
+
+    return specs[index::count]
+
+def _to_str(obj):
+    # JSON strings are unicode, but the method parameters are compared with
+    # (and keyword arguments have to be) plain strings
+    if isinstance(obj, unicode):
+        return str(obj)
+    elif isinstance(obj, list):
+        return [_to_str(v) for v in obj]
+    elif isinstance(obj, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in obj.items())
+    return obj
+
+def make_system(spec):
+    '''
+    Creates the control system that belongs to a problem spec.
+    '''
+
+    ua = spec.get('ua', [])
+    ff = parse_vectorfield(spec['ff'], n_inputs=len(ua) if ua else None)
+
+    constraints = spec.get('constraints', None)
+    if constraints is not None:
+        # keys of JSON objects are strings
+        constraints = dict((int(k), tuple(v)) for k, v in constraints.items())
+
+    kwargs = _to_str(spec.get('kwargs', dict()))
+
+    return ControlSystem(ff, a=spec.get('a', 0.0), b=spec.get('b', 1.0),
+                         xa=spec['xa'], xb=spec['xb'], ua=ua, ub=spec.get('ub', []),
+                         constraints=constraints, **kwargs)
+
+def solve_spec(spec, outdir):
+    '''
+    Solves the problem of a spec and saves its results in the directory
+    `outdir` (see :py:func:`results.save_results`).
+
+    Returns
+    -------
+
+    dict
+        A summary of the solution process (no exception is raised if it fails).
+    '''
+
+    summary = dict(name=spec['name'], file=None, reached_accuracy=False,
+                   nIt=None, error=None)
+    start = time.time()
+
+    try:
+        S = make_system(spec)
+        S.solve()
+
+        fname = os.path.join(outdir, spec['name'] + '.npz')
+        S.save_results(fname)
+
+        summary['file'] = os.path.basename(fname)
+        summary['reached_accuracy'] = bool(S.reached_accuracy)
+        summary['nIt'] = S.nIt
+    except Exception as err:
+        logger.error("Problem {} failed: {}".format(spec['name'], err))
+        summary['error'] = '{}: {}'.format(type(err).__name__, err)
+
+    summary['time'] = time.time() - start
+
+    return summary
+
+def _solve_job(args):
+    # (module level function, so that it can be sent to the worker processes)
+    return solve_spec(*args)
+
+def run_batch(specs, outdir, n_workers=1, summary_file=None, skip_existing=False):
+    '''
+    Solves the problems of the specs with a pool of worker processes.
+
+    Parameters
+    ----------
+
+    specs : list
+        The problem specs (see :py:func:`load_specs`).
+
+    outdir : str
+        The directory for the results (created if necessary).
+
+    n_workers : int
+        Number of worker processes (`1` solves the problems in this process).
+
+    summary_file : str
+        Name of a JSON-lines file in `outdir` to which the summary of every
+        problem is appended as soon as it is solved.
+
+    skip_existing : bool
+        Whether to skip the problems whose results already exist
+        (e.g. to continue an interrupted batch).
+
+    Returns
+    -------
+
+    list
+        The summaries in the order of the specs.
+    '''
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    if skip_existing:
+        specs = [spec for spec in specs
+                 if not os.path.exists(os.path.join(outdir, spec['name'] + '.npz'))]
+
+    jobs = [(spec, outdir) for spec in specs]
+
+    if n_workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(n_workers, len(jobs)))
+        results = pool.imap_unordered(_solve_job, jobs)
+    else:
+        pool = None
+        results = (_solve_job(job) for job in jobs)
+
+    summaries = dict()
+    try:
+        for summary in results:
+            summaries[summary['name']] = summary
+
+            if summary_file is not None:
+                with open(os.path.join(outdir, summary_file), 'a') as f:
+                    f.write(json.dumps(summary) + '\n')
+
+            logger.info("Finished {} ({}/{})".format(summary['name'], len(summaries), len(jobs)))
+    finally:
+        # (all results are there unless the batch was interrupted)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return [summaries[spec['name']] for spec in specs]
+
+def main(argv=None):
+    '''
+    The command line interface `pytrajectory-batch`.
+    '''
+
+    parser = argparse.ArgumentParser(prog='pytrajectory-batch',
+                                     description='Solve a batch of trajectory planning problems.')
+    parser.add_argument('source', help="JSON-lines file or directory with problem specs")
+    parser.add_argument('-o', '--outdir', default='results', help="directory for the results")
+    parser.add_argument('-j', '--workers', type=int, default=1, help="number of worker processes")
+    parser.add_argument('--shard', default='0/1',
+                        help="solve only the part i (starting with 0) of N parts of the specs, given as i/N")
+    parser.add_argument('--skip-existing', action='store_true',
+                        help="skip the problems whose results already exist")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only log warnings and errors")
+
+    args = parser.parse_args(argv)
+
+    match = re.match(r'^(\d+)/(\d+)$', args.shard)
+    if match is None:
+        parser.error("invalid shard: {}".format(args.shard))
+    index, count = int(match.group(1)), int(match.group(2))
+
+    enable_console(logging.WARNING if args.quiet else logging.INFO)
+
+    specs = shard(load_specs(args.source), index, count)
+
+    summary_file = 'summary.jsonl' if count == 1 else 'summary-{}-of-{}.jsonl'.format(index, count)
+    summaries = run_batch(specs, args.outdir, n_workers=args.workers,
+                          summary_file=summary_file, skip_existing=args.skip_existing)
+
+    n_failed = sum(not s['reached_accuracy'] for s in summaries)
+    logger.info("{} of {} problems reached the desired accuracy".format(len(summaries) - n_failed, len(summaries)))
+
+    return 1 if n_failed else 0
+
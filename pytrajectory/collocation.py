@@ -2,12 +2,16 @@
 import numpy as np
 import sympy as sp
 from scipy import sparse
+from multiprocessing.pool import ThreadPool
+import os
 
-from log import logging, Timer
+from log import logger, Timer, track_memory
 from trajectories import Trajectory
+from splines import spline_source
 from solver import Solver
+from simulation import Simulator
+import auxiliary
 
-from auxiliary import sym2num_vectorfield
 
 from IPython import embed as IPS
 
@@ -33,26 +37,73 @@ class CollocationSystem(object):
         self._parameters = dict()
         self._parameters['tol'] = kwargs.get('tol', 1e-5)
         self._parameters['sol_steps'] = kwargs.get('sol_steps', 100)
+        self._parameters['sol_time_limit'] = kwargs.get('sol_time_limit', None)
         self._parameters['method'] = kwargs.get('method', 'leven')
         self._parameters['coll_type'] = kwargs.get('coll_type', 'equidistant')
+        self._parameters['n_threads'] = kwargs.get('n_threads', 1)
+        self._parameters['backend'] = kwargs.get('backend', 'lambdify')
+        self._parameters['memory_tracking'] = kwargs.get('memory_tracking', False)
+        self._parameters['jacobian'] = kwargs.get('jacobian', 'vectorfield')
+        
+        if self._parameters['jacobian'] not in {'vectorfield', 'colored_fd'}:
+            logger.warning("Unknown jacobian method: {}".format(self._parameters['jacobian']))
+            logger.warning("Use 'vectorfield' instead")
+            self._parameters['jacobian'] = 'vectorfield'
+        
+        self._parameters['guess_type'] = kwargs.get('guess_type', 'constant')
+        
+        if self._parameters['guess_type'] not in {'constant', 'linear', 'cubic', 'simulate'}:
+            logger.warning("Unknown guess type: {}".format(self._parameters['guess_type']))
+            logger.warning("Use 'constant' instead")
+            self._parameters['guess_type'] = 'constant'
+        
+        # scaling of the free parameters and the equations in the solver
+        for key in ('x_scale', 'f_scale'):
+            scale = kwargs.get(key, None)
+            if isinstance(scale, str) and scale != 'jacobian':
+                logger.warning("Unknown scaling: {}".format(scale))
+                logger.warning("Use 'jacobian' instead")
+                scale = 'jacobian'
+            self._parameters[key] = scale
+        self._parameters['min_scale'] = kwargs.get('min_scale', None)
+        
+        # pool of worker threads for the evaluation of the vector field
+        # and its jacobian (created on demand --> see self._evaluate_chunked()
+        # and closed after every run of the solver --> see self.solve())
+        self._pool = None
+        self._pool_pid = None
         
         # we don't have a soution, yet
         self.sol = None
+        self.solver_stats = dict()
+        self.memory_stats = dict()
         
-        # create vectorized versions of the control system's vector field
+        # get vectorized versions of the control system's vector field
         # and its jacobian for the faster evaluation of the collocation equation system `G`
         # and its jacobian `DG` (--> see self.build())
-        f = sys.f_sym(sp.symbols(sys.states), sp.symbols(sys.inputs))
+        # (they are created only once for every dynamical system --> see system.SymbolicModel)
+        model = sys.model
         
         # TODO: check order of variables of differentiation ([x,u] vs. [u,x])
         #       because in dot products in later evaluation of `DG` with vector `c`
         #       values for u come first in `c`
-        Df = sp.Matrix(f).jacobian(sys.states + sys.inputs)
         
-        self._ff_vectorized = sym2num_vectorfield(f, sys.states, sys.inputs, vectorized=True, cse=True)
-        self._Df_vectorized = sym2num_vectorfield(Df, sys.states, sys.inputs, vectorized=True, cse=True)
-        self._f = f
-        self._Df = Df
+        # most entries of the jacobian are structurally zero (especially for mechanical systems)
+        # so we just use a function for the nonzero entries and remember their positions
+        # (row, column) --> see self.build()
+        if self._parameters['jacobian'] == 'colored_fd':
+            # the jacobian of the eqs is approximated by finite differences
+            # so the jacobian of the vector field isn't needed at all
+            # (its structure follows from the variables of the components)
+            self._Df_pattern = model.dependency_pattern
+            self._ff_vectorized = model.vectorized_vectorfield(self._parameters['backend'])
+            self._Df_vectorized = None
+            self._Df = None
+        else:
+            self._Df_pattern = model.Df_pattern
+            self._ff_vectorized, self._Df_vectorized = model.vectorized_functions(self._parameters['backend'])
+            self._Df = model.Df
+        self._f = model.f
 
         self.trajectories = Trajectory(sys, **kwargs)
 
@@ -69,7 +120,10 @@ class CollocationSystem(object):
                 for key, value in kwargs.iteritems():
                     self.__setattr__(str(key), value)
 
-        logging.debug("Building Equation System")
+        logger.debug("Building Equation System")
+        
+        # memory usage of the phases of the setup (if it is tracked)
+        self.memory_stats = dict()
         
         # make symbols local
         states = self.sys.states
@@ -80,7 +134,8 @@ class CollocationSystem(object):
         indic = self._get_index_dict()
 
         # compute dependence matrices
-        Mx, Mx_abs, Mdx, Mdx_abs, Mu, Mu_abs = self._build_dependence_matrices(indic)
+        with track_memory(self.memory_stats, 'dependence_matrices', self._parameters['memory_tracking']):
+            Mx, Mx_abs, Mdx, Mdx_abs, Mu, Mu_abs = self._build_dependence_matrices(indic)
 
         # in the later evaluation of the equation system `G` and its jacobian `DG`
         # there will be created the matrices `F` and DF in which every nx rows represent the 
@@ -102,44 +157,79 @@ class CollocationSystem(object):
         delta = 2
         n_cpts = self.trajectories.n_parts_x * delta + 1
         
-        # this (-> `take_indices`) will be the array with indices of the rows we need
-        # 
-        # to get these indices we iterate over all rows and take those whose indices
-        # are contained in `eqind` (modulo the number of state variables -> `x_len`)
-        take_indices = np.tile(eqind, (n_cpts,)) + np.arange(n_cpts).repeat(len(eqind)) * len(states)
-        
-        # here we determine the jacobian matrix of the derivatives of the system state functions
-        # (as they depend on the free parameters in a linear fashion its just the above matrix Mdx)
-        DdX = Mdx[take_indices, :]
-        
-        # here we compute the jacobian matrix of the system/input splines as they also depend on
-        # the free parameters
-        DXU = []
-        n_states = self.sys.n_states
-        n_inputs = self.sys.n_inputs
-        n_vars = n_states + n_inputs
-
-        for i in xrange(n_cpts):
-            DXU.append(np.vstack(( Mx[n_states * i : n_states * (i+1)].toarray(), Mu[n_inputs * i : n_inputs * (i+1)].toarray() )))
+        # (these are the largest arrays of the eqs, so their memory usage is of interest)
+        with track_memory(self.memory_stats, 'jacobian_structure', self._parameters['memory_tracking']):
+            # this (-> `take_indices`) will be the array with indices of the rows we need
+            # 
+            # to get these indices we iterate over all rows and take those whose indices
+            # are contained in `eqind` (modulo the number of state variables -> `x_len`)
+            take_indices = np.tile(eqind, (n_cpts,)) + np.arange(n_cpts).repeat(len(eqind)) * len(states)
             
-        DXU_old = DXU
-        DXU = np.vstack(DXU)
-
-        DXU = sparse.csr_matrix(DXU)
+            # (the state variable of every equation, see self._solver_scales())
+            self._G_states = take_indices % len(states)
+        
+            # here we determine the jacobian matrix of the derivatives of the system state functions
+            # (as they depend on the free parameters in a linear fashion its just the above matrix Mdx)
+            DdX = Mdx[take_indices, :]
+        
+            # here we compute the jacobian matrix of the system/input splines as they also depend on
+            # the free parameters
+            n_states = self.sys.n_states
+            n_inputs = self.sys.n_inputs
+            n_vars = n_states + n_inputs
+
+            # the rows of `DXU` are those of `Mx` and `Mu` ordered by collocation points
+            # (all states and then all inputs for every point)
+            perm = np.hstack((np.arange(n_cpts * n_states).reshape((n_cpts, n_states)),
+                              n_cpts * n_states + np.arange(n_cpts * n_inputs).reshape((n_cpts, n_inputs))))
+        
+            DXU = sparse.vstack((Mx, Mu), format='csr')[perm.ravel(), :]
 
-        # localize vectorized functions for the control system's vector field and its jacobian
-        ff_vec = self._ff_vectorized
-        Df_vec = self._Df_vectorized
+            # localize vectorized functions for the control system's vector field and its jacobian
+            ff_vec = self._ff_vectorized
+            Df_vec = self._Df_vectorized
 
-        # transform matrix formats for faster dot products
-        Mx = Mx.tocsr()
-        Mx_abs = Mx_abs.tocsr()
-        Mdx = Mdx.tocsr()
-        Mdx_abs = Mdx_abs.tocsr()
-        Mu = Mu.tocsr()
-        Mu_abs = Mu_abs.tocsr()
+            # transform matrix formats for faster dot products
+            Mx = Mx.tocsr()
+            Mx_abs = Mx_abs.tocsr()
+            Mdx = Mdx.tocsr()
+            Mdx_abs = Mdx_abs.tocsr()
+            Mu = Mu.tocsr()
+            Mu_abs = Mu_abs.tocsr()
 
-        DdX = DdX.tocsr()
+            DdX = DdX.tocsr()
+        
+            # preallocate the arrays for the values of the vector field and
+            # the nonzero entries of its jacobian in all collocation points
+            Df_rows, Df_cols = self._Df_pattern
+            F_buf = np.empty((n_states, n_cpts))
+            DF_buf = np.empty((Df_rows.size, n_cpts))
+        
+            # the jacobian of the vector field in all collocation points is a block diagonal
+            # matrix of which we just need the rows of the equations that have to be solved
+            # 
+            # so we determine the position of every needed nonzero entry in this matrix
+            # and set up its sparse structure once
+            row_pos = -np.ones(n_states, dtype=int)
+            row_pos[eqind] = np.arange(len(eqind))
+        
+            needed = np.where(row_pos[Df_rows] >= 0)[0]
+        
+            DF_rows = (np.arange(n_cpts)[:,None] * len(eqind) + row_pos[Df_rows[needed]]).ravel()
+            DF_cols = (np.arange(n_cpts)[:,None] * n_vars + Df_cols[needed]).ravel()
+        
+            # the data of this structure is the (flattened) array `DF_buf[needed].T`
+            # and `DF_order` tells us how to rearrange it for the compressed row format
+            DF_struct = sparse.csr_matrix((np.arange(DF_rows.size, dtype=float) + 1.0, (DF_rows, DF_cols)),
+                                          shape=(n_cpts * len(eqind), n_cpts * n_vars))
+            DF_order = DF_struct.data.astype(int) - 1
+            DF_indices = DF_struct.indices
+            DF_indptr = DF_struct.indptr
+            
+            if self._parameters['jacobian'] == 'colored_fd':
+                # structure of the jacobian of the eqs (absolute values avoid cancellations)
+                DG_pattern = (abs(DF_struct).dot(abs(DXU)) + abs(DdX)).tocsr()
+                DG_pattern.eliminate_zeros()
         
         # define the callable functions for the eqs
         def G(c):
@@ -154,7 +244,8 @@ class CollocationSystem(object):
             # to lower ends of integrator chains (via eqind)
             # other equations need not be solved
             #F = ff_vec(X, U).take(eqind, axis=0)
-            F = ff_vec(X, U).ravel(order='F').take(take_indices, axis=0)[:,None]
+            self._evaluate_chunked(ff_vec, X, U, F_buf, axis=1)
+            F = F_buf.ravel(order='F').take(take_indices, axis=0)[:,None]
         
             dX = Mdx.dot(c)[:,None] + Mdx_abs
             dX = dX.take(take_indices, axis=0)
@@ -173,25 +264,22 @@ class CollocationSystem(object):
             U = Mu.dot(c)[:,None] + Mu_abs
             U = np.array(U).reshape((n_inputs, -1), order='F')
             
-            # get the jacobian blocks and turn them into the right shape
-            DF_blocks = Df_vec(X,U).transpose([2,0,1])
-
-            # build a block diagonal matrix from the blocks
-            DF_csr = sparse.block_diag(DF_blocks, format='csr').dot(DXU)
-        
-            # if we make use of the system structure
-            # we have to select those rows which correspond to the equations
-            # that have to be solved
-            if self.trajectories._parameters['use_chains']:
-                DF_csr = sparse.csr_matrix(DF_csr.toarray().take(take_indices, axis=0))
-                # TODO: is the performance gain that results from not having to solve
-                #       some equations (use integrator chains) greater than
-                #       the performance loss that results from transfering the
-                #       sparse matrix to a full numpy array and back to a sparse matrix?
+            # get the values of the nonzero entries of the jacobian
+            self._evaluate_chunked(Df_vec, X, U, DF_buf, axis=1)
+
+            # build the (already reduced) block diagonal matrix from them
+            # 
+            # if we make use of the system structure it only contains those rows
+            # which correspond to the equations that have to be solved
+            DF_data = DF_buf[needed].T.ravel()[DF_order]
+            DF_csr = sparse.csr_matrix((DF_data, DF_indices, DF_indptr), shape=DF_struct.shape).dot(DXU)
         
             DG = DF_csr - DdX
         
             return DG
+        
+        if self._parameters['jacobian'] == 'colored_fd':
+            DG = self._colored_fd_jacobian(G, DG_pattern)
 
         C = Container(G=G, DG=DG,
                       Mx=Mx, Mx_abs=Mx_abs,
@@ -203,6 +291,124 @@ class CollocationSystem(object):
         #return G, DG
         return C
 
+    def _colored_fd_jacobian(self, G, pattern):
+        '''
+        Returns a function that approximates the jacobian of the collocation
+        system `G` by forward differences.
+        
+        Columns that have no nonzero entry in a common row are perturbed at once
+        (see :py:func:`auxiliary.color_columns`), so every evaluation of the
+        jacobian just needs one evaluation of `G` per group of columns
+        (and one in the unperturbed point).
+        
+        Parameters
+        ----------
+        
+        G : callable
+            The collocation system
+        
+        pattern : scipy.sparse.csr_matrix
+            The structure of its jacobian
+        '''
+        
+        colors, n_colors = auxiliary.color_columns(pattern)
+        
+        logger.debug("Jacobian by finite differences: {} columns in {} groups".format(
+            pattern.shape[1], n_colors))
+        
+        indices, indptr = pattern.indices, pattern.indptr
+        rows = np.repeat(np.arange(pattern.shape[0]), np.diff(indptr))
+        
+        # the group of the column of every nonzero entry
+        entry_colors = colors[indices]
+        
+        step = np.sqrt(np.finfo(float).eps)
+        
+        def DG(c):
+            c = np.asarray(c, dtype=float).ravel()
+            
+            # steps that are exactly representable in floating point arithmetic
+            h = (c + step * np.maximum(1.0, np.abs(c))) - c
+            
+            G0 = G(c)
+            
+            G_perturbed = np.empty((n_colors, G0.size))
+            for k in xrange(n_colors):
+                G_perturbed[k] = G(c + np.where(colors == k, h, 0.0))
+            
+            data = (G_perturbed[entry_colors, rows] - G0[rows]) / h[indices]
+            
+            return sparse.csr_matrix((data, indices, indptr), shape=pattern.shape)
+        
+        return DG
+
+    def _evaluate_chunked(self, fnc, X, U, out, axis):
+        '''
+        Evaluates the vectorized function `fnc` (i.e. the vector field or its jacobian)
+        for the values `X` and `U` of the state and input variables in all collocation
+        points and writes the result into the preallocated array `out`.
+        
+        If the parameter `n_threads` is greater than one the collocation points
+        are split into chunks that are evaluated in a pool of threads (the numpy
+        functions the vectorized functions consist of release the GIL).
+        
+        Parameters
+        ----------
+        
+        fnc : callable
+            Vectorized function returning an array whose last axis
+            corresponds to the collocation points.
+        
+        X, U : numpy.ndarray
+            Values of the state and input variables (one column per point).
+        
+        out : numpy.ndarray
+            Array to write the values into.
+        
+        axis : int
+            Axis of `out` that corresponds to the collocation points
+            (if it is the first one the result of `fnc` will be transposed).
+        '''
+        
+        def _eval(sl):
+            # the result is written into a view of `out`
+            # with the collocation points as its last axis
+            if axis == 0:
+                fnc(X[:,sl], U[:,sl], out=np.rollaxis(out[sl], 0, out.ndim))
+            else:
+                fnc(X[:,sl], U[:,sl], out=out[:,sl])
+        
+        n_threads = self._parameters['n_threads']
+        n_pts = X.shape[1]
+        
+        if n_threads > 1 and n_pts > n_threads:
+            # the pool has to be recreated in a forked child process
+            # because its threads do not exist there
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPool(n_threads)
+                self._pool_pid = os.getpid()
+            
+            bounds = np.linspace(0, n_pts, n_threads + 1).astype(int)
+            chunks = [slice(bounds[k], bounds[k+1]) for k in xrange(n_threads)]
+            
+            self._pool.map(_eval, chunks)
+        else:
+            _eval(slice(None))
+        
+        return out
+
+    def _close_pool(self):
+        '''
+        Stops the worker threads of the pool (if there are any).
+        '''
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.close()
+            self._pool.join()
+        
+        # (the threads of a pool inherited by a forked process don't exist there)
+        self._pool = None
+        self._pool_pid = None
+
     def _get_index_dict(self):
         # here we do something that will be explained after we've done it  ;-)
         indic = dict()
@@ -257,52 +463,76 @@ class CollocationSystem(object):
         lx = len(cpts) * self.sys.n_states
         lu = len(cpts) * self.sys.n_inputs
         
-        # initialize sparse dependence matrices
-        Mx = sparse.lil_matrix((lx, n_dof))
-        Mx_abs = sparse.lil_matrix((lx, 1))
+        n_cpts = len(cpts)
+        
+        # the dependence vectors of every spline are computed for all
+        # collocation points at once and then placed in the rows
+        # (every n-th, starting with the index of the variable)
+        # of the sparse dependence matrices
+        def _place(blocks, n_vars, n_rows):
+            if not blocks:
+                return sparse.csr_matrix((n_rows, n_dof)), sparse.csr_matrix((n_rows, 1))
+            
+            rows = []
+            cols = []
+            data = []
+            abs_part = np.zeros(n_rows)
+            
+            for iv, (i, j, m, m_abs) in enumerate(blocks):
+                k = np.arange(n_cpts) * n_vars + iv
+                
+                rows.append(k.repeat(j - i))
+                cols.append(np.tile(np.arange(i, j), n_cpts))
+                data.append(m.ravel())
+                abs_part[k] = m_abs
+            
+            rows = np.hstack(rows)
+            cols = np.hstack(cols)
+            data = np.hstack(data)
+            
+            # ignore zero entries
+            nz = (data != 0.0)
+            
+            M = sparse.csr_matrix((data[nz], (rows[nz], cols[nz])), shape=(n_rows, n_dof))
+            M_abs = sparse.csr_matrix(abs_part[:,None])
+            
+            return M, M_abs
         
-        Mdx = sparse.lil_matrix((lx, n_dof))
-        Mdx_abs = sparse.lil_matrix((lx, 1))
+        x_blocks = []
+        dx_blocks = []
+        for xx in states:
+            # get index range of `xx` in vector of all indep coeffs
+            i,j = indic[xx]
+            
+            # determine spline and derivation order according to integrator chains
+            # (and the coefficients if the variable is an affine function of the derivative)
+            spline_x, dorder_fx, scale_x, offset_x = spline_source(x_fnc[xx])
+            spline_dx, dorder_dfx, scale_dx, offset_dx = spline_source(dx_fnc[xx])
+            assert dorder_dfx == dorder_fx + 1
+            
+            # get dependence vectors for the collocation points and spline variable
+            mx, mx_abs = spline_x.get_dependence_vectors(cpts, d=dorder_fx)
+            mdx, mdx_abs = spline_dx.get_dependence_vectors(cpts, d=dorder_dfx)
+            
+            x_blocks.append((i, j, scale_x * mx, scale_x * mx_abs + offset_x))
+            dx_blocks.append((i, j, scale_dx * mdx, scale_dx * mdx_abs + offset_dx))
         
-        Mu = sparse.lil_matrix((lu, n_dof))
-        Mu_abs = sparse.lil_matrix((lu, 1))
+        u_blocks = []
+        for uu in inputs:
+            # get index range of `uu` in vector of all indep coeffs
+            i,j = indic[uu]
+            
+            spline_u, dorder_fu, scale_u, offset_u = spline_source(u_fnc[uu])
+            
+            # get dependence vectors for the collocation points and spline variable
+            mu, mu_abs = spline_u.get_dependence_vectors(cpts, d=dorder_fu)
+            
+            u_blocks.append((i, j, scale_u * mu, scale_u * mu_abs + offset_u))
+        
+        Mx, Mx_abs = _place(x_blocks, self.sys.n_states, lx)
+        Mdx, Mdx_abs = _place(dx_blocks, self.sys.n_states, lx)
+        Mu, Mu_abs = _place(u_blocks, self.sys.n_inputs, lu)
         
-        for ip, p in enumerate(cpts):
-            for ix, xx in enumerate(states):
-                # get index range of `xx` in vector of all indep coeffs
-                i,j = indic[xx]
-
-                # determine derivation order according to integrator chains
-                dorder_fx = _get_derivation_order(x_fnc[xx])
-                dorder_dfx = _get_derivation_order(dx_fnc[xx])
-                assert dorder_dfx == dorder_fx + 1
-
-                # get dependence vector for the collocation point and spline variable
-                mx, mx_abs = x_fnc[xx].im_self.get_dependence_vectors(p, d=dorder_fx)
-                mdx, mdx_abs = dx_fnc[xx].im_self.get_dependence_vectors(p, d=dorder_dfx)
-
-                k = ip * self.sys.n_states + ix
-                
-                Mx[k, i:j] = mx
-                Mx_abs[k] = mx_abs
-
-                Mdx[k, i:j] = mdx
-                Mdx_abs[k] = mdx_abs
-                
-            for iu, uu in enumerate(self.sys.inputs):
-                # get index range of `xx` in vector of all indep coeffs
-                i,j = indic[uu]
-
-                dorder_fu = _get_derivation_order(u_fnc[uu])
-
-                # get dependence vector for the collocation point and spline variable
-                mu, mu_abs = u_fnc[uu].im_self.get_dependence_vectors(p, d=dorder_fu)
-
-                k = ip * self.sys.n_inputs + iu
-                
-                Mu[k, i:j] = mu
-                Mu_abs[k] = mu_abs
-
         return Mx, Mx_abs, Mdx, Mdx_abs, Mu, Mu_abs
 
     def get_guess(self):
@@ -312,6 +542,11 @@ class CollocationSystem(object):
 
         If it is the first iteration step, then a vector with the same length as
         the vector of the free parameters with arbitrary values is returned.
+        The user may provide a `first_guess` either as a dictionary of callables
+        for some of the splines (which are interpolated) or as an array with
+        values for all free parameters. The splines without a user given guess
+        are interpolated from a function chosen by `guess_type` 
+        (see :meth:`_guess_functions`).
 
         Else, for every variable a spline has been created for, the old spline
         of the iteration before and the new spline are evaluated at specific
@@ -322,20 +557,34 @@ class CollocationSystem(object):
         '''
 
         if not self.trajectories._old_splines:
-            if self._first_guess is None:
-                free_coeffs_all = np.hstack(self.trajectories.indep_coeffs.values())
+            free_coeffs_all = np.hstack(self.trajectories.indep_coeffs.values())
+
+            if isinstance(self._first_guess, np.ndarray) and self._first_guess.size != free_coeffs_all.size:
+                logger.warning("Size of first guess ({}) does not fit the free parameters ({})".format(
+                                self._first_guess.size, free_coeffs_all.size))
+                logger.warning("Use default guess instead")
+                self._first_guess = None
+
+            if isinstance(self._first_guess, np.ndarray):
+                # the whole vector of free parameters is given
+                guess = np.array(self._first_guess, dtype=float)
+            elif self._first_guess is None and self._parameters['guess_type'] == 'constant':
                 guess = 0.1 * np.ones(free_coeffs_all.size)
             else:
+                first_guess = self._first_guess or dict()
+                guess_fncs = self._guess_functions()
                 guess = np.empty(0)
             
                 for k, v in sorted(self.trajectories.indep_coeffs.items(), key = lambda (k, v): k):
-                    logging.debug("Get new guess for spline {}".format(k))
+                    logger.debug("Get new guess for spline {}".format(k))
 
-                    if self._first_guess.has_key(k):
-                        s = self.trajectories.splines[k]
-                        f = self._first_guess[k]
+                    s = self.trajectories.splines[k]
 
-                        free_coeffs_guess = s.interpolate(f)
+                    if first_guess.has_key(k):
+                        free_coeffs_guess = s.interpolate(first_guess[k])
+                    elif guess_fncs.has_key(k):
+                        f, df0, dfn = guess_fncs[k]
+                        free_coeffs_guess = s.interpolate(f, m0=df0, mn=dfn)
                     else:
                         free_coeffs_guess = 0.1 * np.ones(len(v))
 
@@ -347,7 +596,7 @@ class CollocationSystem(object):
             # by interpolating the corresponding old (coarser) spline
             for k, v in sorted(self.trajectories.indep_coeffs.items(), key = lambda (k, v): k):
                 if (self.trajectories.splines[k].type == 'x'):
-                    logging.debug("Get new guess for spline {}".format(k))
+                    logger.debug("Get new guess for spline {}".format(k))
                     
                     s_new = self.trajectories.splines[k]
                     s_old = self.trajectories._old_splines[k]
@@ -366,7 +615,98 @@ class CollocationSystem(object):
         self.guess = guess
     
     
-    def solve(self, G, DG):
+    def _guess_functions(self):
+        '''
+        Returns the functions the splines are interpolated with in the first
+        iteration step together with their slopes at the borders.
+
+        Depending on the parameter `guess_type` these are
+
+        * ``'constant'`` --> none (all free parameters are set to 0.1)
+        * ``'linear'``   --> straight lines between the boundary values
+        * ``'cubic'``    --> cubic polynomials that also meet the boundary values
+          of the first derivatives (e.g. velocities at the end of an integrator chain)
+        * ``'simulate'`` --> the states of a simulation of the system starting in `xa`
+          with the inputs moving linearly between their boundary values
+
+        Missing boundary values are replaced by the value at the other border (or zero).
+        Note that the boundary values are taken from the splines, so they already
+        respect scaled and shifted integrator chains.
+        '''
+        guess_type = self._parameters['guess_type']
+        splines = self.trajectories.splines
+        
+        if guess_type == 'constant':
+            return dict()
+        
+        a, b = self.sys.a, self.sys.b
+        
+        fncs = dict()
+        for k, s in splines.items():
+            y0, y1 = s._boundary_values.get(0, (None, None))
+            y0, y1 = (y0 if y0 is not None else y1), (y1 if y1 is not None else y0)
+            y0, y1 = (y0 or 0.0), (y1 or 0.0)
+            
+            m0 = m1 = (y1 - y0) / (b - a)
+            if guess_type == 'cubic' and s._boundary_values.has_key(1):
+                dy0, dy1 = s._boundary_values[1]
+                m0 = dy0 if dy0 is not None else m0
+                m1 = dy1 if dy1 is not None else m1
+            
+            fncs[k] = (_hermite_cubic(a, b, y0, y1, m0, m1), m0, m1)
+        
+        if guess_type == 'simulate':
+            sim_fncs = self._simulated_guess_functions()
+            
+            if sim_fncs is None:
+                logger.warning("Simulation for the initial guess failed")
+                logger.warning("Use 'linear' guess instead")
+            else:
+                fncs.update(sim_fncs)
+        
+        return fncs
+
+    def _simulated_guess_functions(self):
+        '''
+        Simulates the system starting in `xa` with the inputs moving linearly
+        between `ua` and `ub` (zero if not given) and returns interpolants
+        of the simulated states with a spline of their own (or `None` if
+        the simulation is not possible or diverges).
+        '''
+        a, b = self.sys.a, self.sys.b
+        bv = self.sys.boundary_values
+        
+        start = [bv[x][0] for x in self.sys.states]
+        if any(x0 is None for x0 in start):
+            return None
+        
+        ua = np.array([bv[u][0] if bv.has_key(u) and bv[u][0] is not None else 0.0
+                       for u in self.sys.inputs])
+        ub = np.array([bv[u][1] if bv.has_key(u) and bv[u][1] is not None else 0.0
+                       for u in self.sys.inputs])
+        
+        def u(t):
+            return ua + (ub - ua) * t / (b - a)
+        
+        try:
+            S = Simulator(self.sys.f_num, b - a, start, u)
+            tt, xt, ut = S.simulate()
+        except Exception as err:
+            logger.debug("Simulation for the initial guess: {}".format(err))
+            return None
+        
+        if S.status != 'finished':
+            return None
+        
+        tt = tt + a
+        fncs = dict()
+        for i, x in enumerate(self.sys.states):
+            if self.trajectories.splines.has_key(x):
+                fncs[x] = (lambda t, i=i: np.interp(t, tt, xt[:, i]), None, None)
+        
+        return fncs
+
+    def solve(self, G, DG, time_limit=None, callback=None, stop=None):
         '''
         This method is used to solve the collocation equation system.
         
@@ -378,19 +718,64 @@ class CollocationSystem(object):
         
         DG : callable
             Function for the jacobian.
+        
+        time_limit : float
+            Remaining time of the whole solution process (the solver
+            stops at the smaller one of this and `sol_time_limit`).
+        
+        callback, stop : callable
+            Passed on to the :py:class:`solver.Solver`.
         '''
 
-        logging.debug("Solving Equation System")
+        logger.debug("Solving Equation System")
+        
+        limits = [t for t in (time_limit, self._parameters['sol_time_limit']) if t is not None]
+        
+        x_scale, f_scale = self._solver_scales()
         
         # create our solver
         solver = Solver(F=G, DF=DG, x0=self.guess, tol=self._parameters['tol'],
-                        maxIt=self._parameters['sol_steps'], method=self._parameters['method'])
+                        maxIt=self._parameters['sol_steps'], method=self._parameters['method'],
+                        time_limit=min(limits) if limits else None, callback=callback, stop=stop,
+                        x_scale=x_scale, f_scale=f_scale, min_scale=self._parameters['min_scale'])
         
         # solve the equation system
-        self.sol = solver.solve()
+        try:
+            self.sol = solver.solve()
+        finally:
+            self._close_pool()
+        
+        self.solver_stats = dict(steps=solver.nIt, residual=solver.res, timed_out=solver.timed_out,
+                                 cancelled=solver.cancelled)
         
         return self.sol
 
+    def _solver_scales(self):
+        '''
+        Returns the scales of the free parameters and the equations for the solver.
+        
+        The typical magnitudes of the variables (given as dictionaries
+        `{'x1' : 10.0, ...}`) apply to the free parameters of their splines
+        and to the equations of the state variables, respectively.
+        '''
+        
+        x_scale = self._parameters['x_scale']
+        if isinstance(x_scale, dict):
+            indic = self._get_index_dict()
+            
+            scales = np.ones(self.guess.size)
+            for k in self.trajectories.indep_coeffs.keys():
+                i, j = indic[k]
+                scales[i:j] = x_scale.get(k, 1.0)
+            x_scale = scales
+        
+        f_scale = self._parameters['f_scale']
+        if isinstance(f_scale, dict):
+            scales = np.array([f_scale.get(xx, 1.0) for xx in self.sys.states])
+            f_scale = scales[self._G_states]
+        
+        return x_scale, f_scale
+
     def save(self):
 
         save = dict()
@@ -454,29 +839,25 @@ def collocation_nodes(a, b, npts, coll_type):
         # add left and right borders
         cpts = np.hstack((a, chpts, b))
     else:
-        logging.warning('Unknown type of collocation points.')
-        logging.warning('--> will use equidistant points!')
+        logger.warning('Unknown type of collocation points.')
+        logger.warning('--> will use equidistant points!')
         cpts = np.linspace(a, b, npts, endpoint=True)
     
     return cpts
 
-def _get_derivation_order(fnc):
+def _hermite_cubic(a, b, y0, y1, m0, m1):
     '''
-    Returns derivation order of function according to place in integrator chain.
+    Returns the cubic polynomial on :math:`[a, b]` with values `y0`, `y1`
+    and slopes `m0`, `m1` at the borders.
     '''
-
-    from .splines import Spline
+    T = b - a
     
-    if fnc.im_func == Spline.f.im_func:
-        return 0
-    elif fnc.im_func == Spline.df.im_func:
-        return 1
-    elif fnc.im_func == Spline.ddf.im_func:
-        return 2
-    elif fnc.im_func == Spline.dddf.im_func:
-        return 3
-    else:
-        raise ValueError()
+    def p(t):
+        tau = (np.asarray(t, dtype=float) - a) / T
+        return ((2*tau**3 - 3*tau**2 + 1) * y0 + (tau**3 - 2*tau**2 + tau) * T * m0
+                + (-2*tau**3 + 3*tau**2) * y1 + (tau**3 - tau**2) * T * m1)
+    
+    return p
 
 def _build_sol_from_free_coeffs(splines):
     '''
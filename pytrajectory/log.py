@@ -1,31 +1,48 @@
 import time
 import sys
 import os
+import threading
+from contextlib import contextmanager
 
 import logging
 
-DEBUG = False
-LOG2CONSOLE = True
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
 LOG2FILE = False
 
-# get logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+# get the logger of the package
+# (its records propagate to the handlers of the application,
+#  without any the library stays silent --> see enable_console())
+package_logger = logging.getLogger('pytrajectory')
+package_logger.addHandler(logging.NullHandler())
 
-# log to console
-if LOG2CONSOLE:
-    console_handler = logging.StreamHandler()
-    console_formatter = logging.Formatter(fmt='%(levelname)s: \t %(message)s', datefmt='%d-%m-%Y %H:%M:%S')
-    
-    if DEBUG:
-        console_level = logging.DEBUG
-    else:
-        console_level = logging.INFO
-    
-    console_handler.setFormatter(console_formatter)
-    console_handler.setLevel(console_level)
-    
-    logger.addHandler(console_handler)
+# the handler added by enable_console()
+_console_handler = None
+
+def enable_console(level=logging.INFO):
+    '''
+    Prints the messages of the package logger with at least the given
+    level to the console (e.g. for scripts and the examples).
+
+    Calling it again only changes the level. Applications that configure
+    the logging themselves don't need this, the records propagate to their
+    handlers (but would appear twice if the root logger prints to the
+    console, too).
+    '''
+    global _console_handler
+
+    if _console_handler is None:
+        _console_handler = logging.StreamHandler()
+        _console_handler.setFormatter(logging.Formatter(fmt='%(levelname)s: \t %(message)s',
+                                                        datefmt='%d-%m-%Y %H:%M:%S'))
+        package_logger.addHandler(_console_handler)
+
+    package_logger.setLevel(level)
+
+    return _console_handler
 
 # log to file
 if LOG2FILE:
@@ -39,10 +56,49 @@ if LOG2FILE:
         file_handler.setFormatter(file_formatter)
         file_handler.setLevel(file_level)
     
-        logger.addHandler(file_handler)
+        package_logger.addHandler(file_handler)
+        package_logger.setLevel(file_level)
     except Exception as err:
-        logging.error('Could not create log file!')
-        logging.error('Got message: {}'.format(err))
+        package_logger.error('Could not create log file!')
+        package_logger.error('Got message: {}'.format(err))
+
+
+# the logger that is used in the current thread (see `use_logger`)
+_local = threading.local()
+
+class ContextLogger(object):
+    '''
+    Forwards all logging calls to the logger that is used in the current
+    thread, i.e. to the logger of the control system whose solution process
+    runs in it (see :py:func:`use_logger`) or to the package logger.
+
+    So messages of several solution processes running in parallel threads
+    can be told apart (or silenced) by giving every system its own logger.
+    '''
+    def __getattr__(self, name):
+        return getattr(current_logger(), name)
+
+logger = ContextLogger()
+
+def current_logger():
+    '''
+    Returns the logger that is used in the current thread.
+    '''
+    return getattr(_local, 'logger', None) or package_logger
+
+@contextmanager
+def use_logger(lg):
+    '''
+    Sends the messages of the current thread to the logger `lg`
+    (a :py:class:`logging.Logger` or :py:class:`logging.LoggerAdapter`)
+    while the code block runs (`None` means the package logger).
+    '''
+    previous = getattr(_local, 'logger', None)
+    _local.logger = lg
+    try:
+        yield lg
+    finally:
+        _local.logger = previous
 
 
 class Timer():
@@ -67,4 +123,155 @@ class Timer():
 
     def __exit__(self, *args):
         self.delta = time.time() - self.start
-        logging.debug("---> [%s elapsed %f s]"%(self.label, self.delta))
+        logger.debug("---> [%s elapsed %f s]"%(self.label, self.delta))
+
+
+def _rss():
+    '''
+    Returns the current resident set size of the process in bytes
+    (or `None` if it can't be determined on this platform).
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+class MemoryMonitor(object):
+    '''
+    Provides a context manager that determines the peak memory usage of a code block.
+    
+    The module :py:mod:`tracemalloc` exists since python 3.4, so with python 2
+    the method is always 'rss'. That only yields the start and the peak of the
+    resident set size (sampled every `interval`), and the largest allocations
+    (`top`) stay empty.
+    
+    Parameters
+    ----------
+    
+    label : str
+        The 'name' of the code block which is monitored
+    
+    method : str
+        'tracemalloc' to trace the allocations of python objects (if the module is
+        available), 'rss' to sample the resident set size of the process in a
+        background thread or 'auto' to take the first one available
+    
+    interval : float
+        Sampling interval (in seconds) for the resident set size
+    
+    n_top : int
+        Number of the largest allocations (by source line) to report
+        (only with 'tracemalloc', otherwise none are reported)
+    '''
+    
+    # the monitors that are currently active in every thread (they may be nested)
+    _local = threading.local()
+    
+    def __init__(self, label="~", method='auto', interval=0.001, n_top=5):
+        if method == 'auto':
+            method = 'tracemalloc' if tracemalloc is not None else 'rss'
+        elif method == 'tracemalloc' and tracemalloc is None:
+            logger.warning("Module 'tracemalloc' is not available, sample the resident set size instead")
+            method = 'rss'
+        
+        self.label = label
+        self.method = method
+        self.interval = interval
+        self.n_top = n_top
+        
+        self.start = None
+        self.peak = None
+        self.top = []
+    
+    @property
+    def _active(self):
+        if not hasattr(self._local, 'active'):
+            self._local.active = []
+        return self._local.active
+    
+    def __enter__(self):
+        if self.method == 'tracemalloc':
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            
+            # the peak of enclosing monitors is kept by them (see __exit__)
+            for m in self._active:
+                m._update(tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            
+            self.start = tracemalloc.get_traced_memory()[0]
+            self.peak = self.start
+        else:
+            self.start = _rss()
+            self.peak = self.start
+            
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample)
+            self._thread.daemon = True
+            self._thread.start()
+        
+        self._active.append(self)
+        
+        return self
+    
+    def __exit__(self, *args):
+        self._active.remove(self)
+        
+        if self.method == 'tracemalloc':
+            self._update(tracemalloc.get_traced_memory()[1])
+            
+            snapshot = tracemalloc.take_snapshot()
+            self.top = [(str(stat.traceback), stat.size) for stat in snapshot.statistics('lineno')[:self.n_top]]
+            
+            if self._started_tracing:
+                tracemalloc.stop()
+            
+            # enclosing monitors don't get to see this peak anymore
+            for m in self._active:
+                m._update(self.peak)
+        else:
+            self._stop.set()
+            self._thread.join()
+            self._update(_rss())
+        
+        logger.debug("---> [%s peak memory %s bytes]"%(self.label, self.peak))
+    
+    def _update(self, value):
+        if value is not None and (self.peak is None or value > self.peak):
+            self.peak = value
+    
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._update(_rss())
+    
+    def result(self):
+        '''
+        Returns the memory usage at the start, the peak (in bytes) and
+        the largest allocations of the monitored code block.
+        '''
+        return dict(method=self.method, start=self.start, peak=self.peak, top=self.top)
+
+
+@contextmanager
+def track_memory(phases, label, method=None):
+    '''
+    Monitors the memory usage of a code block (see :py:class:`MemoryMonitor`) and
+    stores the result in the dictionary `phases` with the key `label`.
+    
+    If `method` is `None` or `False` nothing is monitored.
+    '''
+    if not method:
+        yield
+    else:
+        if method is True:
+            method = 'auto'
+        
+        monitor = MemoryMonitor(label, method=method)
+        with monitor:
+            yield
+        
+        phases[label] = monitor.result()
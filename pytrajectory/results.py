@@ -0,0 +1,565 @@
+# IMPORTS
+import numpy as np
+import zipfile
+import struct
+import json
+import tempfile
+import os
+
+# NOTE:
+# This module should only depend on numpy and the standard library
+# so that stored results can be loaded without any symbolic computations.
+
+
+# names of the spline methods that evaluate the spline and its derivatives
+# (in the order of the derivatives)
+_DERIVATIVES = ('f', 'df', 'ddf', 'dddf')
+
+
+def _variable_source(fnc):
+    '''
+    Returns the tag of the spline, the derivation order, the scale and offset
+    and the saturation limits (or `None`) that belong to the solution function
+    `fnc` of a variable.
+    '''
+
+    # the solution functions of constrained variables are compositions
+    # of a saturation function and a spline (--> auxiliary.saturation_functions)
+    limits = getattr(fnc, 'saturation_limits', None)
+    if limits is not None:
+        fnc = fnc.y_fnc
+
+    # elements of integrator chains with affine relations
+    # (--> splines.SplineFunction)
+    if hasattr(fnc, 'spline'):
+        return fnc.spline.tag, fnc.d, (fnc.scale, fnc.offset), limits
+
+    # all other solution functions are methods of the spline objects
+    # (`im_self` is the spline, `im_func` the method)
+    return fnc.im_self.tag, _DERIVATIVES.index(fnc.im_func.__name__), (1.0, 0.0), limits
+
+def _json_default(obj):
+    # numpy scalars and arrays that may be part of the parameters
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return str(obj)
+
+def _boundary_arrays(sys):
+    # the boundary values of a dynamical system (`nan` if not given)
+    def _bv(names, k):
+        return np.array([np.nan if sys.boundary_values[v][k] is None else sys.boundary_values[v][k]
+                         for v in names], dtype=float)
+
+    return dict(xa=_bv(sys.states, 0), xb=_bv(sys.states, 1),
+                ua=_bv(sys.inputs, 0), ub=_bv(sys.inputs, 1))
+
+def collect_results(S):
+    '''
+    Collects the arrays that represent the solution of a control system
+    (see :py:func:`save_results`).
+    '''
+
+    traj = S.eqs.trajectories
+
+    # the original system (with constrained variables)
+    if S.constraints:
+        sys = S._dyn_sys_orig
+    else:
+        sys = S.dyn_sys
+
+    arrays = dict()
+    arrays['a'] = np.array(sys.a, dtype=float)
+    arrays['b'] = np.array(sys.b, dtype=float)
+    arrays['states'] = np.array(sys.states)
+    arrays['inputs'] = np.array(sys.inputs)
+
+    # boundary values
+    arrays.update(_boundary_arrays(sys))
+
+    # splines
+    tags = sorted(traj.splines.keys())
+    arrays['spline_tags'] = np.array(tags)
+    arrays['spline_info'] = np.array([[s.a, s.b, s.n, s._use_std_approach]
+                                      for s in (traj.splines[t] for t in tags)], dtype=float)
+    for t in tags:
+        arrays['coeffs/' + t] = np.array(traj.splines[t]._coeffs, dtype=float)
+
+    # which variable is represented by which spline (derivative)
+    fncs = [traj.x_fnc[x] for x in sys.states] + [traj.u_fnc[u] for u in sys.inputs]
+    var_spline, var_order, var_affine, var_limits = [], [], [], []
+    for fnc in fncs:
+        tag, order, affine, limits = _variable_source(fnc)
+        var_spline.append(tags.index(tag))
+        var_order.append(order)
+        var_affine.append(affine)
+        var_limits.append(limits if limits is not None else (np.nan, np.nan))
+
+    arrays['var_spline'] = np.array(var_spline, dtype=int)
+    arrays['var_order'] = np.array(var_order, dtype=int)
+    arrays['var_affine'] = np.array(var_affine, dtype=float).reshape(-1, 2)
+    arrays['var_limits'] = np.array(var_limits, dtype=float).reshape(-1, 2)
+
+    # simulation results
+    sim_data = getattr(S, 'sim_data', None)
+    if sim_data is not None:
+        arrays['sim_t'], arrays['sim_x'], arrays['sim_u'] = [np.asarray(d, dtype=float) for d in sim_data[:3]]
+
+    # state and parameters
+    arrays['nIt'] = np.array(getattr(S, 'nIt', 0))
+    arrays['reached_accuracy'] = np.array(bool(S.reached_accuracy))
+
+    parameters = {'sys' : S._parameters,
+                  'eqs' : S.eqs._parameters,
+                  'traj' : traj._parameters}
+    arrays['parameters'] = np.array(json.dumps(parameters, sort_keys=True, default=_json_default))
+
+    return arrays
+
+def save_results(S, fname):
+    '''
+    Saves the solution of a control system in a compact binary format.
+
+    The file is an uncompressed `.npz` archive which contains only plain
+    numeric (and string) arrays:
+
+    ==================== ==================================================================
+    member               content
+    ==================== ==================================================================
+    a, b                 The borders of the time interval
+    states, inputs       The names of the state and input variables
+    xa, xb, ua, ub       The boundary values (`nan` if not given)
+    spline_tags          The names of the splines
+    spline_info          For every spline: `a`, `b`, number of parts `n`, `use_std_approach`
+    coeffs/<tag>         The `(n, 4)` array of polynomial coefficients of a spline
+    var_spline           For every variable (states, then inputs): index of its spline
+    var_order            For every variable: the derivative of its spline
+    var_affine           For every variable: scale and offset applied to the spline derivative
+    var_limits           For every variable: the saturation limits (`nan` if unconstrained)
+    sim_t, sim_x, sim_u  The simulation results
+    nIt                  Number of iterations
+    reached_accuracy     Whether the desired accuracy was reached
+    parameters           The method parameters (JSON string)
+    ==================== ==================================================================
+
+    Parameters
+    ----------
+
+    S : system.ControlSystem
+        The (solved) control system.
+
+    fname : str
+        The name of the file (the extension `.npz` will be added if necessary).
+
+    Returns
+    -------
+
+    dict
+        The stored arrays.
+    '''
+
+    arrays = collect_results(S)
+
+    # no compression, so that the arrays can be memory mapped
+    np.savez(fname, **arrays)
+
+    return arrays
+
+def load_results(fname, mmap_mode='r'):
+    '''
+    Loads results saved by :py:func:`save_results`.
+
+    Parameters
+    ----------
+
+    fname : str
+        The name of the file.
+
+    mmap_mode : str
+        Mode for memory mapping the arrays (see :py:class:`numpy.memmap`)
+        or `None` to read them into memory.
+
+    Returns
+    -------
+
+    Results
+    '''
+    return Results(fname, mmap_mode=mmap_mode)
+
+
+def save_checkpoint(S, fname):
+    '''
+    Saves the state of the solution process of a control system after an
+    iteration, so that it can be continued later (see :py:meth:`system.ControlSystem.resume`).
+
+    The file is an uncompressed `.npz` archive that is replaced atomically,
+    so an interrupted process leaves the previous checkpoint intact:
+
+    ==================== ==================================================================
+    member               content
+    ==================== ==================================================================
+    states, inputs       The names of the state and input variables
+    a, b                 The borders of the time interval
+    xa, xb, ua, ub       The boundary values of the (unconstrained) system
+    nIt                  Number of finished iterations
+    n_parts_x, n_parts_u The number of spline parts of the last iteration
+    sol, guess           The free parameters found in the last iteration and the guess
+    reached_accuracy     Whether the desired accuracy was reached
+    best/<key>           The best iteration so far (`nIt`, `n_parts_x`, `n_parts_u`, `sol`,
+                         `guess`, `reached_accuracy` and the boundary error `err`)
+    iterations           The statistics of the iterations (JSON string)
+    solver               The statistics of the last run of the eqs solver (JSON string)
+    ==================== ==================================================================
+    '''
+
+    if not fname.endswith('.npz'):
+        fname += '.npz'
+
+    traj = S.eqs.trajectories
+    sys = S.dyn_sys
+
+    arrays = dict()
+    arrays['states'] = np.array(sys.states)
+    arrays['inputs'] = np.array(sys.inputs)
+    arrays['a'] = np.array(sys.a, dtype=float)
+    arrays['b'] = np.array(sys.b, dtype=float)
+    arrays.update(_boundary_arrays(sys))
+
+    arrays['nIt'] = np.array(S.nIt)
+    arrays['n_parts_x'] = np.array(traj.n_parts_x)
+    arrays['n_parts_u'] = np.array(traj.n_parts_u)
+    arrays['sol'] = np.asarray(S.eqs.sol, dtype=float)
+    arrays['guess'] = np.asarray(S.eqs.guess, dtype=float)
+    arrays['reached_accuracy'] = np.array(bool(S.reached_accuracy))
+
+    for k, v in S._best.items():
+        arrays['best/' + k] = np.asarray(v, dtype=float) if k in ('sol', 'guess', 'err') else np.array(v)
+
+    arrays['iterations'] = np.array(json.dumps(S.stats['iterations'], default=_json_default))
+    arrays['solver'] = np.array(json.dumps(S.eqs.solver_stats, default=_json_default))
+
+    # write a temporary file (with a unique name in the same directory,
+    # so concurrent writers don't interfere) and replace the old checkpoint by it
+    fd, tmp_fname = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(fname) + '.',
+                                     dir=os.path.dirname(fname) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+
+        if os.name == 'nt' and os.path.exists(fname):
+            # (renaming doesn't replace existing files on windows)
+            os.remove(fname)
+        os.rename(tmp_fname, fname)
+    except:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+
+    return arrays
+
+def load_checkpoint(fname):
+    '''
+    Loads a checkpoint saved by :py:func:`save_checkpoint`.
+
+    Returns
+    -------
+
+    dict
+        The state of the solution process (with plain python values
+        for the scalars and the statistics).
+    '''
+
+    if not fname.endswith('.npz') and not os.path.exists(fname):
+        fname += '.npz'
+
+    R = Results(fname, mmap_mode=None)
+
+    cp = dict()
+    for k in ('a', 'b', 'xa', 'xb', 'ua', 'ub', 'sol', 'guess'):
+        cp[k] = np.array(R[k])
+    for k in ('states', 'inputs'):
+        cp[k] = tuple(str(v) for v in R[k])
+    for k in ('nIt', 'n_parts_x', 'n_parts_u'):
+        cp[k] = int(R[k])
+    cp['reached_accuracy'] = bool(R['reached_accuracy'])
+
+    cp['best'] = dict()
+    for k in R.keys():
+        if k.startswith('best/'):
+            v = R[k]
+            cp['best'][k[5:]] = np.array(v) if v.ndim > 0 else v.item()
+    cp['best']['reached_accuracy'] = bool(cp['best']['reached_accuracy'])
+
+    cp['iterations'] = json.loads(str(R['iterations']))
+    cp['solver'] = json.loads(str(R['solver']))
+
+    return cp
+
+class Results(object):
+    '''
+    Provides (read only) access to the arrays of a result file.
+
+    Only the directory of the archive is read when the object is created.
+    The arrays are loaded on first access; uncompressed arrays are not read
+    at all but memory mapped.
+
+    Parameters
+    ----------
+
+    fname : str
+        The name of the file.
+
+    mmap_mode : str
+        Mode for memory mapping the arrays or `None` to read them into memory.
+    '''
+
+    def __init__(self, fname, mmap_mode='r'):
+        self.fname = fname
+        self._mmap_mode = mmap_mode
+
+        # the members of the archive
+        zf = zipfile.ZipFile(fname)
+        try:
+            self._members = dict((info.filename[:-4], info) for info in zf.infolist()
+                                 if info.filename.endswith('.npy'))
+        finally:
+            zf.close()
+
+        self._arrays = dict()
+
+    def keys(self):
+        return sorted(self._members.keys())
+
+    def __contains__(self, key):
+        return key in self._members
+
+    def __getitem__(self, key):
+        if key not in self._arrays:
+            if key not in self._members:
+                raise KeyError(key)
+            self._arrays[key] = self._load(self._members[key])
+        return self._arrays[key]
+
+    def _load(self, info):
+        '''
+        Memory maps or reads the array of the archive member `info`.
+        '''
+
+        if self._mmap_mode is not None and info.compress_type == zipfile.ZIP_STORED:
+            with open(self.fname, 'rb') as fid:
+                # skip the local file header of the member
+                # (its size is 30 bytes plus the lengths of the name and extra field)
+                fid.seek(info.header_offset)
+                header = fid.read(30)
+                n_name, n_extra = struct.unpack('<HH', header[26:30])
+                fid.seek(info.header_offset + 30 + n_name + n_extra)
+
+                # read the header of the .npy data
+                version = np.lib.format.read_magic(fid)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fid)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fid)
+                offset = fid.tell()
+
+            # scalars and empty arrays are not worth (or can't be) mapped
+            if not dtype.hasobject and len(shape) > 0 and np.prod(shape) > 0:
+                return np.memmap(self.fname, dtype=dtype, mode=self._mmap_mode, offset=offset,
+                                 shape=shape, order='F' if fortran_order else 'C')
+
+        zf = zipfile.ZipFile(self.fname)
+        try:
+            return np.lib.format.read_array(zf.open(info), allow_pickle=False)
+        finally:
+            zf.close()
+
+    @property
+    def parameters(self):
+        '''
+        The method parameters of the control system.
+        '''
+        return json.loads(str(self['parameters']))
+
+    @property
+    def coeffs(self):
+        '''
+        Dictionary with the coefficient arrays of all splines.
+        '''
+        return dict((t, self['coeffs/' + t]) for t in self['spline_tags'])
+
+
+def _shift_coeffs(C, h):
+    '''
+    Returns the coefficients of the polynomials :math:`p_i(\\tau) = q_i(\\tau - h)`
+    for the cubic polynomials :math:`q_i` given by the rows of `C` (highest degree first).
+    '''
+    c0, c1, c2, c3 = C.T
+    return np.column_stack((c0,
+                            c1 - 3.0*c0*h,
+                            c2 - 2.0*c1*h + 3.0*c0*h**2,
+                            c3 - c2*h + c1*h**2 - c0*h**3))
+
+def _deriv_coeffs(C, d=1):
+    '''
+    Returns the coefficients of the `d`-th derivative of the cubic polynomials
+    given by the rows of `C` (padded to the same shape).
+    '''
+    for _ in xrange(d):
+        C = np.column_stack((np.zeros(C.shape[0]), C[:,:3] * [3.0, 2.0, 1.0]))
+    return C
+
+def _saturation(y, dy, y0, y1):
+    '''
+    Evaluates the saturation function and its time derivative
+    (see :py:func:`auxiliary.saturation_expressions`).
+    '''
+    m = 4.0/(y1 - y0)
+    e = np.exp(m * y)
+    return y1 - (y1 - y0)/(1.0 + e), dy * (4.0 * e)/(1.0 + e)**2
+
+
+class TrajectoryEvaluator(object):
+    '''
+    Evaluates the solution of a control system using numpy only.
+
+    Every variable is represented by piecewise cubic polynomials in the
+    local coordinate :math:`\\tau = t - a - i h` of the part :math:`i` it belongs to,
+    no matter which spline approach was used while solving.
+    The saturation functions of constrained variables are already applied.
+
+    The functions :py:meth:`x`, :py:meth:`u` and :py:meth:`dx` accept
+    scalars (returning arrays of shape `(n,)`) as well as arrays of time points
+    (returning arrays of shape `(len(t), n)`).
+
+    Parameters
+    ----------
+
+    data : mapping
+        Either the arrays of the result format (see :py:func:`save_results`
+        and :py:func:`load_results`) or those of a saved evaluator (see :py:meth:`save`).
+    '''
+
+    def __init__(self, data):
+        self.a = float(data['a'])
+        self.b = float(data['b'])
+        self.states = tuple(str(x) for x in data['states'])
+        self.inputs = tuple(str(u) for u in data['inputs'])
+
+        names = self.states + self.inputs
+
+        if 'spline_tags' in data:
+            # the result format: look up the spline (derivative) of every variable
+            tags = [str(t) for t in data['spline_tags']]
+            info = np.asarray(data['spline_info'])
+
+            coeffs = []
+            for k in xrange(len(names)):
+                s = data['var_spline'][k]
+                a, b, n, use_std_approach = info[s]
+                C = np.array(data['coeffs/' + tags[s]], dtype=float)
+
+                # the polynomials of the non standard approach
+                # are evaluated relative to the right node of their part
+                if not use_std_approach:
+                    C = _shift_coeffs(C, (b - a) / n)
+
+                C = _deriv_coeffs(C, data['var_order'][k])
+
+                # elements of integrator chains with affine relations
+                # (missing in files of older versions)
+                if 'var_affine' in data:
+                    scale, offset = data['var_affine'][k]
+                    C = scale * C
+                    C[:,-1] += offset
+
+                coeffs.append(C)
+        else:
+            coeffs = [np.array(data['coeffs/' + v], dtype=float) for v in names]
+
+        self._coeffs = coeffs
+        self._dcoeffs = [_deriv_coeffs(C) for C in coeffs]
+        self._limits = np.array(data['var_limits'], dtype=float).reshape(-1, 2)
+
+        self._n_states = len(self.states)
+
+    @classmethod
+    def from_system(cls, S):
+        '''
+        Creates the evaluator for the solution of the control system `S`.
+        '''
+        return cls(collect_results(S))
+
+    @classmethod
+    def load(cls, fname, mmap_mode='r'):
+        '''
+        Loads an evaluator saved by :py:meth:`save` (or from a result file).
+        '''
+        return cls(Results(fname, mmap_mode=mmap_mode))
+
+    def save(self, fname):
+        '''
+        Saves the evaluator, i.e. just the piecewise polynomials
+        of all variables and the saturation limits.
+        '''
+        arrays = dict(('coeffs/' + v, C) for v, C in zip(self.states + self.inputs, self._coeffs))
+        arrays['a'] = np.array(self.a)
+        arrays['b'] = np.array(self.b)
+        arrays['states'] = np.array(self.states)
+        arrays['inputs'] = np.array(self.inputs)
+        arrays['var_limits'] = self._limits
+
+        np.savez(fname, **arrays)
+
+    def _eval(self, C, t):
+        '''
+        Evaluates the piecewise polynomials `C` at the time points `t` (Horner scheme).
+        '''
+        n = C.shape[0]
+        h = (self.b - self.a) / n
+
+        i = np.clip(np.floor((t - self.a) / h).astype(int), 0, n - 1)
+        tau = t - self.a - i * h
+
+        c = C[i]
+
+        return ((c[:,0] * tau + c[:,1]) * tau + c[:,2]) * tau + c[:,3]
+
+    def _evaluate(self, indices, t, d=0):
+        '''
+        Evaluates the variables given by `indices` (or their 1st derivatives if `d` is 1).
+        '''
+        tt = np.clip(np.atleast_1d(np.asarray(t, dtype=float)), self.a, self.b)
+        res = np.empty((tt.size, len(indices)))
+
+        for j, k in enumerate(indices):
+            y0, y1 = self._limits[k]
+
+            if np.isnan(y0):
+                res[:,j] = self._eval(self._dcoeffs[k] if d else self._coeffs[k], tt)
+            else:
+                # constrained variable: apply the saturation function
+                y = self._eval(self._coeffs[k], tt)
+                dy = self._eval(self._dcoeffs[k], tt) if d else 0.0
+                psi, dpsi = _saturation(y, dy, y0, y1)
+                res[:,j] = dpsi if d else psi
+
+        if np.ndim(t) == 0:
+            return res[0]
+        return res
+
+    def x(self, t):
+        '''
+        Returns the values of the state variables at `t`.
+        '''
+        return self._evaluate(xrange(self._n_states), t)
+
+    def u(self, t):
+        '''
+        Returns the values of the input variables at `t`.
+        '''
+        return self._evaluate(xrange(self._n_states, len(self._coeffs)), t)
+
+    def dx(self, t):
+        '''
+        Returns the 1st derivatives of the state variables at `t`.
+        '''
+        return self._evaluate(xrange(self._n_states), t, d=1)
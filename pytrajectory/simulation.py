@@ -1,5 +1,10 @@
 import numpy as np
 from scipy.integrate import ode
+import threading
+
+# the integrator 'vode' keeps its state in global (Fortran) variables
+# so only one simulation can run at a time (see Simulator.simulate())
+_integrator_lock = threading.Lock()
 
 class Simulator(object):
     '''
@@ -21,13 +26,35 @@ class Simulator(object):
 
     dt : float
         Time step.
+
+    x_bound : float
+        The simulation is aborted if the absolute value of a state variable exceeds this bound.
+
+    reference : callable
+        Function of the state variables (e.g. the spline trajectories) the simulated
+        states are compared with (entries that are `nan` are not compared).
+
+    max_deviation : float
+        The simulation is aborted if a state variable deviates more than this from
+        the `reference`.
+
+    After the simulation the attribute `status` tells why it stopped: ``'finished'``
+    (end time reached), ``'nonfinite'`` (the state is not finite anymore), ``'bound'``,
+    ``'deviation'`` or ``'failed'`` (the integrator failed). The simulation data of
+    an aborted simulation end with the last finite state.
     '''
 
-    def __init__(self, ff, T, start, u, dt=0.01):
+    def __init__(self, ff, T, start, u, dt=0.01, x_bound=None, reference=None, max_deviation=None):
         self.ff = ff
         self.T = T
         self.u = u
         self.dt = dt
+        
+        # criteria to abort the simulation
+        self.x_bound = x_bound
+        self.reference = reference
+        self.max_deviation = max_deviation
+        self.status = None
 
         # this is where the solutions go
         self.xt = []
@@ -44,6 +71,9 @@ class Simulator(object):
         #initialise our ode solver
         self.solver = ode(self.rhs)
         self.solver.set_initial_value(start)
+        self._set_integrator()
+    
+    def _set_integrator(self):
         self.solver.set_integrator('vode', method='adams', rtol=1e-6)
         #self.solver.set_integrator('lsoda', rtol=1e-6)
         #self.solver.set_integrator('dop853', rtol=1e-6)
@@ -66,13 +96,34 @@ class Simulator(object):
         x = list(self.solver.integrate(self.solver.t+self.dt))
         t = round(self.solver.t, 5)
 
-        if 0 <= t <= self.T:
+        if not np.all(np.isfinite(x)):
+            self.status = 'nonfinite'
+        elif not self.solver.successful():
+            self.status = 'failed'
+        elif 0 <= t <= self.T:
             self.xt.append(x)
             self.ut.append(self.u(t))
             self.t.append(t)
+            
+            self.status = self._check_state(t, x)
 
         return t, x
 
+    def _check_state(self, t, x):
+        '''
+        Returns the reason to abort the simulation in the state `x`
+        at time `t` (or `None`).
+        '''
+        if self.x_bound is not None and np.max(np.abs(x)) > self.x_bound:
+            return 'bound'
+        
+        if self.reference is not None and self.max_deviation is not None:
+            with np.errstate(invalid='ignore'):
+                if np.any(np.abs(np.asarray(x) - self.reference(t)) > self.max_deviation):
+                    return 'deviation'
+        
+        return None
+
     def simulate(self):
         '''
         Starts the simulation
@@ -84,6 +135,15 @@ class Simulator(object):
         List of numpy arrays with time steps and simulation data of system and input variables.
         '''
         t = 0
-        while t <= self.T:
-            t, y = self.calcStep()
+        self.status = None
+        with _integrator_lock:
+            # another simulator may have used the integrator since this one was created
+            self._set_integrator()
+            
+            while t <= self.T and self.status is None:
+                t, y = self.calcStep()
+        
+        if self.status is None:
+            self.status = 'finished'
+        
         return [np.array(self.t), np.array(self.xt), np.array(self.ut)]
@@ -1,8 +1,9 @@
 import numpy as np
 from numpy.linalg import solve, norm
 import scipy as scp
+import time
 
-from log import logging
+from log import logger
 
 
 
@@ -31,9 +32,35 @@ class Solver:
     
     method : str
         The solver to use
+    
+    time_limit : float
+        Maximum number of seconds for the solver (it returns the best
+        solution found so far if this is exceeded)
+    
+    callback : callable
+        Is called with the step number and the residual after every step
+    
+    stop : callable
+        The solver stops (returning the best solution found so far)
+        as soon as this returns `True`
+    
+    x_scale : str or numpy.ndarray
+        Scaling of the variables: 'jacobian' to use the (largest so far) column
+        norms of the jacobian or an array of their typical magnitudes
+        (see :ref:`levenberg_marquardt`)
+    
+    f_scale : str or numpy.ndarray
+        Scaling of the equations: 'jacobian' to use the row norms of the
+        jacobian in the start value or an array of their typical magnitudes
+        (the tolerance still refers to the unscaled equations)
+    
+    min_scale : float
+        Lower bound of the scales relative to the largest one (smaller ones are
+        raised to it), the default is the square root of the machine epsilon
     '''
     
-    def __init__(self, F, DF, x0, tol=1e-5, maxIt=100, method='leven'):
+    def __init__(self, F, DF, x0, tol=1e-5, maxIt=100, method='leven', time_limit=None,
+                 callback=None, stop=None, x_scale=None, f_scale=None, min_scale=None):
         self.F = F
         self.DF = DF
         self.x0 = x0
@@ -41,8 +68,21 @@ class Solver:
         self.reltol = 2e-5
         self.maxIt = maxIt
         self.method = method
+        self.time_limit = time_limit
+        self.callback = callback
+        self.stop = stop
+        self.x_scale = x_scale
+        self.f_scale = f_scale
+        self.min_scale = np.sqrt(np.finfo(float).eps) if min_scale is None else min_scale
         
         self.sol = None
+        
+        # number of steps, residual of the solution and whether the
+        # time limit was exceeded or the solver was stopped otherwise
+        self.nIt = 0
+        self.res = None
+        self.timed_out = False
+        self.cancelled = False
     
 
     def solve(self):
@@ -52,11 +92,11 @@ class Solver:
         '''
         
         if (self.method == 'leven'):
-            logging.debug("Run Levenberg-Marquardt method")
+            logger.debug("Run Levenberg-Marquardt method")
             self.leven()
         
         if (self.sol is None):
-            logging.warning("Wrong solver, returning initial value.")
+            logger.warning("Wrong solver, returning initial value.")
             return self.x0
         else:
             return self.sol
@@ -68,12 +108,62 @@ class Solver:
         to solve nonlinear least squares problems.
         
         For more information see: :ref:`levenberg_marquardt`
+        
+        Only steps that reduce the residual are accepted, so if the time limit
+        is exceeded (or the solver is stopped) the current value is the best
+        one found so far.
+        
+        If the variables are scaled, the steps are computed for the scaled variables
+        :math:`D x` with the diagonal matrix :math:`D` of their (relative) scales, which
+        equilibrates the columns of the jacobian and replaces the damping term
+        :math:`\mu^2 I` by :math:`\mu^2 D^2` (like in MINPACK). If the equations are
+        scaled, the residual of the weighted equations is minimized.
         '''
+        if self.time_limit is not None:
+            deadline = time.time() + self.time_limit
+        else:
+            deadline = None
+        
+        def interrupted():
+            if deadline is not None and time.time() > deadline:
+                self.timed_out = True
+            elif self.stop is not None and self.stop():
+                self.cancelled = True
+            
+            return self.timed_out or self.cancelled
+        
         i = 0
         x = self.x0
         res = 1
         res_alt = -1
         
+        # weights of the equations (fixed for the whole run)
+        w = None
+        if isinstance(self.f_scale, str):
+            DFx0 = scp.sparse.csr_matrix(self.DF(x))
+            w = 1.0 / _normalized(np.sqrt(np.asarray(DFx0.multiply(DFx0).sum(axis=1)).ravel()),
+                                  self.min_scale)
+        elif self.f_scale is not None:
+            w = 1.0 / _normalized(np.asarray(self.f_scale, dtype=float), self.min_scale)
+        
+        def weighted(Fx):
+            return Fx if w is None else w * Fx
+        
+        def unweighted_norm(Fx):
+            return norm(Fx) if w is None else norm(Fx / w)
+        
+        def jacobian(DFx):
+            DFx = scp.sparse.csr_matrix(DFx)
+            return DFx if w is None else scp.sparse.diags(w).dot(DFx).tocsr()
+        
+        # the jacobian in the current value (if already known)
+        DFx = jacobian(DFx0) if isinstance(self.f_scale, str) else None
+        
+        # scales of the variables
+        d = None
+        if self.x_scale is not None and not isinstance(self.x_scale, str):
+            d = 1.0 / _normalized(np.asarray(self.x_scale, dtype=float), self.min_scale)
+        
         eye = scp.sparse.identity(len(self.x0))
 
         #mu = 1.0
@@ -87,25 +177,44 @@ class Solver:
 
         reltol = self.reltol
         
-        Fx = self.F(x)
+        Fx = weighted(self.F(x))
         
         while((res > self.tol) and (self.maxIt > i) and (abs(res-res_alt) > reltol)):
+            if interrupted():
+                break
+            
             i += 1
             
             #if (i-1)%4 == 0:
-            DFx = self.DF(x)
-            DFx = scp.sparse.csr_matrix(DFx)
+            if DFx is None:
+                DFx = jacobian(self.DF(x))
+            
+            if isinstance(self.x_scale, str):
+                col_norms = np.sqrt(np.asarray(DFx.multiply(DFx).sum(axis=0)).ravel())
+                d = col_norms if d is None else np.maximum(d, col_norms)
+            
+            if d is not None:
+                # the steps are computed for the scaled variables `D * x`
+                # (relative to the largest scale, so `mu` keeps its magnitude)
+                D_inv = scp.sparse.diags(1.0 / _normalized(d, self.min_scale))
+                DFx_scaled = DFx.dot(D_inv)
+            else:
+                D_inv = None
+                DFx_scaled = DFx
             
             while (roh < b0):                
-                A = DFx.T.dot(DFx) + mu**2*eye
+                A = DFx_scaled.T.dot(DFx_scaled) + mu**2*eye
 
-                b = DFx.T.dot(Fx)
+                b = DFx_scaled.T.dot(Fx)
                     
                 s = -scp.sparse.linalg.spsolve(A,b)
+                
+                if D_inv is not None:
+                    s = D_inv.dot(s)
 
                 xs = x + np.array(s).flatten()
                 
-                Fxs = self.F(xs)
+                Fxs = weighted(self.F(xs))
 
                 normFx = norm(Fx)
                 normFxs = norm(Fxs)
@@ -114,8 +223,12 @@ class Solver:
                 
                 if (roh<=b0): mu = 2.0*mu
                 if (roh>=b1): mu = 0.5*mu
-                #logging.debug("  roh= %f    mu= %f"%(roh,mu))
-                logging.debug('  mu = {}'.format(mu))
+                #logger.debug("  roh= %f    mu= %f"%(roh,mu))
+                logger.debug('  mu = {}'.format(mu))
+                
+                if (roh < b0) and interrupted():
+                    # don't accept the rejected step
+                    break
                 
                 # the following was believed to be some kind of bug, hence the warning
                 # but that was not the case...
@@ -124,16 +237,37 @@ class Solver:
                     #from IPython import embed as IPS
                     #IPS()
             
-            Fx = Fxs
-            x = xs
+            if self.timed_out or self.cancelled:
+                break
             
             roh = 0.0
             res_alt = res
-            res = normFx
-            logging.debug("nIt= %d    res= %f"%(i,res))
+            res = normFx if w is None else unweighted_norm(Fx)
+            
+            Fx = Fxs
+            x = xs
+            DFx = None
+            logger.debug("nIt= %d    res= %f"%(i,res))
+            
+            if self.callback is not None:
+                self.callback(i, unweighted_norm(Fxs))
             
             # NEW - experimental
             #if res<1.0:
             #    reltol = 1e-3
 
+        if self.timed_out:
+            logger.warning("Time limit of the solver ({} s) exceeded after {} steps".format(self.time_limit, i))
+        elif self.cancelled:
+            logger.info("Solver stopped after {} steps".format(i))
+
+        self.nIt = i
+        self.res = unweighted_norm(Fx)
         self.sol = x
+
+
+def _normalized(scales, min_scale):
+    # relative to the largest scale (variables or equations with a vanishing
+    # scale remain unscaled and the ratios are bounded to keep the steps accurate)
+    scales = np.where(scales > 0, scales, 1.0)
+    return np.maximum(scales / scales.max(), min_scale)
@@ -1,9 +1,9 @@
 import numpy as np
 import sympy as sp
 import scipy.sparse as sparse
-from scipy.sparse.linalg import spsolve
+from scipy.sparse.linalg import spsolve, splu
 
-from log import logging
+from log import logger
 
 # DEBUG
 from IPython import embed as IPS
@@ -40,10 +40,14 @@ class Spline(object):
     use_std_approach : bool
         Whether to use the standard spline interpolation approach
         or the ones used in the project thesis
+    
+    use_dep_operator : bool
+        Whether to keep the solution of the smoothness conditions as a
+        factored sparse operator instead of dense dependence arrays
     '''
 
-    def __init__(self, a=0.0, b=1.0, n=5, bv={},
-                 tag='', use_std_approach=False, **kwargs):
+    def __init__(self, a=0.0, b=1.0, n=5, bv=None,
+                 tag='', use_std_approach=False, use_dep_operator=False, **kwargs):
         # there are two different approaches implemented for evaluating
         # the splines which mainly differ in the node that is used in the 
         # evaluation of the polynomial parts
@@ -74,7 +78,8 @@ class Spline(object):
         # dictionary with boundary values
         #   key: order of the spline's derivative to which the values belong
         #   values: the boundary values the derivative should satisfy
-        self._boundary_values = bv
+        # (a copy, because it is completed later --> see `Trajectory.init_splines`)
+        self._boundary_values = dict(bv) if bv is not None else dict()
         
         # create array of symbolic coefficients
         self._coeffs = sp.symarray('c'+tag, (self.n, 4))
@@ -103,6 +108,13 @@ class Spline(object):
         self._dep_array = None  #np.array([])
         self._dep_array_abs = None  #np.array([])
         
+        # if desired, the dependence arrays are not stored explicitly
+        # (their size grows quadratically with the number of spline parts)
+        # but represented by an operator that applies them on demand
+        # --> see DependenceOperator
+        self._use_dep_operator = use_dep_operator
+        self._dep_op = None
+        
         # steady flag is True if smoothness and boundary conditions are solved
         # --> make_steady()
         self._steady_flag = False
@@ -127,7 +139,8 @@ class Spline(object):
         # respectively other approach
         S = Spline(a=self.a, b=self.b, n=self.n,
                    bv=self._boundary_values,
-                   use_std_approach=not self._use_std_approach)
+                   use_std_approach=not self._use_std_approach,
+                   use_dep_operator=self._use_dep_operator)
         
         # solve smoothness conditions to get dependence arrays
         S.make_steady()
@@ -135,6 +148,7 @@ class Spline(object):
         # copy the attributes of the spline
         self._dep_array = S._dep_array
         self._dep_array_abs = S._dep_array_abs
+        self._dep_op = S._dep_op
         
         # compute the equivalent coefficients (all at once)
         switched_coeffs = _switch_coeffs(S=self, all_coeffs=True)
@@ -157,13 +171,16 @@ class Spline(object):
         Parameters
         ----------
         
-        t : float
-            The point at which to evaluate the spline `d`-th derivative
+        t : float or numpy.ndarray
+            The point(s) at which to evaluate the spline `d`-th derivative
         
         d : int
             The derivation order
         '''
         
+        if not np.isscalar(t):
+            return self._eval_array(np.asarray(t, dtype=float), d)
+        
         # get polynomial part where t is in
         i = int(np.floor(t * self.n / self.b))
         if i == self.n: i -= 1
@@ -173,6 +190,34 @@ class Spline(object):
         else:
             return self._P[i].deriv(d)(t - (i+1)*self._h)
     
+    def _eval_array(self, t, d=0):
+        '''
+        Vectorized counterpart of :py:meth:`_eval` for an array of points.
+        '''
+        
+        # get polynomial parts the points are in
+        i = np.floor(t * self.n / self.b).astype(int)
+        i = np.clip(i, 0, self.n - 1)
+        
+        # coefficients of the `d`-th derivatives of the polynomial parts
+        # (highest order first, like those of `numpy.poly1d`)
+        C = np.asarray(self._coeffs, dtype=float)
+        for k in xrange(d):
+            C = C[:,:-1] * np.arange(C.shape[1] - 1, 0, -1)
+        
+        if self._use_std_approach:
+            tau = t - i * self._h
+        else:
+            tau = t - (i + 1) * self._h
+        
+        # evaluate the polynomials using horner's method
+        C = C[i]
+        values = np.zeros(t.shape)
+        for k in xrange(C.shape[-1]):
+            values = values * tau + C[...,k]
+        
+        return values
+    
     def f(self, t):
         '''This is just a wrapper to evaluate the spline itself.'''
         if not self._prov_flag:
@@ -237,43 +282,62 @@ class Spline(object):
         spline's or its `d`-th derivative's coefficients on its free 
         parameters (independent coefficients).
         
+        If `points` is an array, the vectors for all points are
+        returned at once as rows of a matrix and a vector.
+        
         Parameters
         ----------
         
-        points : float
+        points : float or numpy.ndarray
             The points to evaluate the provisionally spline at.
         
         d : int
             The derivation order.
         '''
         
-        if np.size(points) > 1:
-            raise NotImplementedError()
-        t = points
+        t = np.array(points, dtype=float)
+        scalar = (t.ndim == 0)
+        t = np.atleast_1d(t)
         
-        # determine the spline part to evaluate
-        i = int(np.floor(t * self.n / self.b))
-        if i == self.n: i -= 1
+        # determine the spline parts to evaluate
+        i = np.floor(t * self.n / self.b).astype(int)
+        i[i == self.n] -= 1
 
         if self._use_std_approach:
-            t -= (i) * self._h
+            t = t - (i) * self._h
         else:
-            t -= (i+1) * self._h
+            t = t - (i+1) * self._h
         
-        # Calculate vector to for multiplication with coefficient matrix w.r.t. the derivation order
+        # Calculate vectors for multiplication with coefficient matrix w.r.t. the derivation order
+        zeros = np.zeros_like(t)
+        ones = np.ones_like(t)
         if d == 0:
-            tt = np.array([t*t*t, t*t, t, 1.0])
+            tt = np.array([t*t*t, t*t, t, ones])
         elif d == 1:
-            tt = np.array([3.0*t*t, 2.0*t, 1.0, 0.0])
+            tt = np.array([3.0*t*t, 2.0*t, ones, zeros])
         elif d == 2:
-            tt = np.array([6.0*t, 2.0, 0.0, 0.0])
+            tt = np.array([6.0*t, 2.0*ones, zeros, zeros])
         elif d == 3:
-            tt = np.array([6.0, 0.0, 0.0, 0.0])
+            tt = np.array([6.0*ones, zeros, zeros, zeros])
+        tt = tt.T
         
-        dep_vec = np.dot(tt, self._dep_array[i])
-        dep_vec_abs = np.dot(tt, self._dep_array_abs[i])
+        if self._dep_op is not None:
+            # set up the sparse matrix that evaluates the polynomial parts
+            # and let the operator apply the dependence arrays to it
+            m = t.size
+            rows = np.arange(m).repeat(4)
+            cols = (4 * i[:,None] + np.arange(4)).ravel()
+            E = sparse.csr_matrix((tt.ravel(), (rows, cols)), shape=(m, 4 * self.n))
+            
+            dep_vec, dep_vec_abs = self._dep_op.evaluate(E)
+        else:
+            dep_vec = np.einsum('ij,ijk->ik', tt, self._dep_array[i])
+            dep_vec_abs = np.einsum('ij,ij->i', tt, self._dep_array_abs[i])
         
-        return dep_vec, dep_vec_abs
+        if scalar:
+            return dep_vec[0], dep_vec_abs[0]
+        else:
+            return dep_vec, dep_vec_abs
     
     def set_coefficients(self, free_coeffs=None, coeffs=None):
         '''
@@ -300,15 +364,15 @@ class Spline(object):
             # 
             # first a little check
             if not (self.n == coeffs.shape[0]):
-                logging.error('Dimension mismatch in number of spline parts ({}) and \
+                logger.error('Dimension mismatch in number of spline parts ({}) and \
                             rows in coefficients array ({})'.format(self.n, coeffs.shape[0]))
                 raise ValueError('Dimension mismatch in number of spline parts ({}) and \
                             rows in coefficients array ({})'.format(self.n, coeffs.shape[0]))
             elif not (coeffs.shape[1] == 4):
-                logging.error('Dimension mismatch in number of polynomial coefficients (4) and \
+                logger.error('Dimension mismatch in number of polynomial coefficients (4) and \
                             columns in coefficients array ({})'.format(coeffs.shape[1]))
             # elif not (self._indep_coeffs.size == coeffs.shape[1]):
-            #     logging.error('Dimension mismatch in number of free coefficients ({}) and \
+            #     logger.error('Dimension mismatch in number of free coefficients ({}) and \
             #                 columns in coefficients array ({})'.format(self._indep_coeffs.size, coeffs.shape[1]))
             #     raise ValueError
             
@@ -322,7 +386,7 @@ class Spline(object):
         elif coeffs is None and free_coeffs is not None:
             # a little check
             if not (self._indep_coeffs.size == free_coeffs.size):
-                logging.error('Got {} values for the {} independent coefficients.'\
+                logger.error('Got {} values for the {} independent coefficients.'\
                                 .format(free_coeffs.size, self._indep_coeffs.size))
                 raise ValueError('Got {} values for the {} independent coefficients.'\
                                 .format(free_coeffs.size, self._indep_coeffs.size))
@@ -331,13 +395,17 @@ class Spline(object):
             self._indep_coeffs = free_coeffs
             
             # update the spline coefficients and polynomial parts
+            if self._dep_op is not None:
+                coeffs = self._dep_op.coefficients(free_coeffs)
+            else:
+                coeffs = self._dep_array.dot(free_coeffs) + self._dep_array_abs
+            
             for k in xrange(self.n):
-                coeffs_k = self._dep_array[k].dot(free_coeffs) + self._dep_array_abs[k]
-                self._coeffs[k] = coeffs_k
-                self._P[k] = np.poly1d(coeffs_k)
+                self._coeffs[k] = coeffs[k]
+                self._P[k] = np.poly1d(coeffs[k])
         else:
             # not sure...
-            logging.error('Not sure what to do, please either pass `coeffs` or `free_coeffs`.')
+            logger.error('Not sure what to do, please either pass `coeffs` or `free_coeffs`.')
             raise TypeError('Not sure what to do, please either pass `coeffs` or `free_coeffs`.')
         
         # now we have numerical values for the coefficients so we can set this to False
@@ -374,20 +442,19 @@ class Spline(object):
             free_coeffs = np.linalg.lstsq(S_dep_mat, fnc_t - S_dep_mat_abs)[0]
 
         else:
-            # compute values 
-            values = [fnc(t) for t in self.nodes]
+            # compute values (at all nodes at once if `fnc` accepts arrays)
+            values = _evaluate_at(fnc, self.nodes)
             
             # create vector of step sizes
-            h = np.array([self.nodes[k+1] - self.nodes[k] for k in xrange(self.nodes.size-1)])
+            h = np.diff(self.nodes)
             
             # create diagonals for the coefficient matrix of the equation system
-            l = np.array([h[k+1] / (h[k] + h[k+1]) for k in xrange(self.nodes.size-2)])
+            l = h[1:] / (h[:-1] + h[1:])
             d = 2.0*np.ones(self.nodes.size-2)
-            u = np.array([h[k] / (h[k] + h[k+1]) for k in xrange(self.nodes.size-2)])
+            u = h[:-1] / (h[:-1] + h[1:])
             
             # right hand site of the equation system
-            r = np.array([(3.0/h[k])*l[k]*(values[k+1] - values[k]) + (3.0/h[k+1])*u[k]*(values[k+2]-values[k+1])\
-                          for k in xrange(self.nodes.size-2)])
+            r = (3.0/h[:-1])*l*(values[1:-1] - values[:-2]) + (3.0/h[1:])*u*(values[2:] - values[1:-1])
             
             # add conditions for unique solution
             
@@ -413,28 +480,26 @@ class Spline(object):
             # solve the equation system
             sol = sparse.linalg.spsolve(D.tocsr(),r)
             
-            # calculate the coefficients
-            coeffs = np.zeros((self.n, 4))
+            # compute the coefficients of the interpolant (of all parts at once)
+            dv = values[1:] - values[:-1]
             
-            # compute the coefficients of the interpolant
             if self._use_std_approach:
-                for i in xrange(self.n):
-                    coeffs[i, :] = [-2.0/h[i]**3 * (values[i+1]-values[i]) + 1.0/h[i]**2 * (sol[i]+sol[i+1]),
-                                    3.0/h[i]**2 * (values[i+1]-values[i]) - 1.0/h[i] * (2*sol[i]+sol[i+1]),
-                                    sol[i],
-                                    values[i]]
+                coeffs = np.column_stack((-2.0/h**3 * dv + 1.0/h**2 * (sol[:-1]+sol[1:]),
+                                          3.0/h**2 * dv - 1.0/h * (2*sol[:-1]+sol[1:]),
+                                          sol[:-1],
+                                          values[:-1]))
             else:
-                for i in xrange(self.n):
-                    coeffs[i, :] = [2.0/h[i]**3 * (values[i]-values[i+1]) + 1.0/h[i]**2 * (sol[i]+sol[i+1]),
-                                    3.0/h[i]**2 * (values[i]-values[i+1]) + 1.0/h[i] * (sol[i]+2*sol[i+1]),
-                                    sol[i+1],
-                                    values[i+1]]
+                coeffs = np.column_stack((-2.0/h**3 * dv + 1.0/h**2 * (sol[:-1]+sol[1:]),
+                                          -3.0/h**2 * dv + 1.0/h * (sol[:-1]+2*sol[1:]),
+                                          sol[1:],
+                                          values[1:]))
                     
             # get the indices of the free coefficients
             coeff_name_split_str = [c.name.split('_')[-2:] for c in self._indep_coeffs_sym]
-            free_coeff_indices = [(int(s[0]), int(s[1])) for s in coeff_name_split_str]
+            free_coeff_indices = np.array([(int(s[0]), int(s[1])) for s in coeff_name_split_str],
+                                          dtype=int).reshape((-1, 2))
             
-            free_coeffs = np.array([coeffs[i] for i in free_coeff_indices])
+            free_coeffs = coeffs[free_coeff_indices[:,0], free_coeff_indices[:,1]]
         
         # set solution for the free coefficients
         #self.set_coefficients(free_coeffs=free_coeffs)
@@ -477,7 +542,7 @@ class Spline(object):
         elif self._prov_flag:
             # spline cannot be plotted, because there are no numeric
             # values for its polynomial coefficients
-            logging.error("There are no numeric values for the spline's\
+            logger.error("There are no numeric values for the spline's\
                             polynomial coefficients.")
             return
         
@@ -491,7 +556,7 @@ class Spline(object):
                 plt.plot(tt,St)
                 plt.show()
             except ImportError:
-                logging.error('Could not import matplotlib for plotting the curve.')
+                logger.error('Could not import matplotlib for plotting the curve.')
         
         if ret_array:
             return St
@@ -524,6 +589,76 @@ def get_spline_nodes(a=0.0, b=1.0, n=10, nodes_type='equidistant'):
     
     return nodes
     
+def _evaluate_at(fnc, points):
+    '''
+    Evaluates `fnc` at all points at once if it accepts arrays
+    and point by point otherwise.
+    '''
+    try:
+        values = np.asarray(fnc(points), dtype=float)
+    except Exception:
+        values = None
+    
+    if values is None or values.shape != points.shape:
+        values = np.array([fnc(t) for t in points], dtype=float)
+    
+    return values
+
+class SplineFunction(object):
+    '''
+    Represents an affine function :math:`\\alpha S^{(d)} + \\beta` of a
+    spline's derivative (e.g. of an element of an integrator chain with
+    scaled or shifted relations, see :py:class:`auxiliary.IntegChain`).
+    
+    Parameters
+    ----------
+    
+    spline : Spline
+        The spline
+    
+    d : int
+        The derivation order
+    
+    scale, offset : float
+        The coefficients of the affine function
+    '''
+    
+    def __init__(self, spline, d=0, scale=1.0, offset=0.0):
+        self.spline = spline
+        self.d = d
+        self.scale = scale
+        self.offset = offset
+    
+    def __call__(self, t):
+        if not self.spline._prov_flag:
+            return self.scale * self.spline._eval(t, d=self.d) + self.offset
+        else:
+            dep, dep_abs = self.spline.get_dependence_vectors(t, d=self.d)
+            return self.scale * dep, self.scale * dep_abs + self.offset
+
+
+def spline_function(spline, d=0, scale=1.0, offset=0.0):
+    '''
+    Returns a callable for the affine function of the `d`-th derivative
+    of the spline (just the spline's method if it isn't scaled or shifted).
+    '''
+    if scale == 1.0 and offset == 0.0:
+        return (spline.f, spline.df, spline.ddf, spline.dddf)[d]
+    return SplineFunction(spline, d, scale, offset)
+
+def spline_source(spline_fnc):
+    '''
+    Returns the spline, the derivation order, the scale and the offset
+    of a callable spline function.
+    '''
+    if isinstance(spline_fnc, SplineFunction):
+        return spline_fnc.spline, spline_fnc.d, spline_fnc.scale, spline_fnc.offset
+    
+    # `im_func` is the function's id
+    # `im_self` is the object of which `func` is the method
+    methods = (Spline.f.im_func, Spline.df.im_func, Spline.ddf.im_func, Spline.dddf.im_func)
+    return spline_fnc.im_self, methods.index(spline_fnc.im_func), 1.0, 0.0
+
 def differentiate(spline_fnc):
     '''
     Returns the derivative of a callable spline function.
@@ -535,6 +670,11 @@ def differentiate(spline_fnc):
         The spline function to derivate.
     
     '''
+    if isinstance(spline_fnc, SplineFunction):
+        if spline_fnc.d == 3:
+            raise NotImplementedError()
+        return spline_function(spline_fnc.spline, spline_fnc.d + 1, spline_fnc.scale)
+    
     # `im_func` is the function's id
     # `im_self` is the object of which `func` is the method
     if spline_fnc.im_func == Spline.f.im_func:
@@ -562,7 +702,7 @@ def make_steady(S):
     
     # This should be yet untouched
     if S._steady_flag:
-        logging.warning('Spline already has been made steady.')
+        logger.warning('Spline already has been made steady.')
         return
     
     # get spline coefficients and interval size
@@ -642,35 +782,42 @@ def make_steady(S):
     B = sparse.csc_matrix(B)
     r = sparse.csc_matrix(r)
     
-    tmp1 = spsolve(B,r)
-    tmp2 = spsolve(B,-A)
-    
-    if sparse.issparse(tmp1):
-        tmp1 = tmp1.toarray()
-    if sparse.issparse(tmp2):
-        tmp2 = tmp2.toarray()
+    if S._use_dep_operator:
+        # just keep the factored system instead of the (dense) solution
+        S._dep_op = DependenceOperator(a_mat, b_mat, A, B, r.toarray().ravel(),
+                                       shape=(coeffs.shape[0], coeffs.shape[1], a.size))
+        S._dep_array = None
+        S._dep_array_abs = None
+    else:
+        tmp1 = spsolve(B,r)
+        tmp2 = spsolve(B,-A)
+        
+        if sparse.issparse(tmp1):
+            tmp1 = tmp1.toarray()
+        if sparse.issparse(tmp2):
+            tmp2 = tmp2.toarray()
+        
+        dep_array = np.zeros((coeffs.shape[0], coeffs.shape[1], a.size))
+        dep_array_abs = np.zeros_like(coeffs, dtype=float)
+        
+        for i,bb in enumerate(b):
+            tmp = bb.name.split('_')[-2:]
+            j = int(tmp[0])
+            k = int(tmp[1])
     
-    dep_array = np.zeros((coeffs.shape[0], coeffs.shape[1], a.size))
-    dep_array_abs = np.zeros_like(coeffs, dtype=float)
+            dep_array[j,k,:] = tmp2[i]
+            dep_array_abs[j,k] = tmp1[i]
     
-    for i,bb in enumerate(b):
-        tmp = bb.name.split('_')[-2:]
-        j = int(tmp[0])
-        k = int(tmp[1])
-
-        dep_array[j,k,:] = tmp2[i]
-        dep_array_abs[j,k] = tmp1[i]
-
-    tmp3 = np.eye(len(a))
-    for i,aa in enumerate(a):
-        tmp = aa.name.split('_')[-2:]
-        j = int(tmp[0])
-        k = int(tmp[1])
-
-        dep_array[j,k,:] = tmp3[i]
+        tmp3 = np.eye(len(a))
+        for i,aa in enumerate(a):
+            tmp = aa.name.split('_')[-2:]
+            j = int(tmp[0])
+            k = int(tmp[1])
     
-    S._dep_array = dep_array
-    S._dep_array_abs = dep_array_abs
+            dep_array[j,k,:] = tmp3[i]
+        
+        S._dep_array = dep_array
+        S._dep_array_abs = dep_array_abs
     
     # a is vector of independent spline coeffs (free parameters)
     S._indep_coeffs = a
@@ -678,6 +825,109 @@ def make_steady(S):
     # now we are done and this can be set to True
     S._steady_flag = True
 
+class DependenceOperator(object):
+    '''
+    Implicit representation of the dependence arrays of a spline.
+    
+    The coefficients `c` of the polynomial spline parts are split into the
+    free ones `a` and the dependent ones `b` which are determined by the
+    smoothness and boundary conditions
+    
+    .. math::
+       
+       A a + B b = r  \Rightarrow  b = B^{-1} (r - A a)
+    
+    Instead of storing the dense solution :math:`B^{-1} A` (whose size grows
+    quadratically with the number of spline parts) this class keeps the sparse
+    factorisation of `B` and applies it on demand.
+    
+    Parameters
+    ----------
+    
+    a_mat, b_mat : scipy.sparse.spmatrix
+        Matrices that place the free and dependent coefficients in the
+        (flattened) array of all spline coefficients.
+    
+    A, B : scipy.sparse.spmatrix
+        Left hand sides of the smoothness conditions w.r.t. `a` and `b`.
+    
+    r : numpy.ndarray
+        Right hand side of the smoothness conditions.
+    
+    shape : tuple
+        Shape of the dense dependence array that is represented.
+    '''
+    
+    def __init__(self, a_mat, b_mat, A, B, r, shape):
+        self._a_mat = sparse.csr_matrix(a_mat)
+        self._b_mat = sparse.csr_matrix(b_mat)
+        self._A = sparse.csr_matrix(A)
+        self._B = sparse.csc_matrix(B)
+        self.shape = shape
+        
+        self._lu = None
+        
+        # absolute part of the dependent coefficients  B^(-1)*r
+        self._abs = self.lu.solve(np.asarray(r, dtype=float))
+    
+    @property
+    def lu(self):
+        '''
+        The sparse LU factorisation of `B` (computed on first access).
+        '''
+        if self._lu is None:
+            self._lu = splu(self._B)
+        return self._lu
+    
+    def __getstate__(self):
+        # the factorisation cannot be copied or pickled
+        # but will be recomputed when needed
+        state = self.__dict__.copy()
+        state['_lu'] = None
+        return state
+    
+    def coefficients(self, free_coeffs):
+        '''
+        Returns the array of all spline coefficients for given values
+        of the free coefficients.
+        '''
+        free_coeffs = np.asarray(free_coeffs, dtype=float)
+        dep_coeffs = self._abs - self.lu.solve(self._A.dot(free_coeffs))
+        
+        coeffs = self._a_mat.dot(free_coeffs) + self._b_mat.dot(dep_coeffs)
+        
+        return coeffs.reshape(self.shape[:2])
+    
+    def evaluate(self, E):
+        '''
+        Applies the dependence arrays to the rows of the sparse matrix `E`
+        that maps the flattened spline coefficients to some values
+        (e.g. of the spline at some points).
+        
+        Returns the dependence on the free coefficients as a dense matrix
+        with one row for every row of `E` and the absolute part as a vector.
+        '''
+        Eb = sparse.csr_matrix(E).dot(self._b_mat)
+        
+        # (E*b_mat) * B^(-1) is computed by solving the transposed system
+        EbBinv = self.lu.solve(np.asarray(Eb.T.toarray(), dtype=float), trans='T')
+        if EbBinv.ndim == 1:
+            EbBinv = EbBinv[:,None]
+        
+        dep = E.dot(self._a_mat).toarray() - self._A.T.dot(EbBinv).T
+        dep_abs = Eb.dot(self._abs)
+        
+        return dep, dep_abs
+    
+    def toarray(self):
+        '''
+        Returns the dense dependence arrays.
+        '''
+        N = self.shape[0] * self.shape[1]
+        dep, dep_abs = self.evaluate(sparse.identity(N, format='csr'))
+        
+        return dep.reshape(self.shape), dep_abs.reshape(self.shape[:2])
+
 def get_smoothness_matrix(S, N1, N2):
     '''
     Returns the coefficient matrix and right hand site for the 
@@ -830,8 +1080,11 @@ def _switch_coeffs(S, all_coeffs=False, dep_arrays=None):
         else:
             new_M, new_m = dep_arrays
 
-        old_M = S._dep_array
-        old_m = S._dep_array_abs
+        if S._dep_op is not None:
+            old_M, old_m = S._dep_op.toarray()
+        else:
+            old_M = S._dep_array
+            old_m = S._dep_array_abs
 
         coeffs = S._indep_coeffs
 
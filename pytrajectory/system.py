@@ -5,13 +5,18 @@ import sympy as sp
 from scipy import sparse
 import pickle
 import copy
+import multiprocessing
+import Queue
+import threading
+import time
 
 from trajectories import Trajectory
 from collocation import CollocationSystem
 from simulation import Simulator
 import auxiliary
 import visualisation
-from log import logging, Timer
+import results
+from log import logger, use_logger, Timer, track_memory
 
 # DEBUGGING
 from IPython import embed as IPS
@@ -48,48 +53,187 @@ class ControlSystem(object):
         Box-constraints of the state variables.
     
     kwargs
-        ============= =============   ============================================================
-        key           default value   meaning
-        ============= =============   ============================================================
-        sx            5               Initial number of spline parts for the system variables
-        su            5               Initial number of spline parts for the input variables
-        kx            2               Factor for raising the number of spline parts
-        maxIt         10              Maximum number of iteration steps
-        eps           1e-2            Tolerance for the solution of the initial value problem
-        ierr          1e-1            Tolerance for the error on the whole interval
-        tol           1e-5            Tolerance for the solver of the equation system
-        use_chains    True            Whether or not to use integrator chains
-        sol_steps     100             Maximum number of iteration steps for the eqs solver
-        ============= =============   ============================================================
+        ==================== =============   ============================================================
+        key                  default value   meaning
+        ==================== =============   ============================================================
+        sx                   5               Initial number of spline parts for the system variables
+        su                   5               Initial number of spline parts for the input variables
+        kx                   2               Factor for raising the number of spline parts
+        maxIt                10              Maximum number of iteration steps
+        eps                  1e-2            Tolerance for the solution of the initial value problem
+        ierr                 1e-1            Tolerance for the error on the whole interval
+        tol                  1e-5            Tolerance for the solver of the equation system
+        use_chains           True            Whether or not to use integrator chains
+        sol_steps            100             Maximum number of iteration steps for the eqs solver
+        use_dep_operator     False           Whether to represent the splines' dependence arrays by
+                                             a factored sparse operator (saves memory)
+        n_threads            1               Number of threads for the evaluation of the vector field
+                                             and its jacobian in the collocation points
+        backend              'lambdify'      How to generate the numeric functions of the vector field
+                                             and its jacobian ('lambdify', 'numpy', 'numba', 'numexpr')
+        n_procs              1               Number of worker processes for the symbolic preprocessing
+                                             (jacobian and common subexpressions) of large systems
+        time_limit           None            Maximum number of seconds for the whole solution process
+                                             (the best solution found so far is taken if exceeded)
+        sol_time_limit       None            Maximum number of seconds for each run of the eqs solver
+        sim_policy           'always'        When to simulate the initial value problem after solving the
+                                             collocation system ('always' or 'estimate': only if a cheap
+                                             estimate says that the accuracy can be reached and in the
+                                             last iteration)
+        memory_tracking      False           Whether to determine the peak memory usage of the phases of
+                                             every iteration (True, 'tracemalloc' or 'rss', see
+                                             :py:class:`log.MemoryMonitor`)
+        mass_matrix          None            Mass matrix `M` (or a callable returning it for the state
+                                             variables) if the vector field `ff` is given implicitly by
+                                             `M(x) * dx/dt = ff(x, u)` (see :py:class:`MassMatrixModel`)
+        numeric              False           Whether `ff` is a vectorized numeric function `ff(X, U)` of
+                                             the values in many points (one column per point) that
+                                             is used without any symbolic processing (see
+                                             :py:class:`NumericModel`)
+        fd_method            'central'       How to approximate the jacobian of a numeric vector field
+                                             ('forward', 'central' or 'complex_step')
+        sparsity             None            Structure of the jacobian of a numeric vector field (dense
+                                             if not given, an array of its possibly nonzero entries
+                                             or 'detect', see :py:class:`NumericModel`)
+        jacobian             'vectorfield'   How to compute the jacobian of the collocation system
+                                             ('vectorfield': from the jacobian of the vector field,
+                                             'colored_fd': by finite differences of grouped columns)
+        x_scale              None            Scaling of the free parameters in the eqs solver ('jacobian'
+                                             or typical magnitudes of the variables `{'x1' : 10.0, ...}`)
+        f_scale              None            Scaling of the equations in the eqs solver ('jacobian' or
+                                             typical magnitudes of the state variables' equations)
+        min_scale            None            Lower bound of the relative scales in the eqs solver
+                                             (default: square root of the machine epsilon)
+        guess_type           'constant'      How to guess the free parameters in the first iteration
+                                             ('constant', 'linear', 'cubic' or 'simulate', see
+                                             :py:meth:`collocation.CollocationSystem._guess_functions`)
+        sim_bound            None            Abort the simulation if the absolute value of a state exceeds
+                                             this bound (see :py:meth:`simulate`)
+        sim_deviation        None            Abort the simulation if a state deviates more than this
+                                             multiple of `eps` from its spline trajectory
+        checkpoint           None            Name of a file in which the state of the solution process is
+                                             saved after every iteration (see :py:meth:`resume`, it isn't
+                                             passed on to derived systems or multistart candidates)
+        logger               None            Logger (or adapter) for the messages of the solution process
+                                             (default: the package logger 'pytrajectory')
+        model                None            A :py:class:`SymbolicModel` of the vector field that is
+                                             reused instead of analysing `ff` (see :py:meth:`derive`)
+        ==================== =============   ============================================================
     '''
 
     def __init__(self, ff, a=0., b=1., xa=[], xb=[], ua=[], ub=[], constraints=None, **kwargs):
+        # remember how the system was created (see self.derive())
+        self._init_args = dict(ff=ff, a=a, b=b, xa=xa, xb=xb, ua=ua, ub=ub, constraints=constraints)
+        self._init_kwargs = dict(kwargs)
+        
+        # where the messages of the solution process go (see self.solve())
+        self.logger = kwargs.get('logger', None)
+        
         # set method parameters
         self._parameters = dict()
         self._parameters['maxIt'] = kwargs.get('maxIt', 10)
         self._parameters['eps'] = kwargs.get('eps', 1e-2)
         self._parameters['ierr'] = kwargs.get('ierr', 1e-1)
+        self._parameters['backend'] = kwargs.get('backend', 'lambdify')
+        self._parameters['n_procs'] = kwargs.get('n_procs', 1)
+        self._parameters['time_limit'] = kwargs.get('time_limit', None)
+        self._parameters['sim_policy'] = kwargs.get('sim_policy', 'always')
+        self._parameters['memory_tracking'] = kwargs.get('memory_tracking', False)
+        self._parameters['checkpoint'] = kwargs.get('checkpoint', None)
+        self._parameters['sim_bound'] = kwargs.get('sim_bound', None)
+        self._parameters['sim_deviation'] = kwargs.get('sim_deviation', None)
+        
+        if self._parameters['sim_policy'] not in {'always', 'estimate'}:
+            logger.warning("Unknown simulation policy: {}".format(self._parameters['sim_policy']))
+            logger.warning("Use 'always' instead")
+            self._parameters['sim_policy'] = 'always'
+        
+        fd_method = kwargs.get('fd_method', 'central')
+        if fd_method not in {'forward', 'central', 'complex_step'}:
+            logger.warning("Unknown differentiation method: {}".format(fd_method))
+            logger.warning("Use 'central' instead")
+            fd_method = 'central'
 
         # create an object for the dynamical system
-        self.dyn_sys = DynamicalSystem(f_sym=ff, a=a, b=b, xa=xa, xb=xb, ua=ua, ub=ub)
+        self.dyn_sys = DynamicalSystem(f_sym=ff, a=a, b=b, xa=xa, xb=xb, ua=ua, ub=ub,
+                                       backend=self._parameters['backend'],
+                                       n_procs=self._parameters['n_procs'],
+                                       mass_matrix=kwargs.get('mass_matrix', None),
+                                       numeric=kwargs.get('numeric', False),
+                                       fd_method=fd_method,
+                                       sparsity=kwargs.get('sparsity', None),
+                                       model=kwargs.get('model', None))
 
         # handle eventual system constraints
         self.constraints = constraints
         if self.constraints is not None:
+            if isinstance(self.dyn_sys.model, MassMatrixModel):
+                raise NotImplementedError("Constraints are not supported for vector fields "
+                                          "given by a mass matrix")
+            if isinstance(self.dyn_sys.model, NumericModel):
+                raise NotImplementedError("Constraints are not supported for numeric vector fields")
+            
             # transform the constrained vectorfield into an unconstrained one
+            # (integrator chains that contain a constrained variable don't survive
+            #  this transformation, so the others can still be used)
             self.unconstrain(constraints)
 
-            # we cannot make use of an integrator chain
-            # if it contains a constrained variable
-            kwargs['use_chains'] = False
-            # TODO: implement it so that just those chains are not used 
-            #       which actually contain a constrained variable
-
         # create an object for the collocation equation system
         self.eqs = CollocationSystem(sys=self.dyn_sys, **kwargs)
 
         # We didn't really do anything yet, so this should be false
         self.reached_accuracy = False
+        self.boundary_error = None
+        self.consistency_error = None
+        self.sim_status = None
+        
+        # some information about the solution process (see self.solve())
+        self.stats = dict()
+        
+        # callables that are informed about the progress of the solution process
+        # and a flag to cancel it (possibly from another thread)
+        self._listeners = []
+        self._cancel_event = threading.Event()
+
+    def derive(self, **kwargs):
+        '''
+        Creates a new control system for the same vector field but with other
+        boundary values, time interval, constraints or method parameters.
+        
+        The new system shares the analysis of the vector field (its dimensions,
+        integrator chains, jacobian and the numeric functions) with this one,
+        so no symbolic computations have to be done again.
+        
+        Parameters
+        ----------
+        
+        kwargs
+            Any of the arguments of :py:class:`ControlSystem` (`a`, `b`, `xa`, `xb`,
+            `ua`, `ub`, `constraints` and the method parameters). The ones that are
+            not given are taken from the creation of this system, except for the
+            `checkpoint` file (which belongs to this system only).
+        
+        Returns
+        -------
+        
+        ControlSystem
+            The new control system.
+        '''
+        
+        if kwargs.has_key('ff') or kwargs.has_key('model'):
+            raise ValueError("The vector field of a derived system can't be changed")
+        
+        args = dict(self._init_args)
+        args.update(self._init_kwargs)
+        args.pop('checkpoint', None)
+        args.update(kwargs)
+        
+        if self.constraints is not None:
+            args['model'] = self._dyn_sys_orig.model
+        else:
+            args['model'] = self.dyn_sys.model
+        
+        return ControlSystem(**args)
 
     def set_param(self, param='', value=None):
         '''
@@ -105,10 +249,11 @@ class ControlSystem(object):
             The new value
         '''
         
-        if param in {'maxIt', 'eps', 'ierr'}:
+        if param in {'maxIt', 'eps', 'ierr', 'time_limit', 'sim_policy'}:
             self._parameters[param] = value
 
-        elif param in {'n_parts_x', 'sx', 'n_parts_u', 'su', 'kx', 'use_chains', 'nodes_type', 'use_std_approach'}:
+        elif param in {'n_parts_x', 'sx', 'n_parts_u', 'su', 'kx', 'use_chains', 'nodes_type', 'use_std_approach',
+                       'use_dep_operator'}:
             if param == 'nodes_type' and value != 'equidistant':
                 raise NotImplementedError()
 
@@ -119,7 +264,7 @@ class ControlSystem(object):
 
             self.eqs.trajectories._parameters[param] = value
 
-        elif param in {'tol', 'method', 'coll_type', 'sol_steps'}:
+        elif param in {'tol', 'method', 'coll_type', 'sol_steps', 'n_threads', 'sol_time_limit'}:
             self.eqs._parameters[param] = value
 
         else:
@@ -144,12 +289,6 @@ class ControlSystem(object):
         # backup the original constrained system
         self._dyn_sys_orig = copy.deepcopy(self.dyn_sys)
 
-        # get symbolic vectorfield
-        # (as sympy matrix toenable replacement method)
-        x = sp.symbols(self.dyn_sys.states)
-        u = sp.symbols(self.dyn_sys.inputs)
-        ff_mat = sp.Matrix(self.dyn_sys.f_sym(x, u))
-
         # get neccessary information form the dynamical system
         a = self.dyn_sys.a
         b = self.dyn_sys.b
@@ -163,21 +302,62 @@ class ControlSystem(object):
             xa, xb = self.dyn_sys.boundary_values[xk]
             
             if not ( v[0] < xa < v[1] ) or not ( v[0] < xb < v[1] ):
-                logging.error('Boundary values have to be strictly within the saturation limits!')
-                logging.info('Please have a look at the documentation, \
+                logger.error('Boundary values have to be strictly within the saturation limits!')
+                logger.info('Please have a look at the documentation, \
                               especially the example of the constrained double intgrator.')
                 raise ValueError('Boundary values have to be strictly within the saturation limits!')
             
-            # calculate saturation function expression and its derivative
-            yk = sp.Symbol(xk)
             m = 4.0/(v[1] - v[0])
-            psi = v[1] - (v[1]-v[0])/(1. + sp.exp(m * yk))
             
-            #dpsi = ((v[1]-v[0])*m*sp.exp(m*yk))/(1.0+sp.exp(m*yk))**2
-            dpsi = (4. * sp.exp(m * yk))/(1. + sp.exp(m * yk))**2
+            # update boundary values for new unconstrained variable
+            boundary_values[xk] = ( (1./m) * np.log((xa - v[0]) / (v[1] - xa)),
+                                    (1./m) * np.log((xb - v[0]) / (v[1] - xb)) )
+        
+        # create a new unconstrained system
+        xa = [boundary_values[x][0] for x in self.dyn_sys.states]
+        xb = [boundary_values[x][1] for x in self.dyn_sys.states]
+        ua = [boundary_values[u][0] for u in self.dyn_sys.inputs]
+        ub = [boundary_values[u][1] for u in self.dyn_sys.inputs]
+
+        # the transformed vector field only depends on the constraints
+        # so it is shared by all systems derived from this one (see self.derive())
+        key = ('unconstrained', tuple(sorted((k, tuple(v)) for k, v in constraints.items())))
+        f_sym, model = self.dyn_sys.model._cached(key, lambda: self._unconstrained_model(constraints))
+        
+        self.dyn_sys = DynamicalSystem(f_sym , a, b, xa, xb, ua, ub,
+                                       backend=self._parameters['backend'], model=model)
+
+    def _unconstrained_model(self, constraints):
+        '''
+        Transforms the vector field with respect to the constraints
+        (see :py:meth:`unconstrain`).
+
+        Returns
+        -------
+
+        callable
+            The new (symbolic) vector field.
+
+        SymbolicModel
+            Its analysis.
+        '''
+
+        # get symbolic vectorfield
+        # (as sympy matrix toenable replacement method)
+        ff_mat = sp.Matrix(self.dyn_sys.f_expr)
+
+        for k, v in constraints.items():
+            xk = self.dyn_sys.states[k]
+
+            # calculate saturation function expression and its derivative
+            yk = sp.Symbol(xk)
+            psi, dpsi = auxiliary.saturation_expressions(yk, v[0], v[1])
             
             # replace constrained variables in vectorfield with saturation expression
             # x(t) = psi(y(t))
+            #
+            # (this also removes every relation `d/dt x_i = x_k` or `d/dt x_k = x_j`
+            #  from the vectorfield, so no integrator chain will contain x_k)
             ff_mat = ff_mat.replace(sp.Symbol(xk), psi)
             
             # update vectorfield to represent differential equation for new
@@ -186,10 +366,6 @@ class ControlSystem(object):
             #      d/dt x(t) = (d/dy psi(y(t))) * d/dt y(t)
             # <==> d/dt y(t) = d/dt x(t) / (d/dy psi(y(t)))
             ff_mat[k] /= dpsi
-            
-            # update boundary values for new unconstrained variable
-            boundary_values[xk] = ( (1./m) * np.log((xa - v[0]) / (v[1] - xa)),
-                                    (1./m) * np.log((xb - v[0]) / (v[1] - xb)) )
         
         # create a callable function for the new symbolic vectorfield
         ff = np.asarray(ff_mat).flatten().tolist()
@@ -199,13 +375,12 @@ class ControlSystem(object):
             xu = np.hstack((x,u))
             return _f_sym(*xu)
 
-        # create a new unconstrained system
-        xa = [boundary_values[x][0] for x in self.dyn_sys.states]
-        xb = [boundary_values[x][1] for x in self.dyn_sys.states]
-        ua = [boundary_values[u][0] for u in self.dyn_sys.inputs]
-        ub = [boundary_values[u][1] for u in self.dyn_sys.inputs]
+        # (we already have the expression of the new vectorfield
+        #  so there is no need to analyse `f_sym` again)
+        model = SymbolicModel(ff, n_states=self.dyn_sys.n_states, n_inputs=self.dyn_sys.n_inputs,
+                              n_procs=self._parameters['n_procs'])
 
-        self.dyn_sys = DynamicalSystem(f_sym , a, b, xa, xb, ua, ub)
+        return f_sym, model
 
     def constrain(self):
         '''
@@ -245,6 +420,18 @@ class ControlSystem(object):
         While the desired accuracy has not been reached, the collocation system will
         be set up and solved with a iteratively raised number of spline parts.
         
+        If the `time_limit` is exceeded or the process is cancelled (see :py:meth:`cancel`),
+        it stops and the best solution found so far is taken. Information about every
+        iteration (spline parts, solver steps and residual, errors, elapsed time and,
+        if it is tracked, the peak memory usage of its phases) is stored in :py:attr:`stats`.
+        
+        The progress is reported to the listeners (see :py:meth:`add_listener`).
+        
+        All state of the solution process belongs to this instance, so several systems
+        may be solved in parallel threads. Their messages go to the `logger` of the system.
+        
+        A :py:meth:`cancel` before the start of the solution process has no effect.
+        
         Returns
         -------
         
@@ -254,40 +441,399 @@ class ControlSystem(object):
         callable
             Callable function for the input variables.
         '''
+        
+        self._cancel_event.clear()
+        
+        return self._run()
+    
+    def resume(self, fname):
+        '''
+        Continues a solution process from a checkpoint (see the parameter `checkpoint`
+        and :py:func:`results.save_checkpoint`), e.g. after the process was killed.
+        
+        The collocation system is rebuilt with the number of spline parts of the
+        stored iteration and solved again with the stored free parameters as the
+        guess (which usually takes very few solver steps). Then the solution process
+        goes on like :py:meth:`solve`.
+        
+        The system has to be created with the same vector field, boundary values
+        and method parameters as the one that saved the checkpoint.
+        '''
+        
+        self._cancel_event.clear()
+        
+        return self._run(checkpoint=results.load_checkpoint(fname))
+    
+    def _run(self, checkpoint=None):
+        '''
+        Runs the main loop with the logger of the system.
+        '''
+        
+        with use_logger(self.logger):
+            return self._solve(checkpoint=checkpoint)
+    
+    def _solve(self, checkpoint=None):
+        '''
+        The main loop (see :py:meth:`solve` and :py:meth:`resume`).
+        '''
 
-        # do the first iteration step
-        logging.info("1st Iteration: {} spline parts".format(self.eqs.trajectories.n_parts_x))
-        self._iterate()
+        self._start_time = time.time()
+        self._best = None
+        self._best_is_current = False
+        self._simulated = False
+        self.stats = dict(iterations=[], timed_out=False, cancelled=False)
+        
+        if checkpoint is None:
+            # do the first iteration step
+            logger.info("1st Iteration: {} spline parts".format(self.eqs.trajectories.n_parts_x))
+            self._iterate()
+            
+            # this was the first iteration
+            # now we are getting into the loop
+            self.nIt = 1
+        else:
+            self._resume_iteration(checkpoint)
         
-        # this was the first iteration
-        # now we are getting into the loop
-        self.nIt = 1
+        self._save_checkpoint()
         
         while not self.reached_accuracy and self.nIt < self._parameters['maxIt']:
+            if self._remaining_time() == 0:
+                logger.warning("Time limit ({} s) exceeded after {} iterations".format(
+                                self._parameters['time_limit'], self.nIt))
+                self.stats['timed_out'] = True
+                break
+            
+            if self._cancel_event.is_set():
+                logger.info("Solution process cancelled after {} iterations".format(self.nIt))
+                self.stats['cancelled'] = True
+                break
+            
             # raise the number of spline parts
             self.eqs.trajectories._raise_spline_parts()
             
             if self.nIt == 1:
-                logging.info("2nd Iteration: {} spline parts".format(self.eqs.trajectories.n_parts_x))
+                logger.info("2nd Iteration: {} spline parts".format(self.eqs.trajectories.n_parts_x))
             elif self.nIt == 2:
-                logging.info("3rd Iteration: {} spline parts".format(self.eqs.trajectories.n_parts_x))
+                logger.info("3rd Iteration: {} spline parts".format(self.eqs.trajectories.n_parts_x))
             elif self.nIt >= 3:
-                logging.info("{}th Iteration: {} spline parts".format(self.nIt+1, self.eqs.trajectories.n_parts_x))
+                logger.info("{}th Iteration: {} spline parts".format(self.nIt+1, self.eqs.trajectories.n_parts_x))
 
             # start next iteration step
             self._iterate()
 
             # increment iteration number
             self.nIt += 1
+            
+            self._save_checkpoint()
 
-        # as a last, if there were any constraints to be taken care of,
-        # we project the unconstrained variables back on the original constrained ones
-        if self.constraints:
-            self.constrain()
+        self.stats['timed_out'] |= any(it['sol_timed_out'] for it in self.stats['iterations'])
+        self.stats['cancelled'] |= self._cancel_event.is_set()
+        self.stats['nIt'] = self.nIt
+        
+        if (self.stats['timed_out'] or self.stats['cancelled']) and not self._best_is_current:
+            # an earlier iteration yielded a better solution
+            # (this also takes care of the constraints)
+            logger.info("Take the solution of iteration {}".format(self._best['nIt']))
+            self._set_solution(self._best)
+        
+        else:
+            if not self._simulated:
+                # the solution process stopped early after an
+                # iteration whose simulation was skipped
+                self.simulate()
+                self.check_accuracy()
+            
+            if self.constraints:
+                # as a last, if there were any constraints to be taken care of,
+                # we project the unconstrained variables back on the original constrained ones
+                self.constrain()
+        
+        self.stats.update(time=time.time() - self._start_time, best_iteration=self._best['nIt'],
+                          reached_accuracy=self.reached_accuracy, boundary_error=self.boundary_error,
+                          consistency_error=self.consistency_error)
+        
+        if self._parameters['memory_tracking']:
+            peaks = [m['peak'] for it in self.stats['iterations'] for m in it['memory'].values()
+                     if m['peak'] is not None]
+            self.stats['memory_peak'] = max(peaks) if peaks else None
+        
+        self._emit('finished', **self.stats)
         
         # return the found solution functions
         return self.eqs.trajectories.x, self.eqs.trajectories.u
 
+    def solve_async(self, executor):
+        '''
+        Submits :py:meth:`solve` to an executor (e.g. of :py:mod:`concurrent.futures`)
+        and returns the future.
+        
+        To keep an event loop responsive, run the solution process in an executor
+        and forward the progress events into the loop, e.g. (python 3)::
+        
+            S.add_listener(lambda event, data: loop.call_soon_threadsafe(queue.put_nowait, (event, data)))
+            x, u = await asyncio.wrap_future(S.solve_async(executor))
+        
+        or use ``loop.run_in_executor(executor, S.solve)``. The solution process can be
+        stopped with :py:meth:`cancel` from any thread (also before the executor starts it).
+        '''
+        
+        self._cancel_event.clear()
+        
+        return executor.submit(self._run)
+
+    def cancel(self):
+        '''
+        Cancels a running solution process (see :py:meth:`solve` and :py:meth:`solve_async`).
+        
+        It stops at the next step of the eqs solver or between the
+        iterations and the best solution found so far is taken.
+        '''
+        
+        self._cancel_event.set()
+
+    def add_listener(self, listener):
+        '''
+        Adds a callable that is informed about the progress of the solution process.
+        
+        It is called with the name of the event and a dictionary of data:
+        
+        ==================== ==============================================================
+        event                data
+        ==================== ==============================================================
+        iteration            nIt, n_parts_x, n_parts_u
+        sol_step             step, residual
+        simulation           boundary_error, consistency_error
+        accuracy_reached     nIt, boundary_error, consistency_error
+        finished             the solution statistics (see :py:attr:`stats`)
+        ==================== ==============================================================
+        
+        Note that the listeners are called in the thread that runs the solution process.
+        '''
+        
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        '''
+        Removes a listener that was added by :py:meth:`add_listener`.
+        '''
+        
+        self._listeners.remove(listener)
+
+    def _emit(self, event, **data):
+        '''
+        Informs all listeners about an event of the solution process.
+        '''
+        
+        for listener in list(self._listeners):
+            try:
+                listener(event, data)
+            except Exception as err:
+                logger.warning("Listener {} failed for event '{}': {}".format(listener, event, err))
+
+    def solve_multistart(self, candidates=4, perturbation=0.5, seed=None, n_workers=None, timeout=None):
+        '''
+        Solves the problem for several candidate starting points in parallel
+        worker processes.
+
+        As soon as one of them reaches the desired accuracy the others are
+        terminated and its solution is applied to this system. If none reaches it,
+        the candidate with the smallest boundary value error is taken.
+
+        Because the workers are forked from the current process (which has to be
+        supported by the platform) the vector field isn't processed again.
+
+        Parameters
+        ----------
+
+        candidates : int or list
+            Either the number of candidates (the first one starts from the usual
+            guess, the others from random perturbations of it) or a list of
+            dictionaries. Each of them may contain a `first_guess` (see
+            :py:class:`collocation.CollocationSystem`), a `perturbation` for the
+            usual guess and any method parameter accepted by :py:meth:`set_param`
+            (e.g. `sx`, `su` or `kx`).
+
+        perturbation : float
+            Standard deviation of the random perturbations if `candidates` is an int.
+
+        seed : int
+            Seed for the random perturbations.
+
+        n_workers : int
+            Maximum number of simultaneously running workers (default: number of cpus).
+
+        timeout : float
+            Number of seconds to wait for all candidates together (default: no limit).
+
+        Returns
+        -------
+
+        callable
+            Callable function for the system state.
+
+        callable
+            Callable function for the input variables.
+        '''
+
+        if isinstance(candidates, int):
+            candidates = [dict()] + [{'perturbation' : perturbation} for i in xrange(candidates - 1)]
+        candidates = [dict(c) for c in candidates]
+
+        rng = np.random.RandomState(seed)
+        for c in candidates:
+            if c.get('perturbation') and not c.has_key('seed'):
+                c['seed'] = rng.randint(2**31 - 1)
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+
+        queue = multiprocessing.Queue()
+        workers = dict()
+        pending = range(len(candidates))
+        results = []
+        best = None
+
+        # the timeout applies to all candidates together
+        deadline = None if timeout is None else time.time() + timeout
+
+        try:
+            while pending or workers:
+                # keep the allowed number of workers busy
+                while pending and len(workers) < n_workers:
+                    i = pending.pop(0)
+                    workers[i] = multiprocessing.Process(target=self._solve_candidate,
+                                                         args=(i, candidates[i], queue))
+                    workers[i].daemon = True
+                    workers[i].start()
+                
+                # (the workers are checked regularly, because a worker that
+                #  gets killed, e.g. by the OOM killer, never reports a result)
+                interval = 0.5
+                if deadline is not None:
+                    interval = min(interval, max(0.0, deadline - time.time()))
+                
+                try:
+                    res = queue.get(timeout=interval)
+                except Queue.Empty:
+                    if deadline is not None and time.time() >= deadline:
+                        logger.warning("Multistart: timeout after {} s".format(timeout))
+                        break
+                    
+                    dead = [i for i, w in workers.items() if not w.is_alive()]
+                    if not dead:
+                        continue
+                    
+                    try:
+                        # the result of a finished worker may still be on its way
+                        res = queue.get(timeout=0.1)
+                    except Queue.Empty:
+                        i = dead[0]
+                        workers[i].join()
+                        res = dict(index=i, candidate=candidates[i],
+                                   error="worker exited with code {}".format(workers[i].exitcode))
+                
+                workers.pop(res['index']).join()
+                results.append(res)
+
+                if res['error'] is not None:
+                    logger.warning("Multistart: candidate {} failed ({})".format(res['index'], res['error']))
+                    continue
+
+                logger.info("Multistart: candidate {} finished (reached accuracy: {}, error: {})".format(
+                             res['index'], res['reached_accuracy'], res['boundary_error']))
+
+                if best is None or (res['reached_accuracy'], -res['boundary_error']) \
+                                   > (best['reached_accuracy'], -best['boundary_error']):
+                    best = res
+
+                if res['reached_accuracy']:
+                    break
+        finally:
+            # cancel the remaining candidates
+            for w in workers.values():
+                w.terminate()
+                w.join()
+        
+        if best is None:
+            raise RuntimeError("Multistart: none of the {} candidates yielded a solution".format(len(candidates)))
+
+        self.multistart_results = results
+        self._set_solution(best)
+
+        return self.eqs.trajectories.x, self.eqs.trajectories.u
+
+    def _solve_candidate(self, index, candidate, queue):
+        '''
+        Solves the problem for one candidate of :py:meth:`solve_multistart`
+        (runs in a forked worker process and reports to `queue`).
+        '''
+
+        res = dict(index=index, candidate=candidate, error=None)
+
+        # the candidates would overwrite each other's checkpoints
+        # (and the one of this system)
+        self._parameters['checkpoint'] = None
+
+        try:
+            self._apply_candidate(candidate)
+            self.solve()
+
+            traj = self.eqs.trajectories
+            res.update(reached_accuracy=self.reached_accuracy, boundary_error=self.boundary_error,
+                       nIt=self.nIt, sol=self.eqs.sol, guess=self.eqs.guess,
+                       n_parts_x=traj.n_parts_x, n_parts_u=traj.n_parts_u)
+        except Exception as err:
+            res['error'] = repr(err)
+
+        queue.put(res)
+
+    def _apply_candidate(self, candidate):
+        '''
+        Applies the method parameters and starting point of a multistart candidate.
+        '''
+
+        for k, v in candidate.items():
+            if k not in {'first_guess', 'perturbation', 'seed'}:
+                self.set_param(k, v)
+
+        if candidate.has_key('first_guess'):
+            self.eqs._first_guess = candidate['first_guess']
+
+        if candidate.get('perturbation'):
+            # determine the usual guess for the first iteration and perturb it
+            traj = self.eqs.trajectories
+            traj.init_splines()
+            self.eqs.get_guess()
+            traj.splines = dict()
+            
+            rng = np.random.RandomState(candidate.get('seed'))
+            guess = self.eqs.guess + candidate['perturbation'] * rng.randn(self.eqs.guess.size)
+            self.eqs._first_guess = guess
+
+    def _set_solution(self, res):
+        '''
+        Rebuilds the splines from a solution found by a multistart candidate
+        or an earlier iteration.
+        '''
+
+        self._apply_candidate(dict((k, v) for k, v in res.get('candidate', {}).items()
+                                   if k not in {'perturbation', 'seed'}))
+
+        traj = self.eqs.trajectories
+        traj._parameters['n_parts_x'] = res['n_parts_x']
+        traj._parameters['n_parts_u'] = res['n_parts_u']
+        traj.init_splines()
+        traj.set_coeffs(res['sol'])
+        self.eqs.guess = res['guess']
+        self.eqs.sol = res['sol']
+        self.nIt = res['nIt']
+
+        self.simulate()
+        self.check_accuracy()
+
+        if self.constraints:
+            self.constrain()
+
     def _iterate(self):
         '''
         This method is used to run one iteration step.
@@ -303,35 +849,205 @@ class ControlSystem(object):
         As a last, the resulting initial value problem is simulated.
         '''
 
+        self._emit('iteration', nIt=len(self.stats['iterations']) + 1,
+                   n_parts_x=self.eqs.trajectories.n_parts_x, n_parts_u=self.eqs.trajectories.n_parts_u)
+        
+        # peak memory usage of the phases (if it is tracked)
+        memory = dict()
+        mt = self._parameters['memory_tracking']
+        
         # Initialise the spline function objects
-        self.eqs.trajectories.init_splines()
+        with track_memory(memory, 'init_splines', mt):
+            self.eqs.trajectories.init_splines()
         
         # Get an initial value (guess)
-        self.eqs.get_guess()
+        with track_memory(memory, 'guess', mt):
+            self.eqs.get_guess()
         
         # Build the collocation equations system
-        C = self.eqs.build()
-        G, DG = C.G, C.DG
+        with track_memory(memory, 'build', mt):
+            C = self.eqs.build()
+            G, DG = C.G, C.DG
+        
+        for k, v in self.eqs.memory_stats.items():
+            memory['build/' + k] = v
         
         # Solve the collocation equation system
-        sol = self.eqs.solve(G, DG)
+        with track_memory(memory, 'solve', mt):
+            sol = self.eqs.solve(G, DG, time_limit=self._remaining_time(),
+                                 callback=lambda step, res: self._emit('sol_step', step=step, residual=res),
+                                 stop=self._cancel_event.is_set)
+        
+        if self.eqs.solver_stats['steps'] == 0 and self._best is not None:
+            # the time was up (or the process was cancelled) before the solver could do anything
+            self._best_is_current = False
+            self.stats['iterations'].append(dict(n_parts_x=self.eqs.trajectories.n_parts_x,
+                                                 n_parts_u=self.eqs.trajectories.n_parts_u,
+                                                 sol_steps=0, skipped=True,
+                                                 sol_timed_out=self.eqs.solver_stats['timed_out'],
+                                                 memory=memory, time=time.time() - self._start_time))
+            return
         
         # Set the found solution
         self.eqs.trajectories.set_coeffs(sol)
 
-        # Solve the resulting initial value problem
-        self.simulate()
+        self._simulated = self._simulation_needed()
         
-        # check if desired accuracy is reached
-        self.check_accuracy()
+        if self._simulated:
+            # Solve the resulting initial value problem
+            # and check if desired accuracy is reached
+            with track_memory(memory, 'simulation', mt):
+                self.simulate()
+                self.check_accuracy()
+            
+            self._emit('simulation', boundary_error=self.boundary_error, consistency_error=self.consistency_error)
+        else:
+            self.reached_accuracy = False
+            self.boundary_error = None
+        
+        if self.reached_accuracy:
+            self._emit('accuracy_reached', nIt=len(self.stats['iterations']) + 1,
+                       boundary_error=self.boundary_error, consistency_error=self.consistency_error)
+        
+        # remember how this iteration went and whether it is the best so far
+        traj = self.eqs.trajectories
+        it = dict(n_parts_x=traj.n_parts_x, n_parts_u=traj.n_parts_u,
+                  sol_steps=self.eqs.solver_stats['steps'], sol_residual=self.eqs.solver_stats['residual'],
+                  sol_timed_out=self.eqs.solver_stats['timed_out'],
+                  sol_cancelled=self.eqs.solver_stats['cancelled'],
+                  boundary_error=self.boundary_error, consistency_error=self.consistency_error,
+                  reached_accuracy=self.reached_accuracy, simulated=self._simulated,
+                  sim_status=self.sim_status if self._simulated else None,
+                  memory=memory, time=time.time() - self._start_time)
+        self.stats['iterations'].append(it)
+        
+        # (iterations without simulation are only better than nothing)
+        err = self.boundary_error if self._simulated else np.inf
+        best = self._best
+        self._best_is_current = best is None or (self.reached_accuracy, -err) \
+                                                > (best['reached_accuracy'], -best['err'])
+        if self._best_is_current:
+            self._best = dict(nIt=len(self.stats['iterations']), n_parts_x=traj.n_parts_x,
+                              n_parts_u=traj.n_parts_u, sol=sol, guess=self.eqs.guess,
+                              reached_accuracy=self.reached_accuracy, err=err)
+
+    def _save_checkpoint(self):
+        if self._parameters['checkpoint'] is not None:
+            results.save_checkpoint(self, self._parameters['checkpoint'])
+
+    def _resume_iteration(self, cp):
+        '''
+        Repeats the iteration stored in the checkpoint `cp` with its solution
+        as the guess (see :py:meth:`resume`).
+        '''
+        
+        # the checkpoint has to belong to this problem
+        sys = self.dyn_sys
+        bv = results._boundary_arrays(sys)
+        if (cp['states'], cp['inputs']) != (sys.states, sys.inputs) \
+                or not np.allclose([cp['a'], cp['b']], [sys.a, sys.b]) \
+                or not all(np.allclose(cp[k], bv[k], equal_nan=True) for k in ('xa', 'xb', 'ua', 'ub')):
+            raise ValueError("The checkpoint belongs to another problem")
+        
+        # the statistics and the best solution of the earlier iterations
+        self.stats['iterations'] = cp['iterations'][:-1]
+        if cp['best']['nIt'] < cp['nIt']:
+            self._best = cp['best']
+        
+        # rebuild the splines with the stored number of parts
+        # (without old splines the guess is the `first_guess` --> CollocationSystem.get_guess())
+        traj = self.eqs.trajectories
+        traj._parameters['n_parts_x'] = cp['n_parts_x']
+        traj._parameters['n_parts_u'] = cp['n_parts_u']
+        traj.splines = dict()
+        
+        logger.info("Resume iteration {}: {} spline parts".format(cp['nIt'], cp['n_parts_x']))
+        
+        first_guess = self.eqs._first_guess
+        self.eqs._first_guess = cp['sol']
+        try:
+            self._iterate()
+        finally:
+            self.eqs._first_guess = first_guess
+        
+        self.nIt = cp['nIt']
+
+    def _simulation_needed(self):
+        '''
+        Decides whether to simulate the initial value problem in the current
+        iteration (see the parameter `sim_policy`).
+        
+        With the policy 'estimate' the simulation is skipped (except for the
+        last iteration) if the consistency error, which can be computed cheaply,
+        shows that the desired accuracy won't be reached. If the tolerance `ierr`
+        is set, this is exactly its criterion. Otherwise the deviation at the
+        end of the interval is estimated by the integral of the consistency error
+        and has to be less than ten times the tolerance `eps`.
+        '''
+        
+        if self._parameters['sim_policy'] == 'always':
+            return True
+        
+        if len(self.stats['iterations']) + 1 >= self._parameters['maxIt']:
+            # the last iteration
+            return True
+        
+        ierr = self._parameters['ierr']
+        eps = self._parameters['eps']
+        
+        maxH, error = self._consistency_error(return_error_array=True)
+        
+        if ierr:
+            self.consistency_error = maxH
+            needed = bool(maxH < ierr)
+        else:
+            self.consistency_error = None
+            dt = (self.dyn_sys.b - self.dyn_sys.a) / (len(error) - 1.0)
+            needed = bool(np.trapz(abs(error), dx=dt, axis=0).max() < 10 * eps)
+        
+        if not needed:
+            logger.debug("Skip simulation (consistency error: {})".format(maxH))
+        
+        return needed
+
+    def _consistency_error(self, return_error_array=False):
+        '''
+        Calculates the consistency error of the current solution
+        (see :py:func:`auxiliary.consistency_error`) for all points at once.
+        '''
+        
+        traj = self.eqs.trajectories
+        
+        return auxiliary.consistency_error((self.dyn_sys.a, self.dyn_sys.b), traj.x, traj.u, traj.dx,
+                                           self.eqs._ff_vectorized, return_error_array=return_error_array,
+                                           vectorized=True)
+
+    def _remaining_time(self):
+        '''
+        Returns the number of seconds left for the solution process
+        (or `None` if there is no time limit).
+        '''
+        
+        time_limit = self._parameters['time_limit']
+        
+        if time_limit is None:
+            return None
+        else:
+            return max(time_limit - (time.time() - self._start_time), 0)
 
     def simulate(self):
         '''
         This method is used to solve the resulting initial value problem
         after the computation of a solution for the input trajectories.
+        
+        The simulation stops early if the state is not finite anymore, exceeds
+        the bound `sim_bound` or deviates more than `sim_deviation` times `eps`
+        from the spline trajectories (only the unconstrained state variables are
+        compared). Then :py:attr:`sim_data` only covers the time until then and
+        :py:attr:`sim_status` tells the reason (see :py:class:`simulation.Simulator`).
         '''
 
-        logging.debug("Solving Initial Value Problem")
+        logger.debug("Solving Initial Value Problem")
 
         # calulate simulation time
         T = self.dyn_sys.b - self.dyn_sys.a
@@ -351,13 +1067,32 @@ class ControlSystem(object):
         for x in x_vars:
             start.append(start_dict[x])
         
+        # criteria for an early abort of the simulation
+        k = self._parameters['sim_deviation']
+        if k is not None:
+            constrained = [i for i in xrange(len(x_vars)) if self.constraints and self.constraints.has_key(i)]
+            
+            def reference(t):
+                x = np.array(self.eqs.trajectories.x(t), dtype=float)
+                x[constrained] = np.nan
+                return x
+            
+            max_deviation = k * self._parameters['eps']
+        else:
+            reference, max_deviation = None, None
+        
         # create simulation object
-        S = Simulator(ff, T, start, self.eqs.trajectories.u)
+        S = Simulator(ff, T, start, self.eqs.trajectories.u, x_bound=self._parameters['sim_bound'],
+                      reference=reference, max_deviation=max_deviation)
         
-        logging.debug("start: %s"%str(start))
+        logger.debug("start: %s"%str(start))
         
         # start forward simulation
         self.sim_data = S.simulate()
+        self.sim_status = S.status
+        
+        if S.status != 'finished':
+            logger.info("Simulation aborted at t = {} ({})".format(self.sim_data[0][-1], S.status))
     
     def check_accuracy(self):
         '''
@@ -388,33 +1123,43 @@ class ControlSystem(object):
         xb = dict([(k, v[1]) for k, v in bv.items() if k in x_sym])
         
         # what is the error
-        logging.debug(40*"-")
-        logging.debug("Ending up with:   Should Be:  Difference:")
+        logger.debug(40*"-")
+        logger.debug("Ending up with:   Should Be:  Difference:")
 
         err = np.empty(xt.shape[1])
         for i, xx in enumerate(x_sym):
             err[i] = abs(xb[xx] - xt[-1][i])
-            logging.debug(str(xx)+" : %f     %f    %f"%(xt[-1][i], xb[xx], err[i]))
+            logger.debug(str(xx)+" : %f     %f    %f"%(xt[-1][i], xb[xx], err[i]))
         
-        logging.debug(40*"-")
+        logger.debug(40*"-")
         
         #if self._ierr:
         ierr = self._parameters['ierr']
         eps = self._parameters['eps']
         if ierr:
             # calculate maximum consistency error on the whole interval
-            maxH = auxiliary.consistency_error((a,b), self.eqs.trajectories.x, self.eqs.trajectories.u, self.eqs.trajectories.dx, self.dyn_sys.f_num)
+            maxH = self._consistency_error()
             
             reached_accuracy = (maxH < ierr) and (max(err) < eps)
-            logging.debug('maxH = %f'%maxH)
+            logger.debug('maxH = %f'%maxH)
+            self.consistency_error = maxH
         else:
             # just check if tolerance for the boundary values is satisfied
             reached_accuracy = max(err) < eps
+            self.consistency_error = None
+        
+        if self.sim_status not in (None, 'finished'):
+            # the simulation was aborted before the end of the interval
+            # (see self.simulate())
+            err[:] = np.inf
+            reached_accuracy = False
+        
+        self.boundary_error = max(err)
         
         if reached_accuracy:
-            logging.info("  --> reached desired accuracy: "+str(reached_accuracy))
+            logger.info("  --> reached desired accuracy: "+str(reached_accuracy))
         else:
-            logging.debug("  --> reached desired accuracy: "+str(reached_accuracy))
+            logger.debug("  --> reached desired accuracy: "+str(reached_accuracy))
         
         self.reached_accuracy = reached_accuracy
     
@@ -429,7 +1174,7 @@ class ControlSystem(object):
         try:
             import matplotlib
         except ImportError:
-            logging.error('Matplotlib is not available for plotting.')
+            logger.error('Matplotlib is not available for plotting.')
             return
 
         if self.constraints:
@@ -473,17 +1218,39 @@ class ControlSystem(object):
         save['traj'] = self.eqs.trajectories.save()
         
         if fname is not None:
-            if not (fname.endswith('.pcl') or fname.endswith('.pcl')):
+            if not fname.endswith('.pcl'):
                 fname += '.pcl'
         
-            with open(fname, 'w') as dumpfile:
+            with open(fname, 'wb') as dumpfile:
                 pickle.dump(save, dumpfile)
 
         return save
 
-    @property
-    def a(self):
-        return self.dyn_sys.a
+    def save_results(self, fname):
+        '''
+        Saves the solution (splines, boundary values, parameters and simulation results)
+        in a compact binary format that can be loaded without sympy
+        (see :py:func:`results.save_results` and :py:func:`results.load_results`).
+        '''
+        
+        return results.save_results(self, fname)
+
+    def export_evaluator(self, fname=None):
+        '''
+        Returns a :py:class:`results.TrajectoryEvaluator` for the solution that
+        only depends on numpy (and saves it if `fname` is given).
+        '''
+        
+        evaluator = results.TrajectoryEvaluator.from_system(self)
+        
+        if fname is not None:
+            evaluator.save(fname)
+        
+        return evaluator
+
+    @property
+    def a(self):
+        return self.dyn_sys.a
 
     @property
     def b(self):
@@ -508,94 +1275,858 @@ class DynamicalSystem(object):
 
     ua, ub : iterables
         The initial and final conditions for the input variables
+    
+    backend : str
+        How to generate the numeric vector field
+        (see :py:func:`auxiliary.sym2num_vectorfield`)
+    
+    n_procs : int
+        Number of worker processes for the symbolic preprocessing
+    
+    mass_matrix : callable or array_like
+        Mass matrix if the vector field is given implicitly
+        (see :py:class:`MassMatrixModel`)
+    
+    numeric : bool
+        Whether `f_sym` is a vectorized numeric function
+        (see :py:class:`NumericModel`)
+    
+    fd_method : str
+        How to approximate the jacobian of a numeric vector field
+    
+    sparsity : array_like or str
+        Structure of the jacobian of a numeric vector field
+    
+    model : SymbolicModel
+        The result of a previous analysis of the vector field
+        (if not given, `f_sym` will be analysed)
     '''
 
-    def __init__(self, f_sym, a=0., b=1., xa=[], xb=[], ua=[], ub=[]):
+    def __init__(self, f_sym, a=0., b=1., xa=[], xb=[], ua=[], ub=[], backend='lambdify',
+                 n_procs=1, mass_matrix=None, numeric=False, fd_method='central', sparsity=None,
+                 model=None):
         self.f_sym = f_sym
         self.a = a
         self.b = b
 
         # analyse the given system
-        self.n_states, self.n_inputs = self._determine_system_dimensions(n=len(xa))
+        # (this is the only place where the vector field gets evaluated)
+        if model is None and mass_matrix is not None:
+            model = MassMatrixModel(f_sym, mass_matrix, n_states=len(xa), n_procs=n_procs)
+        elif model is None and numeric:
+            model = NumericModel(f_sym, n_states=len(xa), n_inputs=len(ua) or None,
+                                 fd_method=fd_method, sparsity=sparsity,
+                                 sample_box=self._sample_box(xa, xb, ua, ub))
+        elif model is None:
+            model = SymbolicModel(f_sym, n_states=len(xa), n_procs=n_procs)
+        self.model = model
+        
+        self.n_states = model.n_states
+        self.n_inputs = model.n_inputs
 
         # set names of the state and input variables
         # (will be used as keys in various dictionaries)
-        self.states = tuple(['x{}'.format(i+1) for i in xrange(self.n_states)])
-        self.inputs = tuple(['u{}'.format(j+1) for j in xrange(self.n_inputs)])
+        self.states = model.states
+        self.inputs = model.inputs
         
         # init dictionary for boundary values
         self.boundary_values = self._get_boundary_dict_from_lists(xa, xb, ua, ub)
 
         # create a numeric counterpart for the vector field
         # for faster evaluation
-        self.f_num = auxiliary.sym2num_vectorfield(f_sym=self.f_sym, x_sym=self.states, u_sym=self.inputs,
-                                                   vectorized=False, cse=False)
+        self.f_num = model.numeric_vectorfield(backend=backend)
+
+    @property
+    def f_expr(self):
+        # the symbolic expression of the vector field
+        return self.model.f
+
+    @staticmethod
+    def _sample_box(xa, xb, ua, ub):
+        '''
+        Returns bounds of the variables for the numerical analysis of the
+        vector field that enclose the boundary values with a margin.
+        '''
+        
+        if not ua and not ub:
+            ua = ub = []
+        
+        lower = []
+        upper = []
+        for va, vb in zip(list(xa) + list(ua), list(xb) + list(ub)):
+            values = [v for v in (va, vb) if v is not None]
+            if not values:
+                lower.append(None)
+                upper.append(None)
+                continue
+            
+            margin = max(1.0, max(values) - min(values))
+            lower.append(min(values) - margin)
+            upper.append(max(values) + margin)
+        
+        return lower, upper
+
+    def _get_boundary_dict_from_lists(self, xa, xb, ua, ub):
+        '''
+        Creates a dictionary of boundary values for the state and input variables
+        for easier access.
+        '''
+
+        # consistency check
+        assert len(xa) == len(xb) == self.n_states
+        #assert len(ua) == len(ub) == self.n_inputs
+        if not ua and not ub:
+            ua = [None] * self.n_inputs
+            ub = [None] * self.n_inputs
+
+        # init dictionary
+        boundary_values = dict()
+
+        # add state boundary values
+        for i, x in enumerate(self.states):
+            boundary_values[x] = (xa[i], xb[i])
+
+        # add input boundary values
+        for j, u in enumerate(self.inputs):
+            boundary_values[u] = (ua[j], ub[j])
+
+        return boundary_values
+
+
+class SymbolicModel(object):
+    '''
+    Holds the results of the symbolic analysis of a vector field, which
+    is done just once per dynamical system: the expression, the system dimensions,
+    the integrator chains, the jacobian (and its structure) and the numeric functions
+    generated from them.
+    
+    The jacobian and the numeric functions are created on demand and cached.
+
+    Parameters
+    ----------
+
+    f_sym : callable or list
+        The (symbolic) vector field or its expression in the symbols
+        `x1, x2, ..., u1, ...` (then `n_inputs` has to be given)
+
+    n_states : int
+        Number of state variables
+    
+    n_inputs : int
+        Number of input variables (determined from `f_sym` if not given)
+    
+    n_procs : int
+        Number of worker processes for the symbolic preprocessing
+        (see :py:func:`auxiliary.jacobian`)
+    '''
+
+    def __init__(self, f_sym, n_states, n_inputs=None, n_procs=1):
+        self.n_states = n_states
+        self.n_procs = n_procs
+        
+        if callable(f_sym):
+            n_inputs, f = self._determine_system_dimensions(f_sym, n_states)
+        else:
+            f = f_sym
+        
+        self.n_inputs = n_inputs
+        self.states = tuple(['x{}'.format(i+1) for i in xrange(self.n_states)])
+        self.inputs = tuple(['u{}'.format(j+1) for j in xrange(self.n_inputs)])
+        
+        # the symbolic expression of the vector field
+        self.f = list(sp.Matrix(f))
+        
+        assert len(self.f) == self.n_states
+        
+        # cache for the parts that are created on demand
+        self._cache = dict()
+        self._lock = threading.RLock()
 
-    def _determine_system_dimensions(self, n):
+    def __deepcopy__(self, memo):
+        # the model doesn't change after its creation
+        # so copies (e.g. of the dynamical system) can share it
+        return self
+
+    @staticmethod
+    def _determine_system_dimensions(f_sym, n):
         '''
-        Determines the number of state and input variables.
+        Determines the number of input variables and the symbolic
+        expression of the vector field.
 
         Parameters
         ----------
 
+        f_sym : callable
+            The (symbolic) vector field
+
         n : int
-            Length of the list of initial state values
+            Number of state variables
         '''
 
         # first, determine system dimensions
-        logging.debug("Determine system/input dimensions")
+        logger.debug("Determine system/input dimensions")
         
         # the number of system variables can be determined via the length
         # of the boundary value lists
-        n_states = n
+        x = sp.symbols(['x{}'.format(i+1) for i in xrange(n)])
         
         # now we want to determine the input dimension
         # therefore we iteratively increase the inputs dimension and try to call
-        # the vectorfield
-        found_n_inputs = False
-        x = np.ones(n_states)
-
+        # the vectorfield with symbols, so the successful call also yields its expression
         j = 0
-        while not found_n_inputs:
-            u = np.ones(j)
+        while True:
+            u = sp.symbols(['u{}'.format(k+1) for k in xrange(j)])
 
             try:
-                self.f_sym(x, u)
+                f = f_sym(x, u)
                 # if no ValueError is raised j is the dimension of the inputs
-                n_inputs = j
-                found_n_inputs = True
+                break
             except (TypeError, ValueError):
                 # unpacking error inside f_sym
                 # (that means the dimensions don't match)
                 j += 1
         
-        logging.debug("--> state: {}".format(n_states))
-        logging.debug("--> input : {}".format(n_inputs))
+        logger.debug("--> state: {}".format(n))
+        logger.debug("--> input : {}".format(j))
 
-        return n_states, n_inputs
+        return j, f
 
-    def _get_boundary_dict_from_lists(self, xa, xb, ua, ub):
+    def _cached(self, key, create):
+        # the model may be shared by systems that are solved in parallel threads
+        # (the lock is reentrant because the parts may depend on each other)
+        with self._lock:
+            if not self._cache.has_key(key):
+                self._cache[key] = create()
+            return self._cache[key]
+
+    @property
+    def chains(self):
         '''
-        Creates a dictionary of boundary values for the state and input variables
-        for easier access.
+        The integrator chains of the vector field and the indices of the
+        equations that have to be solved using collocation
+        (see :py:func:`auxiliary.find_integrator_chains`).
         '''
+        return self._cached('chains', lambda: auxiliary.find_integrator_chains(self))
 
-        # consistency check
-        assert len(xa) == len(xb) == self.n_states
-        #assert len(ua) == len(ub) == self.n_inputs
-        if not ua and not ub:
-            ua = [None] * self.n_inputs
-            ub = [None] * self.n_inputs
+    @property
+    def Df(self):
+        '''
+        The jacobian matrix of the vector field with respect to `[x, u]`.
+        '''
+        return self._cached('Df', lambda: auxiliary.jacobian(self.f, self.states + self.inputs,
+                                                             n_procs=self.n_procs))
 
-        # init dictionary
-        boundary_values = dict()
+    @property
+    def Df_pattern(self):
+        '''
+        The rows and columns of the structurally nonzero entries of the jacobian.
+        '''
+        def create():
+            Df = self.Df
+            
+            # most entries of the jacobian are structurally zero (especially for mechanical systems)
+            Df_rows, Df_cols = [], []
+            for i in xrange(Df.shape[0]):
+                for j in xrange(Df.shape[1]):
+                    if Df[i,j] != 0:
+                        Df_rows.append(i)
+                        Df_cols.append(j)
+            
+            return (np.array(Df_rows, dtype=int), np.array(Df_cols, dtype=int))
+        
+        return self._cached('Df_pattern', create)
 
-        # add state boundary values
-        for i, x in enumerate(self.states):
-            boundary_values[x] = (xa[i], xb[i])
+    @property
+    def dependency_pattern(self):
+        '''
+        The rows and columns of the variables every component of the vector field
+        depends on, i.e. the entries of the jacobian that may be nonzero
+        (determined without differentiating the vector field).
+        '''
+        def create():
+            variables = self.states + self.inputs
+            
+            Df_rows, Df_cols = [], []
+            for i, fi in enumerate(self.f):
+                names = set(str(s) for s in sp.sympify(fi).free_symbols)
+                cols = [j for j, v in enumerate(variables) if v in names]
+                
+                Df_rows.extend([i] * len(cols))
+                Df_cols.extend(cols)
+            
+            return (np.array(Df_rows, dtype=int), np.array(Df_cols, dtype=int))
+        
+        return self._cached('dependency_pattern', create)
 
-        # add input boundary values
-        for j, u in enumerate(self.inputs):
-            boundary_values[u] = (ua[j], ub[j])
+    def numeric_vectorfield(self, backend='lambdify'):
+        '''
+        Returns the numeric vector field `f_num(x, u)` (for single points).
+        '''
+        
+        def create():
+            return auxiliary.sym2num_vectorfield(f_sym=self.f, x_sym=self.states, u_sym=self.inputs,
+                                                 vectorized=False, cse=False, backend=backend)
+        
+        return self._cached(('f_num', backend), create)
 
-        return boundary_values
+    def vectorized_vectorfield(self, backend='lambdify'):
+        '''
+        Returns the vectorized vector field (without generating the function
+        for its jacobian, see :py:meth:`vectorized_functions`).
+        '''
+        
+        def create():
+            return auxiliary.sym2num_vectorfield(self.f, self.states, self.inputs,
+                                                 vectorized=True, cse=True,
+                                                 backend=backend, n_procs=self.n_procs)
+        
+        return self._cached(('ff_vectorized', backend), create)
+
+    def vectorized_functions(self, backend='lambdify'):
+        '''
+        Returns vectorized functions for the vector field and the nonzero entries
+        of its jacobian (in the order given by :py:attr:`Df_pattern`) which
+        take arrays of points as arguments.
+        '''
+        
+        def create():
+            Df_rows, Df_cols = self.Df_pattern
+            Df_nonzero = [self.Df[i,j] for i, j in zip(Df_rows, Df_cols)]
+            
+            ff_vectorized = self.vectorized_vectorfield(backend)
+            Df_vectorized = auxiliary.sym2num_vectorfield(Df_nonzero, self.states, self.inputs,
+                                                          vectorized=True, cse=True,
+                                                          backend=backend, n_procs=self.n_procs)
+            return ff_vectorized, Df_vectorized
+        
+        return self._cached(('vectorized', backend), create)
+
+
+class MassMatrixModel(SymbolicModel):
+    '''
+    Symbolic model of a vector field that is given implicitly by a mass matrix
+    
+    .. math::
+        
+        M(x) \dot{x} = F(x, u)
+    
+    The equations are not solved symbolically (which is very expensive for
+    multibody systems). Instead, the vector field and its jacobian
+    
+    .. math::
+        
+        \\frac{\partial f}{\partial z} = M^{-1} \left( \\frac{\partial F}{\partial z}
+                                                     - \\frac{\partial M}{\partial z} f \\right)
+    
+    are evaluated by solving the linear systems numerically for all points at once.
+    So only the (much smaller) expressions of `M` and `F` have to be differentiated.
+    
+    Rows of the mass matrix that are unit vectors (e.g. those of the positions
+    of a mechanical system) are treated as explicit equations, so integrator
+    chains can still be found. The expressions of the other rows in :py:attr:`f`
+    are just placeholders and :py:attr:`Df` is not available.
+    
+    Parameters
+    ----------
+    
+    f_sym : callable or list
+        The right hand side `F` (see :py:class:`SymbolicModel`)
+    
+    mass_matrix : callable or array_like
+        The mass matrix (`n_states` x `n_states`) or a callable that returns it
+        for the symbols of the state variables
+    
+    n_states, n_inputs, n_procs
+        See :py:class:`SymbolicModel`
+    '''
+    
+    def __init__(self, f_sym, mass_matrix, n_states, n_inputs=None, n_procs=1):
+        SymbolicModel.__init__(self, f_sym, n_states, n_inputs, n_procs)
+        
+        x = sp.symbols(self.states)
+        xu = sp.symbols(self.states + self.inputs)
+        
+        if callable(mass_matrix):
+            mass_matrix = mass_matrix(x)
+        M = sp.Matrix(mass_matrix)
+        
+        if M.shape != (n_states, n_states):
+            raise ValueError("The mass matrix has to be of shape {0} x {0}".format(n_states))
+        
+        if any(M[i,j].has(*xu[n_states:]) for i in xrange(n_states) for j in xrange(n_states)):
+            raise ValueError("The mass matrix must not depend on the input variables")
+        
+        # the equations that are not given explicitly
+        eye = sp.eye(n_states)
+        implicit = [i for i in xrange(n_states) if M.row(i) != eye.row(i)]
+        explicit = [i for i in xrange(n_states) if i not in implicit]
+        
+        if any(M[i,j] != 0 for i in implicit for j in explicit):
+            raise ValueError("The derivatives of explicitly given state variables "
+                             "must not appear in the implicit equations")
+        
+        # the right hand side and the (relevant part of the) mass matrix
+        self.F = self.f
+        self.M = M.extract(implicit, implicit)
+        self._implicit = np.array(implicit, dtype=int)
+        
+        self.f = [self.F[i] if i in explicit else sp.Function('f_' + self.states[i])(*xu)
+                  for i in xrange(n_states)]
+
+    @property
+    def Df(self):
+        '''
+        The jacobian of the vector field isn't available symbolically.
+        '''
+        return None
+
+    @property
+    def DF(self):
+        '''
+        The jacobian matrix of the right hand side with respect to `[x, u]`.
+        '''
+        return self._cached('DF', lambda: auxiliary.jacobian(self.F, self.states + self.inputs,
+                                                             n_procs=self.n_procs))
+
+    @property
+    def dM(self):
+        '''
+        The nonzero entries of the derivatives of the mass matrix as
+        tuple of the row, column, index of the state variable and expression.
+        '''
+        def create():
+            x = sp.symbols(self.states)
+            k = self.M.shape[0]
+            
+            return [(i, j, l, self.M[i,j].diff(x[l])) for i in xrange(k) for j in xrange(k)
+                    for l in xrange(self.n_states) if self.M[i,j].diff(x[l]) != 0]
+        
+        return self._cached('dM', create)
+
+    @property
+    def Df_pattern(self):
+        '''
+        The rows and columns of the structurally nonzero entries of the jacobian
+        (the implicit equations couple via the inverse of the mass matrix, so they
+        share their columns).
+        '''
+        def create():
+            DF = self.DF
+            implicit = set(self._implicit)
+            
+            cols_implicit = set(l for i, j, l, expr in self.dM)
+            for i in implicit:
+                cols_implicit.update(j for j in xrange(DF.shape[1]) if DF[i,j] != 0)
+            
+            Df_rows, Df_cols = [], []
+            for i in xrange(self.n_states):
+                if i in implicit:
+                    cols = sorted(cols_implicit)
+                else:
+                    cols = [j for j in xrange(DF.shape[1]) if DF[i,j] != 0]
+                
+                Df_rows.extend([i] * len(cols))
+                Df_cols.extend(cols)
+            
+            return (np.array(Df_rows, dtype=int), np.array(Df_cols, dtype=int))
+        
+        return self._cached('Df_pattern', create)
+
+    def numeric_vectorfield(self, backend='lambdify'):
+        '''
+        Returns the numeric vector field `f_num(x, u)` (for single points).
+        '''
+        
+        def create():
+            ff_vectorized = self.vectorized_functions(backend)[0]
+            
+            def f_num(x, u):
+                X = np.asarray(x, dtype=float).reshape((-1, 1))
+                U = np.asarray(u, dtype=float).reshape((-1, 1))
+                return ff_vectorized(X, U)[:,0]
+            
+            return f_num
+        
+        return self._cached(('f_num', backend), create)
+
+    def vectorized_vectorfield(self, backend='lambdify'):
+        '''
+        Returns the vectorized vector field.
+        '''
+        return self.vectorized_functions(backend)[0]
+
+    def vectorized_functions(self, backend='lambdify'):
+        '''
+        Returns vectorized functions for the vector field and the nonzero entries
+        of its jacobian (in the order given by :py:attr:`Df_pattern`) which
+        take arrays of points as arguments.
+        '''
+        
+        def create():
+            n_states = self.n_states
+            n_vars = n_states + self.n_inputs
+            implicit = self._implicit
+            k = implicit.size
+            
+            def vectorize(expr):
+                return auxiliary.sym2num_vectorfield(expr, self.states, self.inputs,
+                                                     vectorized=True, cse=True,
+                                                     backend=backend, n_procs=self.n_procs)
+            
+            # numeric functions for the (small) expressions of `F`, `M` and their derivatives
+            DF_rows, DF_cols = np.nonzero([[self.DF[i,j] != 0 for j in xrange(n_vars)]
+                                           for i in xrange(n_states)])
+            
+            F_vec = vectorize(self.F)
+            M_vec = vectorize(list(self.M))
+            DF_vec = vectorize([self.DF[i,j] for i, j in zip(DF_rows, DF_cols)])
+            
+            dM = self.dM
+            if dM:
+                dM_rows, dM_cols, dM_vars, dM_expr = [np.array(v) for v in zip(*dM)]
+                dM_vec = vectorize(list(dM_expr))
+            
+            Df_rows, Df_cols = self.Df_pattern
+            
+            def ff_vectorized(X, U, out=None):
+                f = np.array(F_vec(X, U), dtype=float).reshape((n_states, -1))
+                
+                if k:
+                    M = M_vec(X, U).reshape((k, k, -1)).transpose((2, 0, 1))
+                    f[implicit] = np.linalg.solve(M, f[implicit].T[:,:,None])[:,:,0].T
+                
+                if out is None:
+                    return f
+                out[...] = f
+            
+            def Df_vectorized(X, U, out=None):
+                n_pts = X.shape[1]
+                
+                # the whole jacobian of the right hand side in all points
+                A = np.zeros((n_states, n_vars, n_pts))
+                A[DF_rows, DF_cols] = DF_vec(X, U).reshape((-1, n_pts))
+                
+                if k:
+                    f = ff_vectorized(X, U)
+                    M = M_vec(X, U).reshape((k, k, -1)).transpose((2, 0, 1))
+                    
+                    # d/dz F - (d/dz M) * f  for the implicit equations ...
+                    B = A[implicit]
+                    if dM:
+                        np.subtract.at(B, (dM_rows, dM_vars),
+                                       dM_vec(X, U).reshape((-1, n_pts)) * f[implicit][dM_cols])
+                    
+                    # ... multiplied by the inverse of the mass matrix
+                    A[implicit] = np.linalg.solve(M, B.transpose((2, 0, 1))).transpose((1, 2, 0))
+                
+                Df = A[Df_rows, Df_cols]
+                
+                if out is None:
+                    return Df
+                out[...] = Df
+            
+            return ff_vectorized, Df_vectorized
+        
+        return self._cached(('vectorized', backend), create)
+
+
+class NumericModel(SymbolicModel):
+    '''
+    Model of a vector field that is only given as a vectorized numeric function
+    
+    .. math::
+        
+        F = f(X, U)
+    
+    of the values `X` and `U` of the state and input variables in many points
+    (one column per point). No symbolic processing takes place at all:
+    
+    * the jacobian is approximated by batched finite differences or the complex
+      step method (see :py:func:`auxiliary.numeric_jacobian`) in all points at once
+    * its structure is taken as dense unless a `sparsity` pattern is given
+      (or detected numerically on request)
+    * integrator chains are only taken from components that depend on a
+      single variable (according to the structure of the jacobian) and
+      equal an affine function of it throughout the `sample_box`
+    
+    So :py:attr:`f` and :py:attr:`Df` are not available.
+    
+    A numerical analysis only sees the points where the vector field gets
+    evaluated. E.g. a component that interpolates a table outside the
+    `sample_box` seems to be constant, so a detected structure may miss
+    nonzero entries of the jacobian.
+    
+    Parameters
+    ----------
+    
+    f_num : callable
+        The vectorized vector field, it has to return an array (or a sequence
+        of arrays or scalars) with `n_states` rows
+    
+    n_states : int
+        Number of state variables
+    
+    n_inputs : int
+        Number of input variables (determined from `f_num` if not given)
+    
+    fd_method : str
+        How to approximate the jacobian ('forward', 'central' or 'complex_step',
+        the latter requires `f_num` to accept complex arguments)
+    
+    sparsity : array_like or str
+        Structure of the jacobian, i.e. an array with `n_states` rows and
+        `n_states + n_inputs` columns whose nonzero entries mark the variables
+        every component may depend on. If it is `None` every component may depend
+        on all variables, 'detect' determines it numerically in the random points.
+    
+    sample_box : tuple
+        Lower and upper bounds of the values of the variables `[x, u]` (sequences
+        whose entries may be `None`) for the random points, the default is `[-1, 1]`
+    
+    n_samples : int
+        Number of random points used for the analysis of the vector field
+    
+    seed : int
+        Seed for the random points
+    '''
+    
+    # number of values of a variable in which a relation of an integrator chain is checked
+    _n_check = 101
+    
+    def __init__(self, f_num, n_states, n_inputs=None, fd_method='central', sparsity=None,
+                 sample_box=None, n_samples=3, seed=0):
+        if fd_method not in {'forward', 'central', 'complex_step'}:
+            raise ValueError("Unknown differentiation method: {}".format(fd_method))
+        
+        self.n_states = n_states
+        self.n_procs = 1
+        self.fd_method = fd_method
+        self._f_num = f_num
+        
+        if n_inputs is None:
+            n_inputs = self._determine_input_dimension(f_num, n_states)
+        
+        self.n_inputs = n_inputs
+        self.states = tuple(['x{}'.format(i+1) for i in xrange(self.n_states)])
+        self.inputs = tuple(['u{}'.format(j+1) for j in xrange(self.n_inputs)])
+        
+        # there is no expression of the vector field
+        self.f = None
+        
+        n_vars = n_states + n_inputs
+        
+        if isinstance(sparsity, str) and sparsity != 'detect':
+            raise ValueError("Unknown sparsity pattern: {}".format(sparsity))
+        elif sparsity is None or isinstance(sparsity, str):
+            self._sparsity = sparsity
+        else:
+            self._sparsity = np.asarray(sparsity) != 0
+            
+            if self._sparsity.shape != (n_states, n_vars):
+                raise ValueError("The sparsity pattern has to have the shape {}".format((n_states, n_vars)))
+        
+        # bounds of the variables for the numerical analysis of the vector field
+        lower = -np.ones(n_vars)
+        upper = np.ones(n_vars)
+        if sample_box is not None:
+            for k, (lo, up) in enumerate(zip(*sample_box)[:n_vars]):
+                if lo is not None and up is not None and lo < up:
+                    lower[k], upper[k] = lo, up
+        self._box = (lower, upper)
+        
+        # random points for the numerical analysis of the vector field
+        rand = np.random.RandomState(seed)
+        Z = lower[:,None] + (upper - lower)[:,None] * rand.uniform(0.0, 1.0, (n_vars, n_samples))
+        self._samples = (Z[:n_states], Z[n_states:])
+        
+        # cache for the parts that are created on demand
+        self._cache = dict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _determine_input_dimension(f_num, n):
+        '''
+        Determines the number of input variables by calling the
+        vector field with an increasing number of rows of input values.
+        '''
+        
+        logger.debug("Determine input dimension")
+        
+        X = np.zeros((n, 1))
+        
+        j = 0
+        while True:
+            try:
+                f_num(X, np.zeros((j, 1)))
+                break
+            except (TypeError, ValueError, IndexError):
+                # unpacking or indexing error inside f_num
+                j += 1
+        
+        logger.debug("--> input : {}".format(j))
+        
+        return j
+
+    def _evaluate(self, X, U):
+        '''
+        Evaluates the vector field and returns its values as one array.
+        '''
+        
+        f = self._f_num(X, U)
+        
+        F = np.empty((self.n_states, X.shape[1]), dtype=np.result_type(X, U, float))
+        
+        if len(f) != self.n_states:
+            raise ValueError("The vector field has to return {} rows".format(self.n_states))
+        
+        # rows may be scalars (e.g. constant or zero components)
+        for i in xrange(self.n_states):
+            F[i] = f[i]
+        
+        return F
+
+    @property
+    def chains(self):
+        '''
+        The integrator chains of the vector field and the indices of the
+        equations that have to be solved using collocation.
+        
+        A component of the vector field is taken as derivative of a variable
+        if it depends on no other variable (see :py:attr:`Df_pattern`, so there
+        are no chains unless a `sparsity` pattern is given or detected) and equals
+        an affine function of it in the random points and in many values
+        throughout the `sample_box`.
+        '''
+        def create():
+            logger.debug("Looking for integrator chains")
+            
+            # the variables every component depends on
+            Df_rows, Df_cols = self.Df_pattern
+            
+            variables = self.states + self.inputs
+            lower, upper = self._box
+            
+            chaindict = {}
+            coeffdict = {}
+            for i in xrange(self.n_states):
+                cols = Df_cols[Df_rows == i]
+                if cols.size != 1:
+                    continue
+                
+                k = cols[0]
+                
+                # the random points and the range of the variable
+                X, U = self._samples
+                Z = np.vstack((X, U))
+                Zk = np.tile(Z[:,:1], (1, self._n_check))
+                Zk[k] = np.linspace(lower[k], upper[k], self._n_check)
+                Z = np.hstack((Z, Zk))
+                
+                F = self._evaluate(Z[:self.n_states], Z[self.n_states:])[i]
+                
+                # fit `F = a * Z[k] + c` through the ends of the range
+                a = (F[-1] - F[-self._n_check]) / (upper[k] - lower[k])
+                c = F[-1] - a * upper[k]
+                
+                if a != 0 and np.allclose(F, a * Z[k] + c, rtol=1e-12, atol=1e-12):
+                    # (the coefficients always belong to the latest relation of the variable)
+                    chaindict[variables[k]] = self.states[i]
+                    coeffdict[variables[k]] = (a, c)
+            
+            return auxiliary.assemble_integrator_chains(chaindict, self, coeffdict)
+        
+        return self._cached('chains', create)
+
+    @property
+    def Df(self):
+        '''
+        The jacobian of the vector field isn't available symbolically.
+        '''
+        return None
+
+    @property
+    def Df_pattern(self):
+        '''
+        The rows and columns of the entries of the jacobian that may be nonzero:
+        all of them, those of the given `sparsity` pattern or (if it is 'detect')
+        the nonzero entries in any of the random points (a perturbation of a
+        variable the vector field doesn't depend on changes none of its values).
+        '''
+        def create():
+            n_vars = self.n_states + self.n_inputs
+            
+            if self._sparsity is None:
+                pattern = np.ones((self.n_states, n_vars), dtype=bool)
+            elif isinstance(self._sparsity, str):
+                X, U = self._samples
+                J = auxiliary.numeric_jacobian(self._evaluate, X, U, np.arange(n_vars),
+                                               method=self.fd_method)
+                pattern = np.any(J != 0, axis=2)
+            else:
+                pattern = self._sparsity
+            
+            Df_rows, Df_cols = np.nonzero(pattern)
+            
+            return (Df_rows.astype(int), Df_cols.astype(int))
+        
+        return self._cached('Df_pattern', create)
+
+    @property
+    def dependency_pattern(self):
+        '''
+        The entries of the jacobian that may be nonzero (see :py:attr:`Df_pattern`).
+        '''
+        return self.Df_pattern
+
+    def numeric_vectorfield(self, backend='lambdify'):
+        '''
+        Returns the numeric vector field `f_num(x, u)` (for single points).
+        '''
+        
+        def create():
+            def f_num(x, u):
+                X = np.asarray(x, dtype=float).reshape((-1, 1))
+                U = np.asarray(u, dtype=float).reshape((-1, 1))
+                return self._evaluate(X, U)[:,0]
+            
+            return f_num
+        
+        return self._cached('f_num', create)
+
+    def vectorized_vectorfield(self, backend='lambdify'):
+        '''
+        Returns the vectorized vector field.
+        '''
+        return self.vectorized_functions(backend)[0]
+
+    def vectorized_functions(self, backend='lambdify'):
+        '''
+        Returns vectorized functions for the vector field and the nonzero entries
+        of its jacobian (in the order given by :py:attr:`Df_pattern`) which
+        take arrays of points as arguments.
+        '''
+        
+        def create():
+            Df_rows, Df_cols = self.Df_pattern
+            
+            # only the variables the vector field depends on get perturbed
+            cols, Df_pos = np.unique(Df_cols, return_inverse=True)
+            
+            def ff_vectorized(X, U, out=None):
+                F = self._evaluate(X, U)
+                
+                if out is None:
+                    return F
+                out[...] = F
+            
+            def Df_vectorized(X, U, out=None):
+                J = auxiliary.numeric_jacobian(self._evaluate, X, U, cols, method=self.fd_method)
+                Df = J[Df_rows, Df_pos]
+                
+                if out is None:
+                    return Df
+                out[...] = Df
+            
+            return ff_vectorized, Df_vectorized
+        
+        return self._cached('vectorized', create)
@@ -2,8 +2,8 @@
 import numpy as np
 import copy
 
-from splines import Spline, differentiate
-from log import logging
+from splines import Spline, differentiate, spline_function
+from log import logger
 import auxiliary
 
 class Trajectory(object):
@@ -30,8 +30,10 @@ class Trajectory(object):
         self._parameters['kx'] = kwargs.get('kx', 2)
         self._parameters['nodes_type'] = kwargs.get('nodes_type', 'equidistant')
         self._parameters['use_std_approach'] = kwargs.get('use_std_approach', True)
+        self._parameters['use_dep_operator'] = kwargs.get('use_dep_operator', False)
         
-        self._chains, self._eqind = auxiliary.find_integrator_chains(sys)
+        chains, eqind = sys.model.chains
+        self._chains, self._eqind = list(chains), list(eqind)
         self._parameters['use_chains'] = kwargs.get('use_chains', True)
 
         # Initialise dictionaries as containers for all
@@ -76,12 +78,16 @@ class Trajectory(object):
         Parameters
         ----------
         
-        t : float
-            The time point in (a,b) to evaluate the system at.
+        t : float or numpy.ndarray
+            The time point(s) in (a,b) to evaluate the system at
+            (for an array of points there is one column per point).
         '''
         
+        if not np.isscalar(t):
+            return np.array([self.x_fnc[xx](t) for xx in self.sys.states])
+        
         if not self.sys.a <= t <= self.sys.b:
-            logging.warning("Time point 't' has to be in (a,b)")
+            logger.warning("Time point 't' has to be in (a,b)")
             arr = None
         else:
             arr = np.array([self.x_fnc[xx](t) for xx in self.sys.states])
@@ -95,12 +101,17 @@ class Trajectory(object):
         Parameters
         ----------
         
-        t : float
-            The time point in (a,b) to evaluate the input variables at.
+        t : float or numpy.ndarray
+            The time point(s) in (a,b) to evaluate the input variables at
+            (for an array of points there is one column per point).
         '''
         
+        if not np.isscalar(t):
+            t = np.clip(t, self.sys.a, self.sys.b)
+            return np.array([self.u_fnc[uu](t) for uu in self.sys.inputs])
+        
         if not self.sys.a <= t <= self.sys.b:
-            #logging.warning("Time point 't' has to be in (a,b)")
+            #logger.warning("Time point 't' has to be in (a,b)")
             arr = np.array([self.u_fnc[uu](self.sys.b) for uu in self.sys.inputs])
         else:
             arr = np.array([self.u_fnc[uu](t) for uu in self.sys.inputs])
@@ -114,12 +125,16 @@ class Trajectory(object):
         Parameters
         ----------
         
-        t : float
-            The time point in (a,b) to evaluate the 1st derivatives at.
+        t : float or numpy.ndarray
+            The time point(s) in (a,b) to evaluate the 1st derivatives at
+            (for an array of points there is one column per point).
         '''
         
+        if not np.isscalar(t):
+            return np.array([self.dx_fnc[xx](t) for xx in self.sys.states])
+        
         if not self.sys.a <= t <= self.sys.b:
-            logging.warning("Time point 't' has to be in (a,b)")
+            logger.warning("Time point 't' has to be in (a,b)")
             arr = None
         else:
             arr = np.array([self.dx_fnc[xx](t) for xx in self.sys.states])
@@ -137,7 +152,7 @@ class Trajectory(object):
             Dictionary of boundary values for the state and input splines functions.
         
         '''
-        logging.debug("Initialise Splines")
+        logger.debug("Initialise Splines")
         
         # store the old splines to calculate the guess later
         self._old_splines = copy.deepcopy(self.splines)
@@ -155,60 +170,57 @@ class Trajectory(object):
             for chain in self._chains:
                 upper = chain.upper
                 lower = chain.lower
+                
+                # every element is an affine function of a derivative of the upper end
+                # (its boundary values have to be transformed to those of the derivative)
+                transforms = chain.transforms
+                chain_bv = [_inverse_transform(bv[elem], *transforms[i])
+                            for i, elem in enumerate(chain.elements)]
         
                 # here we just create a spline object for the upper ends of every chain
                 # w.r.t. its lower end (whether it is an input variable or not)
                 if chain.lower.startswith('x'):
                     splines[upper] = Spline(self.sys.a, self.sys.b, n=self.n_parts_x, bv={0:bv[upper]}, tag=upper,
                                             nodes_type=self._parameters['nodes_type'],
-                                            use_std_approach=self._parameters['use_std_approach'])
+                                            use_std_approach=self._parameters['use_std_approach'],
+                                            use_dep_operator=self._parameters['use_dep_operator'])
                     splines[upper].type = 'x'
                 elif chain.lower.startswith('u'):
-                    splines[upper] = Spline(self.sys.a, self.sys.b, n=self.n_parts_u, bv={0:bv[lower]}, tag=upper,
+                    splines[upper] = Spline(self.sys.a, self.sys.b, n=self.n_parts_u, bv={0:chain_bv[-1]}, tag=upper,
                                             nodes_type=self._parameters['nodes_type'],
-                                            use_std_approach=self._parameters['use_std_approach'])
+                                            use_std_approach=self._parameters['use_std_approach'],
+                                            use_dep_operator=self._parameters['use_dep_operator'])
                     splines[upper].type = 'u'
         
                 # search for boundary values to satisfy
                 for i, elem in enumerate(chain.elements):
                     if elem in self.sys.states:
-                        splines[upper]._boundary_values[i] = bv[elem]
+                        splines[upper]._boundary_values[i] = chain_bv[i]
                         if splines[upper].type == 'u':
-                            splines[upper]._boundary_values[i+1] = bv[lower]
+                            splines[upper]._boundary_values[i+1] = chain_bv[-1]
         
                 # solve smoothness and boundary conditions
                 splines[upper].make_steady()
         
                 # calculate derivatives
                 for i, elem in enumerate(chain.elements):
+                    if i > 2:
+                        continue
+                    
+                    fnc = spline_function(splines[upper], i, *transforms[i])
+                    
                     if elem in self.sys.inputs:
-                        if (i == 0):
-                            u_fnc[elem] = splines[upper].f
-                        if (i == 1):
-                            u_fnc[elem] = splines[upper].df
-                        if (i == 2):
-                            u_fnc[elem] = splines[upper].ddf
+                        u_fnc[elem] = fnc
                     elif elem in self.sys.states:
-                        if (i == 0):
-                            splines[upper]._boundary_values[0] = bv[elem]
-                            if splines[upper].type == 'u':
-                                splines[upper]._boundary_values[1] = bv[lower]
-                            x_fnc[elem] = splines[upper].f
-                        if (i == 1):
-                            splines[upper]._boundary_values[1] = bv[elem]
-                            if splines[upper].type == 'u':
-                                splines[upper]._boundary_values[2] = bv[lower]
-                            x_fnc[elem] = splines[upper].df
-                        if (i == 2):
-                            splines[upper]._boundary_values[2] = bv[elem]
-                            x_fnc[elem] = splines[upper].ddf
+                        x_fnc[elem] = fnc
 
         # now handle the variables which are not part of any chain
         for i, xx in enumerate(self.sys.states):
             if not x_fnc.has_key(xx):
                 splines[xx] = Spline(self.sys.a, self.sys.b, n=self.n_parts_x, bv={0:bv[xx]}, tag=xx,
                                      nodes_type=self._parameters['nodes_type'],
-                                     use_std_approach=self._parameters['use_std_approach'])
+                                     use_std_approach=self._parameters['use_std_approach'],
+                                     use_dep_operator=self._parameters['use_dep_operator'])
                 splines[xx].make_steady()
                 splines[xx].type = 'x'
                 x_fnc[xx] = splines[xx].f
@@ -218,7 +230,8 @@ class Trajectory(object):
             if not u_fnc.has_key(uu):
                 splines[uu] = Spline(self.sys.a, self.sys.b, n=self.n_parts_u, bv={0:bv[uu]}, tag=uu,
                                      nodes_type=self._parameters['nodes_type'],
-                                     use_std_approach=self._parameters['use_std_approach'])
+                                     use_std_approach=self._parameters['use_std_approach'],
+                                     use_dep_operator=self._parameters['use_dep_operator'])
                 splines[uu].make_steady()
                 splines[uu].type = 'u'
                 u_fnc[uu] = splines[uu].f
@@ -253,7 +266,7 @@ class Trajectory(object):
         
         '''
         # TODO: look for bugs here!
-        logging.debug("Set spline coefficients")
+        logger.debug("Set spline coefficients")
         
         sol_bak = sol.copy()
         subs = dict()
@@ -302,3 +315,10 @@ class Trajectory(object):
 
         return save
         
+
+
+def _inverse_transform(values, scale, offset):
+    '''
+    Returns the boundary values of `(x - offset) / scale`.
+    '''
+    return tuple(None if v is None else (v - offset) / scale for v in values)
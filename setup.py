@@ -7,6 +7,7 @@ from distutils.core import setup
 setup(name='PyTrajectory',
     version='1.2.0',
     packages=['pytrajectory'],
+    scripts=['bin/pytrajectory-batch'],
     requires=['numpy (>=1.8.1)',
                 'sympy (>=0.7.5)',
                 'scipy (>=0.13.0)',
@@ -0,0 +1,46 @@
+# IMPORTS
+
+import pytrajectory
+import sympy as sp
+import numpy as np
+
+# NOTE:
+# The control systems that are shared by the tests.
+
+
+def pendulum(x, u):
+    x1, x2, x3, x4 = x
+    u1, = u
+    return [x2, u1, x4, 2.0*(9.81*sp.sin(x3) + u1*sp.cos(x3))]
+
+
+def double_integrator(x, u):
+    x1, x2 = x
+    u1, = u
+    return [x2, u1]
+
+
+def make_pendulum(**kwargs):
+    # swing up of the pendulum (the boundary values may be overridden)
+    args = dict(a=0.0, b=2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0], ua=[0.0], ub=[0.0])
+    args.update(kwargs)
+    return pytrajectory.ControlSystem(pendulum, **args)
+
+
+def make_double_integrator(**kwargs):
+    args = dict(a=0.0, b=2.0, xa=[0.0, 0.0], xb=[1.0, 0.0], ua=[0.0], ub=[0.0])
+    args.update(kwargs)
+    return pytrajectory.ControlSystem(double_integrator, **args)
+
+
+def make_counting_vectorfield():
+    # the pendulum that counts how often it is evaluated
+    # (calls with wrong dimensions fail before they are counted)
+    calls = []
+
+    def f(x, u):
+        ff = pendulum(x, u)
+        calls.append(1)
+        return ff
+
+    return f, calls
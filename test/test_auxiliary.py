@@ -4,6 +4,7 @@ import pytrajectory
 import pytest
 import sympy as sp
 import numpy as np
+from scipy import sparse
 
 
 class TestCseLambdify(object):
@@ -105,3 +106,127 @@ class TestCseLambdify(object):
         f = pytrajectory.auxiliary.cse_lambdify(args=(x, y), expr=expr, modules='numpy')
 
         assert f(0., 0.) == 1.
+
+
+class TestCseCodegen(object):
+
+    def get_expr(self):
+        x, y = sp.symbols('x, y')
+
+        M = sp.Matrix([[0.5*(x + y), sp.asin(sp.sin(0.5*(x+y)))],
+                       [sp.sin(x+y)**2 + sp.cos(x+y)**2, 1.0]])
+
+        return (x, y), M
+
+    @pytest.mark.parametrize('backend', ['numpy', 'numba', 'numexpr'])
+    def test_matrix_vectorized(self, backend):
+        if backend != 'numpy':
+            pytest.importorskip(backend)
+
+        args, M = self.get_expr()
+        ones = np.ones(10)
+
+        f = pytrajectory.auxiliary.cse_codegen(args=args, expr=M, backend=backend)
+
+        assert f.shape == (2, 2)
+
+        out = np.zeros((2, 2, 10))
+        res = f(ones, ones, out)
+
+        assert res is out
+        assert np.allclose(out, np.ones((2, 2, 10)))
+
+    def test_sym2num_vectorfield_backends(self):
+        def ff(x, u):
+            x1, x2 = x
+            u1, = u
+            return [x2, -x1**sp.Rational(3, 2) + u1]
+
+        x_sym = ('x1', 'x2')
+        u_sym = ('u1',)
+        X = np.array([[1.0, 4.0], [2.0, 3.0]])
+        U = np.array([[0.5, 1.0]])
+
+        f_ref = pytrajectory.auxiliary.sym2num_vectorfield(ff, x_sym, u_sym, vectorized=True)
+        f_gen = pytrajectory.auxiliary.sym2num_vectorfield(ff, x_sym, u_sym, vectorized=True,
+                                                           backend='numpy')
+
+        assert np.allclose(f_ref(X, U), f_gen(X, U))
+        assert np.allclose(f_gen(X, U), [[2.0, 3.0], [-0.5, -7.0]])
+
+        out = np.empty((2, 2))
+        f_gen(X, U, out=out)
+        assert np.allclose(out, f_ref(X, U))
+
+
+class TestParallelPreprocessing(object):
+
+    def get_expr(self):
+        x1, x2, u1 = sp.symbols('x1, x2, u1')
+        f = [1.0*x2, sp.sin(x1 + x2)**2 + sp.cos(x1 + x2) * u1, sp.exp(x1*x2) + sp.sin(x1 + x2)]
+
+        return (x1, x2, u1), f
+
+    def test_jacobian(self):
+        args, f = self.get_expr()
+        J_ref = sp.Matrix(f).jacobian(args)
+
+        for n_procs in (1, 2):
+            J = pytrajectory.auxiliary.jacobian(f, ['x1', 'x2', 'u1'], n_procs=n_procs)
+            assert J == J_ref
+
+    def test_parallel_cse(self):
+        args, f = self.get_expr()
+        vals = (0.3, -1.2, 2.0)
+
+        for n_procs in (1, 2):
+            fnc = pytrajectory.auxiliary.cse_lambdify(args, f, n_procs=n_procs, modules='numpy')
+            assert np.allclose(fnc(*vals), [float(e.subs(zip(args, vals))) for e in f])
+
+            gen = pytrajectory.auxiliary.cse_codegen(args, sp.Matrix(f), n_procs=n_procs)
+            out = gen(*(vals + (np.zeros((3, 1)),)))
+            assert np.allclose(out.ravel(), fnc(*vals))
+
+
+class TestNumericJacobian(object):
+
+    def fnc(self, X, U):
+        return np.array([X[0] * U[0], np.sin(X[1])])
+
+    @pytest.mark.parametrize('method', ['forward', 'central', 'complex_step'])
+    def test_methods(self, method):
+        X = np.random.rand(2, 5)
+        U = np.random.rand(1, 5)
+
+        J = pytrajectory.auxiliary.numeric_jacobian(self.fnc, X, U, [0, 2], method=method)
+
+        assert J.shape == (2, 2, 5)
+        assert np.allclose(J[0], [U[0], X[0]])
+        assert np.allclose(J[1], 0.0)
+
+    def test_unknown_method(self):
+        with pytest.raises(ValueError):
+            pytrajectory.auxiliary.numeric_jacobian(self.fnc, np.zeros((2, 1)), np.zeros((1, 1)),
+                                                    [0], method='backward')
+
+
+class TestColorColumns(object):
+
+    def test_tridiagonal(self):
+        n = 20
+        A = sparse.diags([np.ones(n-1), np.ones(n), np.ones(n-1)], [-1, 0, 1])
+
+        colors, n_colors = pytrajectory.auxiliary.color_columns(A)
+
+        assert n_colors == 3
+        assert np.array_equal(colors, np.arange(n) % 3)
+
+    def test_random(self):
+        A = sparse.random(50, 40, density=0.05, random_state=0, format='csr')
+
+        colors, n_colors = pytrajectory.auxiliary.color_columns(A)
+
+        # the columns of a group don't share any row
+        for k in xrange(n_colors):
+            counts = (A[:, colors == k] != 0).sum(axis=1)
+            assert counts.max() <= 1
@@ -0,0 +1,109 @@
+# IMPORTS
+
+import pytrajectory
+import pytest
+import sympy as sp
+import numpy as np
+import json
+import os
+
+from pytrajectory import batch
+from pytrajectory.results import load_results
+
+
+def double_integrator_spec(name, xb, **kwargs):
+    spec = dict(name=name, ff=['x2', 'u1'], a=0.0, b=2.0,
+                xa=[0.0, 0.0], xb=[xb, 0.0], ua=[0.0], ub=[0.0])
+    spec.update(kwargs)
+    return spec
+
+
+class TestParseVectorfield(object):
+
+    def test_expressions(self):
+        ff = batch.parse_vectorfield(['x2', 'u1 - sin(x1)'])
+
+        x1, x2, u1 = sp.symbols('x1, x2, u1')
+        assert ff([x1, x2], [u1]) == [x2, u1 - sp.sin(x1)]
+
+        # the dimensions are checked
+        with pytest.raises(ValueError):
+            ff([x1, x2], [])
+
+    def test_unknown_variables(self):
+        with pytest.raises(ValueError):
+            batch.parse_vectorfield(['x2', 'u1 + y'])
+
+        # more inputs are used than given
+        with pytest.raises(ValueError):
+            batch.parse_vectorfield(['x2', 'u2'], n_inputs=1)
+
+
+class TestSpecs(object):
+
+    def test_load_specs(self, tmpdir):
+        specs = [double_integrator_spec('p{}'.format(i), float(i)) for i in xrange(3)]
+
+        fname = tmpdir.join('specs.jsonl')
+        fname.write('\n'.join(json.dumps(spec) for spec in specs) + '\n')
+        assert batch.load_specs(str(fname)) == specs
+
+        # a directory of json files (names are taken from the files)
+        specdir = tmpdir.mkdir('specs')
+        for i, spec in enumerate(specs):
+            spec = dict(spec)
+            del spec['name']
+            specdir.join('q{}.json'.format(i)).write(json.dumps(spec))
+
+        assert [s['name'] for s in batch.load_specs(str(specdir))] == ['q0', 'q1', 'q2']
+
+    def test_shard(self):
+        specs = range(10)
+        parts = [batch.shard(specs, i, 3) for i in xrange(3)]
+
+        assert sorted(sum(parts, [])) == specs
+
+        with pytest.raises(ValueError):
+            batch.shard(specs, 3, 3)
+
+    def test_make_system(self):
+        spec = double_integrator_spec('p', 1.0, constraints={'1' : [-1.0, 1.0]},
+                                      kwargs={'sx' : 4, 'coll_type' : u'chebychev'})
+        S = batch.make_system(spec)
+
+        assert S.constraints == {1 : (-1.0, 1.0)}
+        assert S.eqs.trajectories.n_parts_x == 4
+        assert S.eqs._parameters['coll_type'] == 'chebychev'
+
+
+class TestBatch(object):
+
+    def test_main(self, tmpdir):
+        specs = [double_integrator_spec('p{}'.format(i), float(i)) for i in xrange(3)]
+        specs.append(double_integrator_spec('broken', 1.0, ff=['x2', 'v']))
+
+        fname = tmpdir.join('specs.jsonl')
+        fname.write('\n'.join(json.dumps(spec) for spec in specs) + '\n')
+        outdir = str(tmpdir.join('results'))
+
+        # two shards (one of them with two worker processes)
+        assert batch.main([str(fname), '-o', outdir, '--shard', '0/2', '-j', '2', '-q']) == 0
+        assert batch.main([str(fname), '-o', outdir, '--shard', '1/2', '-q']) == 1
+
+        summaries = []
+        for i in xrange(2):
+            with open(os.path.join(outdir, 'summary-{}-of-2.jsonl'.format(i))) as f:
+                summaries += [json.loads(line) for line in f]
+
+        assert sorted(s['name'] for s in summaries) == ['broken', 'p0', 'p1', 'p2']
+
+        for s in summaries:
+            if s['name'] == 'broken':
+                assert s['error'] is not None and s['file'] is None
+            else:
+                assert s['reached_accuracy']
+                R = load_results(os.path.join(outdir, s['file']))
+                assert R['reached_accuracy']
+
+        # nothing is solved again
+        assert batch.run_batch(specs[:3], outdir, skip_existing=True) == []
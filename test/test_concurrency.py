@@ -0,0 +1,141 @@
+# IMPORTS
+
+import pytrajectory
+import numpy as np
+import subprocess
+import threading
+import logging
+import sys
+import os
+
+from pytrajectory.log import logger, use_logger, package_logger
+from systems import make_pendulum, make_double_integrator
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestConcurrency(object):
+
+    # different transitions of the cart, so the solutions differ
+    targets = [0.0, 0.5, -0.5]
+
+    def make_systems(self):
+        return [make_pendulum(xb=[xb, 0.0, 0.0, 0.0]) for xb in self.targets]
+
+    def solve_parallel(self, systems):
+        errors = []
+
+        def run(S):
+            try:
+                S.solve()
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=run, args=(S,)) for S in systems]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert not errors
+
+    def test_parallel_solves(self):
+        serial = self.make_systems()
+        for S in serial:
+            S.solve()
+
+        # the systems derived from the first one share its symbolic model
+        parallel = [serial[0].derive(xb=[xb, 0.0, 0.0, 0.0]) for xb in self.targets]
+        self.solve_parallel(parallel)
+
+        tt = np.linspace(0.0, 2.0, 21)
+        for S1, S2 in zip(serial, parallel):
+            assert S2.reached_accuracy == S1.reached_accuracy
+            assert S2.nIt == S1.nIt
+            assert np.allclose(S2.eqs.sol, S1.eqs.sol)
+            assert np.allclose([S2.eqs.trajectories.u(t) for t in tt],
+                               [S1.eqs.trajectories.u(t) for t in tt])
+
+    def test_logger_per_system(self):
+        handlers = [ListHandler() for _ in self.targets]
+        loggers = []
+        for i, h in enumerate(handlers):
+            lg = logging.getLogger('pytrajectory.test_concurrency.{}'.format(i))
+            lg.propagate = False
+            lg.setLevel(logging.DEBUG)
+            lg.addHandler(h)
+            loggers.append(lg)
+
+        systems = [make_double_integrator(xb=[xb, 0.0], logger=lg)
+                   for xb, lg in zip(self.targets, loggers)]
+        self.solve_parallel(systems)
+
+        for h in handlers:
+            # every system logs its own solution process, all in the same thread
+            assert any('1st Iteration' in r.getMessage() for r in h.records)
+            assert len(set(r.thread for r in h.records)) == 1
+
+        threads = [h.records[0].thread for h in handlers]
+        assert len(set(threads)) == len(threads)
+
+        for lg, h in zip(loggers, handlers):
+            lg.removeHandler(h)
+
+
+class TestContextLogger(object):
+
+    def test_use_logger(self):
+        h = ListHandler()
+        lg = logging.getLogger('pytrajectory.test_context')
+        lg.propagate = False
+        lg.setLevel(logging.DEBUG)
+        lg.addHandler(h)
+
+        with use_logger(lg):
+            logger.debug('inside')
+
+            # other threads still log to the package logger
+            t = threading.Thread(target=lambda: logger.debug('other thread'))
+            t.start()
+            t.join()
+
+        logger.debug('outside')
+
+        assert [r.getMessage() for r in h.records] == ['inside']
+        assert logger.name == package_logger.name
+
+        lg.removeHandler(h)
+
+    def test_no_configuration(self):
+        # the records go to the handlers of the application
+        # (the package itself only adds a console handler on request)
+        code = ("import logging\n"
+                "records = []\n"
+                "class Handler(logging.Handler):\n"
+                "    def emit(self, record):\n"
+                "        records.append(record.getMessage())\n"
+                "logging.getLogger().addHandler(Handler())\n"
+                "logging.getLogger().setLevel(logging.INFO)\n"
+                "from pytrajectory.log import logger, package_logger, enable_console\n"
+                "print([type(h).__name__ for h in package_logger.handlers])\n"
+                "logger.info('message')\n"
+                "enable_console(logging.WARNING)\n"
+                "enable_console(logging.WARNING)\n"
+                "logger.info('silenced')\n"
+                "print(len(package_logger.handlers))\n"
+                "print(records)\n")
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(pytrajectory.__file__)),
+                                             env.get('PYTHONPATH', '')])
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+
+        assert out.splitlines() == ["['NullHandler']", "2", "['message']"]
@@ -0,0 +1,139 @@
+# IMPORTS
+
+import pytrajectory
+import pytest
+import sympy as sp
+import numpy as np
+import subprocess
+import sys
+import os
+
+from pytrajectory.results import load_results
+
+
+def double_integrator(x, u):
+    x1, x2 = x
+    u1, = u
+    return [x2, u1]
+
+
+class TestResults(object):
+
+    @pytest.fixture
+    def fname(self, tmpdir):
+        return os.path.join(str(tmpdir), 'result.npz')
+
+    def test_save_and_load(self, fname):
+        S = pytrajectory.ControlSystem(double_integrator, 0.0, 2.0, xa=[0.0, 0.0], xb=[1.0, 0.0],
+                                       ua=[0.0], ub=[0.0])
+        S.solve()
+        S.save_results(fname)
+
+        R = load_results(fname)
+
+        # the arrays are not read but memory mapped
+        assert isinstance(R['sim_x'], np.memmap)
+        assert np.array_equal(R['sim_x'], S.sim_data[1])
+        assert np.array_equal(R['xb'], [1.0, 0.0])
+
+        assert bool(R['reached_accuracy']) == S.reached_accuracy
+        assert R.parameters['traj']['use_chains'] is True
+
+        # both states and the input are represented by the spline of the chain x1 -> x2 -> u1
+        assert list(R['spline_tags']) == ['x1']
+        assert np.array_equal(R['var_order'], [0, 1, 2])
+        assert np.array_equal(R.coeffs['x1'], S.eqs.trajectories.splines['x1']._coeffs.astype(float))
+
+        # reading into memory works, too
+        R = load_results(fname, mmap_mode=None)
+        assert not isinstance(R['sim_x'], np.memmap)
+        assert np.array_equal(R['sim_x'], S.sim_data[1])
+
+    def test_constraints(self, fname):
+        con = {1 : [-0.1, 0.65]}
+        S = pytrajectory.ControlSystem(double_integrator, 0.0, 2.0, xa=[0.0, 0.0], xb=[1.0, 0.0],
+                                       constraints=con, use_chains=False)
+        S.solve()
+        S.save_results(fname)
+
+        R = load_results(fname)
+
+        assert np.isnan(R['var_limits'][0]).all()
+        assert np.allclose(R['var_limits'][1], con[1])
+        assert np.isnan(R['ua']).all()
+
+
+class TestTrajectoryEvaluator(object):
+
+    def check(self, S, E, tt):
+        traj = S.eqs.trajectories
+
+        assert np.allclose(E.x(tt), [traj.x(t) for t in tt])
+        assert np.allclose(E.dx(tt), [traj.dx(t) for t in tt])
+        assert np.allclose(E.u(tt), [traj.u(t) for t in tt])
+
+        # scalar arguments
+        assert np.allclose(E.x(tt[3]), traj.x(tt[3]))
+
+    @pytest.mark.parametrize('use_std_approach', [True, False])
+    def test_evaluator(self, tmpdir, use_std_approach):
+        def f(x, u):
+            x1, x2, x3, x4 = x
+            u1, = u
+            return [x2, u1, x4, 2.0*(9.81*sp.sin(x3) + u1*sp.cos(x3))]
+
+        S = pytrajectory.ControlSystem(f, 0.0, 2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0],
+                                       ua=[0.0], ub=[0.0], use_std_approach=use_std_approach, kx=5)
+        S.solve()
+
+        tt = np.linspace(0.0, 2.0, 57)
+        fname = os.path.join(str(tmpdir), 'evaluator.npz')
+
+        self.check(S, S.export_evaluator(fname), tt)
+        self.check(S, pytrajectory.results.TrajectoryEvaluator.load(fname), tt)
+
+    def test_constraints(self, tmpdir):
+        S = pytrajectory.ControlSystem(double_integrator, 0.0, 2.0, xa=[0.0, 0.0], xb=[1.0, 0.0],
+                                       constraints={1 : [-0.1, 0.65]}, use_chains=False)
+        S.solve()
+
+        fname = os.path.join(str(tmpdir), 'result.npz')
+        S.save_results(fname)
+
+        E = pytrajectory.results.TrajectoryEvaluator(load_results(fname))
+        self.check(S, E, np.linspace(0.0, 2.0, 33))
+
+    def test_affine_chains(self, tmpdir):
+        def f(x, u):
+            x1, x2, x3, x4 = x
+            u1, = u
+            return [0.5*x2 + 0.1, u1, 2.0*x4, 9.81*sp.sin(x3) + u1*sp.cos(x3)]
+
+        S = pytrajectory.ControlSystem(f, 0.0, 2.0, xa=[0.0, -0.2, np.pi, 0.0], xb=[0.0, -0.2, 0.0, 0.0],
+                                       ua=[0.0], ub=[0.0])
+        S.solve()
+
+        fname = os.path.join(str(tmpdir), 'result.npz')
+        S.save_results(fname)
+
+        R = load_results(fname)
+        assert np.allclose(R['var_affine'][1], [2.0, -0.2])
+
+        self.check(S, pytrajectory.results.TrajectoryEvaluator(R), np.linspace(0.0, 2.0, 33))
+
+
+class TestNumpyOnly(object):
+
+    def test_import(self):
+        # the loader and the evaluator don't need the symbolic part of the package
+        code = ("import sys\n"
+                "import pytrajectory.results\n"
+                "from pytrajectory.results import load_results, TrajectoryEvaluator\n"
+                "print(' '.join(m for m in ('sympy', 'scipy', 'matplotlib') if m in sys.modules))\n")
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(pytrajectory.__file__)),
+                                             env.get('PYTHONPATH', '')])
+        out = subprocess.check_output([sys.executable, '-c', code], env=env)
+
+        assert out.strip() == ''
@@ -0,0 +1,100 @@
+# IMPORTS
+
+import pytrajectory
+import pytest
+import numpy as np
+import copy
+
+from pytrajectory.splines import Spline
+
+
+class TestDependenceOperator(object):
+
+    boundary_values = [{0 : (0.0, 1.0)},
+                       {0 : (0.0, 1.0), 1 : (0.0, 0.0)},
+                       {0 : (0.0, 1.0), 1 : (0.0, 0.0), 2 : (1.0, 0.0)}]
+
+    def make_splines(self, bv, use_std_approach):
+        S_dense = Spline(a=0.0, b=2.0, n=7, bv=dict(bv), use_std_approach=use_std_approach)
+        S_dense.make_steady()
+
+        S_op = Spline(a=0.0, b=2.0, n=7, bv=dict(bv), use_std_approach=use_std_approach,
+                      use_dep_operator=True)
+        S_op.make_steady()
+
+        return S_dense, S_op
+
+    @pytest.mark.parametrize('use_std_approach', [True, False])
+    def test_dependence_vectors(self, use_std_approach):
+        tt = np.linspace(0.0, 2.0, 15)
+
+        for bv in self.boundary_values:
+            S_dense, S_op = self.make_splines(bv, use_std_approach)
+
+            assert S_op._dep_array is None
+
+            for d in xrange(4):
+                dep_dense, dep_abs_dense = S_dense.get_dependence_vectors(tt, d)
+                dep_op, dep_abs_op = S_op.get_dependence_vectors(tt, d)
+
+                assert dep_dense.shape == (tt.size, S_dense._indep_coeffs.size)
+                assert np.allclose(dep_dense, dep_op)
+                assert np.allclose(dep_abs_dense, dep_abs_op)
+
+                # scalar evaluation yields the rows of the vectorized one
+                dep, dep_abs = S_op.get_dependence_vectors(tt[3], d)
+                assert np.allclose(dep, dep_op[3])
+                assert np.allclose(dep_abs, dep_abs_op[3])
+
+    def test_set_coefficients(self):
+        tt = np.linspace(0.0, 2.0, 15)
+
+        for bv in self.boundary_values:
+            S_dense, S_op = self.make_splines(bv, True)
+
+            # the operator has to survive copying (see `Trajectory.init_splines`)
+            S_op = copy.deepcopy(S_op)
+
+            c = np.linspace(-1.0, 1.0, S_dense._indep_coeffs.size)
+            S_dense.set_coefficients(free_coeffs=c)
+            S_op.set_coefficients(free_coeffs=c)
+
+            assert np.allclose([S_dense.f(t) for t in tt], [S_op.f(t) for t in tt])
+            assert np.allclose([S_dense.ddf(t) for t in tt], [S_op.ddf(t) for t in tt])
+
+
+class TestVectorizedEvaluation(object):
+
+    @pytest.mark.parametrize('use_std_approach', [True, False])
+    def test_eval(self, use_std_approach):
+        S = Spline(a=0.0, b=2.0, n=7, bv={0 : (0.0, 1.0)}, use_std_approach=use_std_approach)
+        S.make_steady()
+        S.set_coefficients(free_coeffs=np.linspace(-1.0, 1.0, S._indep_coeffs.size))
+
+        tt = np.linspace(0.0, 2.0, 31)
+
+        for fnc in (S.f, S.df, S.ddf, S.dddf):
+            values = fnc(tt)
+            assert values.shape == tt.shape
+            assert np.allclose(values, [fnc(t) for t in tt])
+
+
+class TestInterpolation(object):
+
+    @pytest.mark.parametrize('use_std_approach', [True, False])
+    def test_cubic_polynomial(self, use_std_approach):
+        p = lambda t: 0.5*t**3 - t**2 + 0.3*t - 1.0
+        dp = lambda t: 1.5*t**2 - 2.0*t + 0.3
+
+        # a function that only accepts scalars is evaluated point by point
+        def p_scalar(t):
+            return p(float(t))
+
+        tt = np.linspace(0.0, 2.0, 31)
+        for fnc in (p, p_scalar):
+            S = Spline(a=0.0, b=2.0, n=5, bv={0 : (p(0.0), p(2.0))}, use_std_approach=use_std_approach)
+            S.make_steady()
+            S.set_coefficients(free_coeffs=S.interpolate(fnc, m0=dp(0.0), mn=dp(2.0)))
+
+            # the polynomial is reproduced exactly
+            assert np.allclose(S.f(tt), p(tt))
@@ -0,0 +1,814 @@
+# IMPORTS
+
+import pytrajectory
+import pytest
+import sympy as sp
+import numpy as np
+import time
+import threading
+import os
+
+from multiprocessing.pool import ThreadPool
+from pytrajectory.system import SymbolicModel, MassMatrixModel, NumericModel
+from pytrajectory.solver import Solver, _normalized
+from pytrajectory.log import MemoryMonitor, tracemalloc
+from systems import pendulum, make_pendulum, make_double_integrator, make_counting_vectorfield
+
+
+class TestSymbolicModel(object):
+
+    def test_dimensions_and_expression(self):
+        f, calls = make_counting_vectorfield()
+        model = SymbolicModel(f, n_states=4)
+
+        assert (model.n_states, model.n_inputs) == (4, 1)
+        assert model.inputs == ('u1',)
+        assert model.f[1] == sp.Symbol('u1')
+
+        chains, eqind = model.chains
+        assert sorted(str(c) for c in chains) == ['x1 -> x2 -> u1', 'x3 -> x4']
+        assert eqind == [3]
+
+        rows, cols = model.Df_pattern
+        assert len(rows) == len(cols) == 5
+        assert model.Df is model.Df
+
+    def test_vectorfield_evaluated_once(self):
+        f, calls = make_counting_vectorfield()
+
+        # the failing calls while probing the input dimension
+        # don't get to the construction of the expression
+        S = pytrajectory.ControlSystem(f, 0.0, 2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0],
+                                       ua=[0.0], ub=[0.0])
+
+        assert len(calls) == 1
+        assert S.eqs._Df is S.dyn_sys.model.Df
+
+    def test_variables_outside_of_chains(self):
+        def f(x, u):
+            x1, x2, x3, x4 = x
+            u1, = u
+            return [x2 + 0.01*x1, u1, x4, 2.0*(9.81*sp.sin(x3) + u1*sp.cos(x3))]
+
+        chains, eqind = SymbolicModel(f, n_states=4).chains
+
+        # the equation of x1 is not part of any chain and has to be solved, too
+        assert sorted(str(c) for c in chains) == ['x2 -> u1', 'x3 -> x4']
+        assert eqind == [0, 3]
+
+
+    def test_affine_chains(self):
+        def f(x, u):
+            x1, x2, x3, x4 = x
+            u1, = u
+            return [0.5*x2 + 0.1, u1, 2.0*x4, 9.81*sp.sin(x3) + u1*sp.cos(x3)]
+
+        chains, eqind = SymbolicModel(f, n_states=4).chains
+        chains = dict((str(c), c) for c in chains)
+
+        assert sorted(chains.keys()) == ['x1 -> x2 -> u1', 'x3 -> x4']
+        assert eqind == [3]
+
+        # x2 = 2*dx1/dt - 0.2 and u1 = dx2/dt
+        assert np.allclose(chains['x1 -> x2 -> u1'].transforms, [(1.0, 0.0), (2.0, -0.2), (2.0, 0.0)])
+        assert np.allclose(chains['x3 -> x4'].transforms, [(1.0, 0.0), (0.5, 0.0)])
+
+        # the same relations are found numerically
+        def F(X, U):
+            x1, x2, x3, x4 = X
+            u1, = U
+            return [0.5*x2 + 0.1, u1, 2.0*x4, 9.81*np.sin(x3) + u1*np.cos(x3)]
+
+        numeric_chains = dict((str(c), c) for c in NumericModel(F, n_states=4, sparsity='detect').chains[0])
+        assert sorted(numeric_chains.keys()) == sorted(chains.keys())
+        for key, c in chains.items():
+            assert np.allclose(numeric_chains[key].transforms, c.transforms)
+
+    def test_replaced_relation(self):
+        # `x2` is the derivative of `x3` (the affine relation to `x1` is dropped)
+        def f(x, u):
+            x1, x2, x3 = x
+            u1, = u
+            return [2*x2, u1, x2]
+
+        def F(X, U):
+            x1, x2, x3 = X
+            u1, = U
+            return [2*x2, u1, x2]
+
+        models = [SymbolicModel(f, n_states=3),
+                  NumericModel(F, n_states=3, n_inputs=1, sparsity='detect')]
+
+        for model in models:
+            chains, eqind = model.chains
+
+            assert [str(c) for c in chains] == ['x3 -> x2 -> u1']
+            assert np.allclose(chains[0].transforms, [(1.0, 0.0), (1.0, 0.0), (1.0, 0.0)])
+            assert eqind == [0]
+
+
+class TestConstraints(object):
+
+    def test_chains_are_kept(self):
+        con = {0 : [-0.8, 0.3], 1 : [-2.0, 2.0]}
+        S = make_pendulum(b=3.0, constraints=con)
+
+        # only the chain that contains the constrained variables is lost
+        assert S.eqs.trajectories._parameters['use_chains']
+        assert [str(c) for c in S.eqs.trajectories._chains] == ['x3 -> x4']
+        assert S.eqs.trajectories._eqind == [0, 1, 3]
+
+    def test_saturation_functions(self):
+        y0, y1 = -0.8, 0.3
+        y = sp.Symbol('y')
+        psi, dpsi = pytrajectory.auxiliary.saturation_expressions(y, y0, y1)
+
+        assert sp.simplify(psi.diff(y) - dpsi) == 0
+
+        tt = np.linspace(0.0, 1.0, 11)
+        psi_y, dpsi_dy = pytrajectory.auxiliary.saturation_functions(np.sin, np.cos, y0, y1)
+
+        # the compositions can be evaluated for arrays
+        values = psi_y(tt)
+        assert values.shape == tt.shape
+        assert np.all((y0 < values) & (values < y1))
+        assert np.allclose(dpsi_dy(tt), np.cos(tt) * sp.lambdify(y, dpsi, 'numpy')(np.sin(tt)))
+
+
+class TestMultistart(object):
+
+    def test_array_first_guess(self):
+        S = make_double_integrator()
+        S.solve()
+        assert S.nIt == 1
+
+        S2 = make_double_integrator(first_guess=S.eqs.sol)
+        S2.solve()
+        assert np.array_equal(S2.eqs.guess, S.eqs.sol)
+        assert np.allclose(S2.eqs.sol, S.eqs.sol)
+
+    def test_solve_multistart(self):
+        S = make_double_integrator()
+
+        # the first candidate fails, the others are never started
+        candidates = [{'unknown' : 1}, {'perturbation' : 0.3, 'sx' : 4}, {}, {}]
+        S.solve_multistart(candidates, seed=0, n_workers=1)
+
+        assert [r['index'] for r in S.multistart_results] == [0, 1]
+        assert S.multistart_results[0]['error'] is not None
+        assert S.reached_accuracy
+        assert S.eqs.trajectories.n_parts_x == 4
+        assert np.allclose(S.sim_data[1][-1], [1.0, 0.0], atol=1e-2)
+
+    def test_timeout(self):
+        S = make_double_integrator()
+
+        # the timeout is the total time for all candidates
+        start = time.time()
+        with pytest.raises(RuntimeError):
+            S.solve_multistart(4, seed=0, n_workers=1, timeout=0.0)
+        assert time.time() - start < 1.0
+
+    def test_crashed_worker(self):
+        S = make_double_integrator()
+        solve_candidate = S._solve_candidate
+
+        # the first worker dies without reporting a result
+        def crashing_candidate(index, candidate, queue):
+            if index == 0:
+                os._exit(9)
+            solve_candidate(index, candidate, queue)
+
+        S._solve_candidate = crashing_candidate
+
+        S.solve_multistart([{}, {}], n_workers=1)
+        assert [r['index'] for r in S.multistart_results] == [0, 1]
+        assert S.multistart_results[0]['error'] == "worker exited with code 9"
+        assert S.reached_accuracy
+
+        with pytest.raises(RuntimeError):
+            S.solve_multistart([{}], n_workers=1)
+
+
+class TestTimeLimits(object):
+
+    def test_solver(self):
+        def F(x):
+            time.sleep(0.01)
+            return np.array([x[0]**2 - 2.0, x[0]*x[1] - 1.0])
+
+        def DF(x):
+            return np.array([[2.0*x[0], 0.0], [x[1], x[0]]])
+
+        x0 = np.array([10.0, 10.0])
+        solver = Solver(F, DF, x0, tol=1e-12, time_limit=0.05)
+        sol = solver.solve()
+
+        # the solver stops early but doesn't get worse than the start value
+        assert solver.timed_out
+        assert 0 < solver.nIt < 100
+        assert np.linalg.norm(F(sol)) < np.linalg.norm(F(x0))
+
+    def test_best_solution_so_far(self):
+        S = make_double_integrator(time_limit=0.0)
+        S.solve()
+
+        # the time is up after setting up the first iteration
+        # but we get its solution and error metrics anyway
+        assert S.stats['timed_out']
+        assert S.stats['nIt'] == len(S.stats['iterations']) == 1
+        assert S.stats['iterations'][0]['sol_steps'] == 0
+        assert S.stats['boundary_error'] == S.boundary_error
+        assert np.array_equal(S.eqs.sol, S.eqs.guess)
+
+
+class TestProgress(object):
+
+    def test_events(self):
+        S = make_double_integrator()
+
+        events = []
+        S.add_listener(lambda event, data: events.append((event, data)))
+        S.solve()
+
+        names = [e for e, d in events]
+        assert names[0] == 'iteration' and names[-1] == 'finished'
+        assert names[-3:-1] == ['simulation', 'accuracy_reached']
+        assert names.count('sol_step') == S.stats['iterations'][0]['sol_steps']
+        assert events[0][1]['n_parts_x'] == S.eqs.trajectories.n_parts_x
+
+        # the residual decreases
+        residuals = [d['residual'] for e, d in events if e == 'sol_step']
+        assert np.all(np.diff(residuals) < 0)
+
+    def test_cancel(self):
+        S = make_double_integrator(sol_steps=50, tol=1e-12)
+
+        def listener(event, data):
+            if event == 'sol_step' and data['step'] == 1:
+                S.cancel()
+
+        S.add_listener(listener)
+        S.solve()
+
+        # we get the solution after the first step of the solver
+        assert S.stats['cancelled']
+        assert S.stats['nIt'] == 1
+        assert S.stats['iterations'][0]['sol_steps'] == 1
+
+        # the flag is reset for the next run
+        S.remove_listener(listener)
+        S.solve()
+        assert not S.stats['cancelled']
+
+        # and cancelling an idle system has no effect
+        S.cancel()
+        S.solve()
+        assert not S.stats['cancelled']
+
+    def test_cancel_async(self):
+        S = make_double_integrator(sol_steps=50, tol=1e-12)
+
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def listener(event, data):
+            if event == 'sol_step' and data['step'] == 1:
+                started.set()
+                proceed.wait(10.0)
+
+        S.add_listener(listener)
+
+        class Executor(object):
+            # (like the executors of concurrent.futures)
+            def __init__(self):
+                self.pool = ThreadPool(1)
+
+            def submit(self, fn):
+                return self.pool.apply_async(fn)
+
+        executor = Executor()
+        future = S.solve_async(executor)
+
+        assert started.wait(10.0)
+        S.cancel()
+        proceed.set()
+        future.get(10.0)
+
+        assert S.stats['cancelled']
+        assert S.stats['nIt'] == 1
+        assert S.stats['iterations'][0]['sol_steps'] == 1
+
+        executor.pool.close()
+        executor.pool.join()
+
+
+class TestDerive(object):
+
+    def test_shared_model(self):
+        f, calls = make_counting_vectorfield()
+        S = pytrajectory.ControlSystem(f, 0.0, 2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0],
+                                       ua=[0.0], ub=[0.0], kx=5)
+
+        S2 = S.derive(b=3.0, xb=[0.5, 0.0, 0.0, 0.0], eps=5e-2)
+
+        # the vector field is analysed only once
+        assert len(calls) == 1
+        assert S2.dyn_sys.model is S.dyn_sys.model
+        assert S2.eqs._Df_vectorized is S.eqs._Df_vectorized
+
+        assert S2.b == 3.0 and S2.a == 0.0
+        assert S2.dyn_sys.boundary_values['x1'] == (0.0, 0.5)
+        assert S2._parameters['eps'] == 5e-2
+        assert S2.eqs.trajectories._parameters['kx'] == 5
+
+    def test_constraints(self):
+        con = {0 : [-0.1, 1.5]}
+        S = make_double_integrator(constraints=con, use_chains=False)
+        S2 = S.derive(xb=[1.2, 0.0])
+        S3 = S.derive(constraints={0 : [-0.2, 1.5]})
+
+        # the transformed vector field is shared, too
+        assert S2._dyn_sys_orig.model is S._dyn_sys_orig.model
+        assert S2.dyn_sys.model is S.dyn_sys.model
+        assert S3.dyn_sys.model is not S.dyn_sys.model
+
+        S2.solve()
+        assert S2.reached_accuracy
+        assert np.allclose(S2.sim_data[1][-1], [1.2, 0.0], atol=1e-2)
+
+
+class TestSimulationPolicy(object):
+
+    def test_estimate(self):
+        S = make_pendulum(kx=3)
+        S.solve()
+
+        S2 = make_pendulum(kx=3, sim_policy='estimate')
+        S2.solve()
+
+        # the coarse iterations don't need a simulation
+        simulated = [it['simulated'] for it in S2.stats['iterations']]
+        assert simulated[0] is False and simulated[-1] is True
+
+        # but they don't change anything
+        assert S2.reached_accuracy and S2.nIt == S.nIt
+        assert np.allclose(S2.sim_data[1], S.sim_data[1])
+        assert [it['consistency_error'] for it in S2.stats['iterations']] == \
+               [it['consistency_error'] for it in S.stats['iterations']]
+
+
+class TestMemoryTracking(object):
+
+    def test_monitor(self):
+        with MemoryMonitor(method='rss') as monitor:
+            a = np.ones(5 * 10**6)
+
+        assert monitor.peak - monitor.start > a.nbytes / 2
+
+        # the allocations are only known to tracemalloc
+        assert monitor.method == 'rss'
+        assert monitor.top == []
+
+    @pytest.mark.skipif(tracemalloc is not None, reason="tracemalloc is available")
+    def test_without_tracemalloc(self):
+        # (python 2) the resident set size is sampled instead
+        with MemoryMonitor(method='tracemalloc') as monitor:
+            a = np.ones(5 * 10**6)
+
+        assert monitor.method == 'rss'
+        assert monitor.top == []
+
+    @pytest.mark.skipif(tracemalloc is None, reason="tracemalloc is not available")
+    def test_tracemalloc(self):
+        with MemoryMonitor(method='tracemalloc', n_top=3) as monitor:
+            a = np.ones(5 * 10**6)
+
+        assert monitor.method == 'tracemalloc'
+        assert monitor.peak - monitor.start > a.nbytes / 2
+        assert 0 < len(monitor.top) <= 3
+
+    def test_phases(self):
+        S = make_double_integrator(memory_tracking='rss')
+        S.solve()
+
+        memory = S.stats['iterations'][0]['memory']
+        assert set(memory) == {'init_splines', 'guess', 'build', 'build/dependence_matrices',
+                               'build/jacobian_structure', 'solve', 'simulation'}
+        assert all(m['peak'] >= m['start'] for m in memory.values())
+        assert S.stats['memory_peak'] == max(m['peak'] for m in memory.values())
+
+
+class TestMassMatrix(object):
+
+    l = 0.5
+
+    def explicit(self, x, u):
+        x1, x2, x3, x4 = x
+        u1, = u
+        return [x2, u1, x4, (9.81*sp.sin(x3) + u1*sp.cos(x3)) / self.l]
+
+    def rhs(self, x, u):
+        x1, x2, x3, x4 = x
+        u1, = u
+        return [x2, u1, x4, (9.81*sp.sin(x3) + u1*sp.cos(x3)) * (2 + sp.cos(x3))]
+
+    def mass_matrix(self, x):
+        x1, x2, x3, x4 = x
+        return sp.diag(1, 1, 1, self.l * (2 + sp.cos(x3)))
+
+    def test_model(self):
+        model = MassMatrixModel(self.rhs, self.mass_matrix, n_states=4)
+        reference = SymbolicModel(self.explicit, n_states=4)
+
+        # the explicit equations still form integrator chains
+        assert [str(c) for c in model.chains[0]] == [str(c) for c in reference.chains[0]]
+        assert model.chains[1] == [3]
+
+        for a, b in zip(model.Df_pattern, reference.Df_pattern):
+            assert np.array_equal(a, b)
+
+        X = np.random.rand(4, 7)
+        U = np.random.rand(1, 7)
+
+        for backend in ('lambdify', 'numpy'):
+            ff, Df = model.vectorized_functions(backend)
+            ff_ref, Df_ref = reference.vectorized_functions(backend)
+
+            assert np.allclose(ff(X, U), ff_ref(X, U))
+            assert np.allclose(Df(X, U), Df_ref(X, U))
+
+            f_num = model.numeric_vectorfield(backend)
+            assert np.allclose(f_num(X[:,0], U[:,0]), ff_ref(X, U)[:,0])
+
+    def test_solve(self):
+        S = pytrajectory.ControlSystem(self.rhs, 0.0, 2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0],
+                                       ua=[0.0], ub=[0.0], mass_matrix=self.mass_matrix)
+        assert isinstance(S.dyn_sys.model, MassMatrixModel)
+
+        S.solve()
+        assert S.reached_accuracy
+
+    def test_invalid(self):
+        # the derivative of the explicitly given `x3` appears in the implicit equation
+        def mass_matrix(x):
+            M = sp.eye(4)
+            M[3,2] = x[0]
+            return M
+
+        with pytest.raises(ValueError):
+            MassMatrixModel(self.rhs, mass_matrix, n_states=4)
+
+        with pytest.raises(NotImplementedError):
+            pytrajectory.ControlSystem(self.rhs, 0.0, 2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0],
+                                       mass_matrix=self.mass_matrix, constraints={0 : [-1.0, 1.0]})
+
+
+class TestNumericModel(object):
+
+    def numeric(self, X, U):
+        x1, x2, x3, x4 = X
+        u1, = U
+        return [x2, u1, x4, 2.0*(9.81*np.sin(x3) + u1*np.cos(x3))]
+
+    @pytest.mark.parametrize('fd_method', ['forward', 'central', 'complex_step'])
+    def test_model(self, fd_method):
+        model = NumericModel(self.numeric, n_states=4, fd_method=fd_method, sparsity='detect')
+        reference = SymbolicModel(pendulum, n_states=4)
+
+        assert model.n_inputs == 1
+
+        # chains and the structure of the jacobian are found numerically
+        assert sorted(str(c) for c in model.chains[0]) == sorted(str(c) for c in reference.chains[0])
+        assert model.chains[1] == reference.chains[1]
+
+        for a, b in zip(model.Df_pattern, reference.Df_pattern):
+            assert np.array_equal(a, b)
+
+        X = np.random.rand(4, 7)
+        U = np.random.rand(1, 7)
+
+        ff, Df = model.vectorized_functions()
+        ff_ref, Df_ref = reference.vectorized_functions()
+
+        assert np.allclose(ff(X, U), ff_ref(X, U))
+        assert np.allclose(Df(X, U), Df_ref(X, U), rtol=1e-5, atol=1e-7)
+
+        if fd_method == 'complex_step':
+            assert np.allclose(Df(X, U), Df_ref(X, U), rtol=1e-14, atol=0)
+
+        assert np.allclose(model.numeric_vectorfield()(X[:,0], U[:,0]), ff_ref(X, U)[:,0])
+
+    def test_sparsity(self):
+        reference = SymbolicModel(pendulum, n_states=4)
+        pattern = np.zeros((4, 5))
+        pattern[reference.Df_pattern] = 1
+
+        # dense by default, so there are no chains
+        model = NumericModel(self.numeric, n_states=4)
+        assert model.Df_pattern[0].size == 4 * 5
+        assert model.chains == ([], range(4))
+
+        model = NumericModel(self.numeric, n_states=4, sparsity=pattern)
+        assert sorted(str(c) for c in model.chains[0]) == sorted(str(c) for c in reference.chains[0])
+        for a, b in zip(model.Df_pattern, reference.Df_pattern):
+            assert np.array_equal(a, b)
+
+        with pytest.raises(ValueError):
+            NumericModel(self.numeric, n_states=4, sparsity=pattern[:3])
+
+        with pytest.raises(ValueError):
+            NumericModel(self.numeric, n_states=4, sparsity='sparse')
+
+    def test_outside_of_samples(self):
+        # the vector field depends on `x1` only outside of [-1, 1]
+        # and `dx3/dt = u1` only holds inside of it
+        table = np.linspace(2.0, 10.0, 9)
+
+        def f(X, U):
+            x1, x2, x3 = X
+            u1, = U
+            return [x2, np.interp(x1, table, table**2), np.clip(u1, -1.0, 1.0)]
+
+        model = NumericModel(f, n_states=3)
+        rows, cols = model.Df_pattern
+        assert np.any((rows == 1) & (cols == 0))
+
+        # the relations are checked throughout the sample box
+        pattern = [[0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]]
+        model = NumericModel(f, n_states=3, sparsity=pattern, sample_box=([-5.0] * 4, [5.0] * 4))
+        assert [str(c) for c in model.chains[0]] == ['x1 -> x2']
+        assert model.chains[1] == [1, 2]
+
+        # the detected structure is only as good as the sample box
+        model = NumericModel(f, n_states=3, sparsity='detect')
+        assert not np.any((model.Df_pattern[0] == 1) & (model.Df_pattern[1] == 0))
+
+        model = NumericModel(f, n_states=3, sparsity='detect', sample_box=([2.0] * 4, [10.0] * 4))
+        assert np.any((model.Df_pattern[0] == 1) & (model.Df_pattern[1] == 0))
+
+    def test_solve(self):
+        kwargs = dict(a=0.0, b=2.0, xa=[0.0, 0.0, np.pi, 0.0], xb=[0.0, 0.0, 0.0, 0.0],
+                      ua=[0.0], ub=[0.0])
+
+        S = pytrajectory.ControlSystem(self.numeric, numeric=True, **kwargs)
+        assert isinstance(S.dyn_sys.model, NumericModel)
+
+        S.solve()
+        assert S.reached_accuracy
+
+        with pytest.raises(NotImplementedError):
+            pytrajectory.ControlSystem(self.numeric, numeric=True, constraints={1: [-1.0, 1.0]},
+                                       **kwargs)
+
+
+class TestColoredJacobian(object):
+
+    @pytest.mark.parametrize('use_chains', [True, False])
+    def test_jacobian(self, use_chains):
+        C = []
+        for jacobian in ('vectorfield', 'colored_fd'):
+            S = make_pendulum(jacobian=jacobian, use_chains=use_chains)
+            S.eqs.trajectories.init_splines()
+            S.eqs.get_guess()
+            C.append(S.eqs.build())
+
+        c = np.random.rand(C[0].guess.size)
+        DG_ref = C[0].DG(c).toarray()
+        DG = C[1].DG(c)
+
+        assert DG.nnz <= C[0].DG(c).nnz
+        assert np.allclose(DG.toarray(), DG_ref, rtol=1e-5, atol=1e-5)
+
+    def test_solve(self):
+        S = make_pendulum(jacobian='colored_fd')
+        assert S.eqs._Df_vectorized is None
+
+        S.solve()
+        assert S.reached_accuracy
+
+        # the vector field isn't differentiated symbolically
+        assert S.eqs._Df is None
+        assert not any(key in S.dyn_sys.model._cache for key in ('Df', 'Df_pattern'))
+        assert np.array_equal(S.dyn_sys.model.dependency_pattern[0], S.dyn_sys.model.Df_pattern[0])
+        assert np.array_equal(S.dyn_sys.model.dependency_pattern[1], S.dyn_sys.model.Df_pattern[1])
+
+
+class TestScaling(object):
+
+    # badly scaled equations and variables
+    def F(self, x):
+        return np.array([1e3 * (x[0]**2 - 2e-6), 1e-2 * (x[0]*x[1] - 1e2), x[2] - 1.0])
+
+    def DF(self, x):
+        return np.array([[2e3 * x[0], 0.0, 0.0], [1e-2 * x[1], 1e-2 * x[0], 0.0], [0.0, 0.0, 1.0]])
+
+    @pytest.mark.parametrize('x_scale, f_scale', [(None, None), ('jacobian', None), (None, 'jacobian'),
+                                                  (np.array([1e-3, 1e5, 1.0]), None),
+                                                  (None, np.array([1e-3, 1.0, 1.0]))])
+    def test_solver(self, x_scale, f_scale):
+        x0 = np.array([1e-2, 1e3, 0.0])
+        solver = Solver(self.F, self.DF, x0, tol=1e-10, maxIt=500, x_scale=x_scale, f_scale=f_scale)
+        sol = solver.solve()
+
+        assert np.linalg.norm(self.F(sol)) < 1e-3 * np.linalg.norm(self.F(x0))
+
+        # the residual refers to the unscaled equations
+        assert np.isclose(solver.res, np.linalg.norm(self.F(sol)))
+
+    @pytest.mark.parametrize('min_scale', [None, 1e-2])
+    def test_min_scale(self, min_scale):
+        x0 = np.array([1e-2, 1e3, 0.0])
+        solver = Solver(self.F, self.DF, x0, tol=1e-10, maxIt=500, x_scale='jacobian',
+                        f_scale='jacobian', min_scale=min_scale)
+        sol = solver.solve()
+
+        assert np.linalg.norm(self.F(sol)) < 1e-3 * np.linalg.norm(self.F(x0))
+
+        # the relative scales are bounded below (vanishing ones remain unscaled)
+        scales = _normalized(np.array([1e-12, 0.5, 0.0, 2.0]), solver.min_scale)
+        assert np.allclose(scales, [solver.min_scale, 0.25, 0.5, 1.0])
+        assert solver.min_scale == (min_scale or np.sqrt(np.finfo(float).eps))
+
+    def test_solve(self):
+        S = make_double_integrator(x_scale={'x1' : 10.0}, f_scale='jacobian')
+        S.solve()
+        assert S.reached_accuracy
+
+        # the scale applies to the free parameters of the spline of `x1`
+        x_scale, f_scale = S.eqs._solver_scales()
+        indic = S.eqs._get_index_dict()
+        i, j = indic['x1']
+        assert np.all(x_scale[i:j] == 10.0)
+        assert np.sum(x_scale == 10.0) == j - i
+        assert f_scale == 'jacobian'
+
+
+class TestGuessTypes(object):
+
+    def make_system(self, guess_type):
+        # from the initial state the system moves on a straight line without any input
+        return make_double_integrator(xa=[0.0, 1.0], xb=[2.0, 1.0], guess_type=guess_type)
+
+    def first_guess(self, S):
+        S.eqs.trajectories.init_splines()
+        S.eqs.get_guess()
+        S.eqs.trajectories.set_coeffs(S.eqs.guess)
+
+        return S.eqs.trajectories.splines['x1']
+
+    @pytest.mark.parametrize('guess_type', ['linear', 'cubic', 'simulate'])
+    def test_first_guess(self, guess_type):
+        tt = np.linspace(0.0, 2.0, 11)
+        s = self.first_guess(self.make_system(guess_type))
+
+        assert np.allclose(s.f(tt), tt, atol=1e-5)
+        assert np.allclose(s.df(tt), 1.0, atol=1e-4)
+
+    def test_cubic(self):
+        # only the cubic guess respects the velocities at the borders
+        S = make_double_integrator(guess_type='cubic')
+        s = self.first_guess(S)
+
+        assert np.allclose([s.f(0.0), s.f(2.0)], [0.0, 1.0])
+        assert np.allclose([s.df(0.0), s.df(2.0)], [0.0, 0.0])
+
+    def test_unknown(self):
+        S = self.make_system('unknown')
+        assert S.eqs._parameters['guess_type'] == 'constant'
+
+    def test_solve(self):
+        S = make_double_integrator(guess_type='cubic')
+        S.solve()
+        assert S.reached_accuracy
+
+
+class TestCheckpoint(object):
+
+    def test_resume(self, tmpdir):
+        fname = str(tmpdir.join('checkpoint.npz'))
+
+        S_ref = make_pendulum()
+        S_ref.solve()
+        assert S_ref.reached_accuracy and S_ref.nIt > 2
+
+        # the process is stopped after the second iteration
+        S1 = make_pendulum(maxIt=2, checkpoint=fname)
+        S1.solve()
+
+        cp = pytrajectory.results.load_checkpoint(fname)
+        assert cp['nIt'] == 2
+        assert cp['n_parts_x'] == S1.eqs.trajectories.n_parts_x
+        assert np.array_equal(cp['sol'], S1.eqs.sol)
+        assert len(cp['iterations']) == 2
+
+        S2 = make_pendulum(checkpoint=fname)
+        S2.resume(fname)
+
+        assert S2.reached_accuracy
+        assert S2.nIt == S_ref.nIt
+        assert len(S2.stats['iterations']) == S2.nIt
+
+        # the repeated iteration starts from its solution
+        assert S2.stats['iterations'][1]['sol_steps'] <= 2
+        assert np.allclose(S2.eqs.sol, S_ref.eqs.sol, atol=1e-4)
+        assert pytrajectory.results.load_checkpoint(fname)['nIt'] == S2.nIt
+
+    def test_other_problem(self, tmpdir):
+        fname = str(tmpdir.join('checkpoint.npz'))
+        make_pendulum(maxIt=1, checkpoint=fname).solve()
+
+        S = make_pendulum(xb=[1.0, 0.0, 0.0, 0.0])
+        with pytest.raises(ValueError):
+            S.resume(fname)
+
+    def test_files(self, tmpdir):
+        fname = str(tmpdir.join('checkpoint.npz'))
+        S = make_double_integrator(checkpoint=fname)
+
+        # the candidates of a multistart don't write checkpoints
+        S.solve_multistart(2, seed=0, n_workers=1)
+        assert tmpdir.listdir() == []
+
+        # no temporary files are left behind
+        S.solve()
+        assert tmpdir.listdir() == [tmpdir.join('checkpoint.npz')]
+
+        # derived systems only write a checkpoint of their own
+        assert S.derive(xb=[2.0, 0.0])._parameters['checkpoint'] is None
+        assert S.derive(checkpoint=fname + '2')._parameters['checkpoint'] == fname + '2'
+
+
+class TestEarlyAbort(object):
+
+    def simulate(self, ff, start, **kwargs):
+        S = pytrajectory.Simulator(ff, 2.0, start, lambda t: np.zeros(1), **kwargs)
+        t, xt, ut = S.simulate()
+        return S, t, xt
+
+    def test_finished(self):
+        S, t, xt = self.simulate(lambda x, u: -x, [1.0], x_bound=10.0)
+        assert S.status == 'finished'
+        assert np.isclose(t[-1], 2.0)
+
+    def test_bound(self):
+        # the solution x(t) = 1/(1 - t) blows up at t = 1
+        S, t, xt = self.simulate(lambda x, u: x**2, [1.0], x_bound=20.0)
+        assert S.status == 'bound'
+        assert t[-1] < 1.0 and abs(xt[-1, 0]) > 20.0
+        assert np.all(np.isfinite(xt))
+
+        # without a bound it is stopped as soon as the integration fails
+        S, t, xt = self.simulate(lambda x, u: x**2, [1.0])
+        assert S.status in ('nonfinite', 'failed')
+        assert t[-1] < 1.0
+        assert np.all(np.isfinite(xt))
+
+    def test_deviation(self):
+        ref = lambda t: np.array([0.0, np.nan])
+        S, t, xt = self.simulate(lambda x, u: np.ones(2), [0.0, 0.0], reference=ref, max_deviation=0.5)
+        assert S.status == 'deviation'
+        assert 0.5 <= t[-1] <= 0.51
+
+    def test_solve(self):
+        S = make_pendulum(sim_deviation=10.0)
+        S.solve()
+        assert S.reached_accuracy
+        assert S.sim_status == 'finished'
+
+        # the first iterations are far away from a solution
+        it = S.stats['iterations'][0]
+        assert it['sim_status'] == 'deviation'
+        assert it['boundary_error'] == np.inf and not it['reached_accuracy']
+
+
+class TestThreads(object):
+
+    def test_equivalence(self):
+        C = []
+        for n_threads in (1, 4):
+            S = make_pendulum(n_threads=n_threads)
+            S.eqs.trajectories.init_splines()
+            S.eqs.get_guess()
+            C.append(S.eqs.build())
+
+        c = np.random.rand(C[0].guess.size)
+        assert np.allclose(C[1].G(c), C[0].G(c))
+        assert np.allclose(C[1].DG(c).toarray(), C[0].DG(c).toarray())
+
+        S.eqs._close_pool()
+
+    def test_solve(self):
+        n_active = threading.active_count()
+
+        S1 = make_pendulum(n_threads=1)
+        S1.solve()
+        S4 = make_pendulum(n_threads=4)
+        S4.solve()
+
+        assert S4.nIt == S1.nIt
+        assert np.allclose(S4.eqs.sol, S1.eqs.sol)
+
+        # the worker threads are stopped after every run of the solver
+        assert S4.eqs._pool is None
+        assert threading.active_count() == n_active